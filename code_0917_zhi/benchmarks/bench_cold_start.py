@@ -0,0 +1,89 @@
+"""
+worker 冷啟動時間
+
+每一輪都啟動新的 Python 行程，量測：
+- import app 的時間（python -X importtime），並列出累計耗時最多的頂層套件
+- 從行程啟動到第一個請求（GET /）回應完成的時間
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_cold_start.py [--runs 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_RESPONSE = """
+import time
+started = time.perf_counter()
+from app import app
+response = app.test_client().get("/")
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - started)
+"""
+
+
+def run_python(args, env):
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def parse_importtime(stderr):
+    """回傳 (import app 的累計微秒, {頂層套件: 累計微秒})"""
+    total, packages, children = 0, {}, {}
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        cumulative, name = parts[1], parts[2]
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # 標題列
+        # importtime 先列出子模組再列出父模組；縮排一層的是上一個頂層模組直接匯入的模組
+        if name.startswith("   ") and not name.startswith("    "):
+            top = name.strip().split(".")[0]
+            children[top] = children.get(top, 0) + cumulative
+        elif not name.startswith("  "):
+            if name.strip() == "app":
+                total, packages = cumulative, children
+            children = {}
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, "cold.json"))
+
+    import_times, first_responses, process_times = [], [], []
+    packages = {}
+    for _ in range(args.runs):
+        result = run_python(["-X", "importtime", "-c", "import app"], env)
+        total, packages = parse_importtime(result.stderr)
+        import_times.append(total / 1e6)
+
+        started = time.perf_counter()
+        result = run_python(["-c", FIRST_RESPONSE], env)
+        process_times.append(time.perf_counter() - started)
+        first_responses.append(float(result.stdout.strip().splitlines()[-1]))
+
+    print(f"import app（中位數）:            {statistics.median(import_times) * 1000:8.1f} ms")
+    print(f"import 到第一個回應（中位數）:   {statistics.median(first_responses) * 1000:8.1f} ms")
+    print(f"行程啟動到結束（中位數）:        {statistics.median(process_times) * 1000:8.1f} ms")
+    print(f"\n累計耗時最多的套件（最後一輪，前 {args.top} 名）:")
+    for name, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<24}{us / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
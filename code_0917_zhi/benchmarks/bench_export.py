@@ -0,0 +1,109 @@
+"""
+個案資料匯出（/admin/export）的速度與記憶體用量
+
+建立 N 筆合成個案（約六成有訪談、平均每案一筆電話關懷紀錄、兩成有復工紀錄），
+以 domdb.export_cases 串流匯出，量測：
+- 匯出時間與每秒個案數、輸出大小
+- 匯出期間行程常駐記憶體（RSS）比匯出前增加的最大值（每送出一段取樣一次）
+
+--collect 另外量測把全部輸出組成一個 bytes 時的 RSS 增加量作為對照。
+RSS 由 /proc/self/statm 讀取，只支援 Linux。
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_export.py [--cases 100000] [--formats csv jsonl] [--backend json] [--collect]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import domdb  # noqa: E402
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """目前的常駐記憶體（bytes）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def populate(count):
+    rnd = random.Random(0)
+    patients, interviews, followups, returns = [], [], [], []
+    for i in range(count):
+        record_no = f"P{i:08d}"
+        patients.append({
+            "medical_record_no": record_no,
+            "patient_name": "王小明",
+            "birth_date": "1980-01-01",
+            "gender": "1",
+            "id_document_no": f"A{i:09d}",
+            "phone_status": rnd.choice(["已完成", "待完成", "結案"]),
+            "created_at": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T09:00:00",
+        })
+        if rnd.random() < 0.6:
+            interviews.append({"medical_record_no": record_no, "job_title": "技術員",
+                               "injury_date": "2024-01-01", "injury_part": "手部"})
+        for _ in range(rnd.choice([0, 1, 2])):
+            followups.append({"case_id": record_no, "note": "電話關懷",
+                              "occupational_injury_compensation": ["醫療", "失能"]})
+        if rnd.random() < 0.2:
+            returns.append({"case_id": record_no, "status": "已復工", "return_date": "2024-06-01"})
+    with domdb.batch():
+        domdb.patients.insert_multiple(patients)
+        domdb.interviews.insert_multiple(interviews)
+        domdb.phone_followups.insert_multiple(followups)
+        domdb.return_to_work_records.insert_multiple(returns)
+
+
+def run(fmt, count):
+    baseline = peak = current_rss()
+    size = 0
+    started = time.perf_counter()
+    for chunk in domdb.export_cases(fmt):
+        size += len(chunk)
+        peak = max(peak, current_rss())
+    elapsed = time.perf_counter() - started
+    print(f"{fmt:<6}{elapsed:8.2f} s {count / elapsed:10.0f} 筆/s {size / 1e6:9.1f} MB"
+          f"   RSS 增加 {(peak - baseline) / 1e6:7.1f} MB")
+
+
+def run_collected(fmt):
+    baseline = current_rss()
+    data = b"".join(domdb.export_cases(fmt))
+    print(f"{fmt:<6}一次組成全部輸出（{len(data) / 1e6:.1f} MB）  RSS 增加 {(current_rss() - baseline) / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--formats", nargs="+", default=list(domdb.EXPORT_FORMATS),
+                        choices=domdb.EXPORT_FORMATS)
+    parser.add_argument("--backend", default="json", choices=["json", "wal", "tables", "sqlite"])
+    parser.add_argument("--collect", action="store_true", help="另外量測一次組成全部輸出的記憶體用量")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        domdb.registry.configure(os.path.join(workdir, "export.json"), args.backend)
+        started = time.perf_counter()
+        populate(args.cases)
+        print(f"建立 {args.cases} 筆個案: {time.perf_counter() - started:.1f} s（{args.backend}）\n")
+        for fmt in args.formats:
+            run(fmt, args.cases)
+        if args.collect:
+            for fmt in args.formats:
+                run_collected(fmt)
+        domdb.registry.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+JSON 編碼方式的載入 / 寫出時間與檔案大小
+
+以合成的 5 萬筆個案（含訪談與電話關懷紀錄，欄位以中文為主）組成整份資料庫，
+比較 TinyDB 預設（json.dumps，中文跳脫）、標準函式庫精簡輸出與 orjson。
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_json_codec.py [--patients 50000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from domdb_storage import JSONCodec, orjson  # noqa: E402
+
+
+class StdlibCompactCodec(JSONCodec):
+    """未安裝 orjson 時 fast 的實際行為"""
+
+    def __init__(self):
+        super().__init__("fast")
+        self.use_orjson = False
+
+
+def make_database(count):
+    patients, interviews, followups = {}, {}, {}
+    for i in range(count):
+        mrn = f"P{i:08d}"
+        patients[str(i + 1)] = {
+            "medical_record_no": mrn,
+            "patient_name": "王小明",
+            "birth_date": "1980-01-01",
+            "gender": "1",
+            "id_document_no": f"A{i:09d}",
+            "address": "臺北市中正區忠孝西路一段一號",
+            "injury_type": "被夾、壓捲",
+            "industry": "製造業",
+            "created_at": f"2025-{i % 12 + 1:02d}-01T09:00:00",
+        }
+        interviews[str(i + 1)] = {
+            "medical_record_no": mrn,
+            "interview_date": "2025-02-01",
+            "notes": "個案表示傷口恢復良好，持續復健中，預計下個月回診。",
+            "needs": ["經濟補助", "職能復健"],
+        }
+        followups[str(i + 1)] = {
+            "case_id": mrn,
+            "call_date": "2025-03-01",
+            "status": "已完成",
+            "content": "電話關懷，個案情緒穩定。",
+        }
+    return {"patients": patients, "interviews": interviews, "phone_followups": followups}
+
+
+def measure(codec, data, repeat):
+    dump_times, load_times = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        content = codec.dumps(data)
+        dump_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        codec.loads(content)
+        load_times.append(time.perf_counter() - started)
+    return min(dump_times), min(load_times), len(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_database(args.patients)
+    codecs = [("stdlib", JSONCodec("stdlib")), ("compact", StdlibCompactCodec())]
+    if orjson is not None:
+        codecs.append(("orjson", JSONCodec("fast")))
+    else:
+        print("未安裝 orjson，略過 orjson 的量測")
+
+    print(f"{'codec':<10}{'dump':>10}{'load':>10}{'size':>12}")
+    for name, codec in codecs:
+        dump, load, size = measure(codec, data, args.repeat)
+        print(f"{name:<10}{dump * 1000:>8.0f}ms{load * 1000:>8.0f}ms{size / 1024 / 1024:>10.1f}MB")
+    # 確認各方式的輸出可以互相讀取
+    assert json.loads(JSONCodec("fast").dumps(data)) == data
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+多個工作行程同時寫入的吞吐量與正確性
+
+模擬以多個 worker 行程（例如 gunicorn -w N）部署：每個行程各自開啟同一個資料庫，
+同時對 /auto-save-step1 送出新增個案的請求。結束後檢查個案總數，
+確認跨行程寫入沒有遺失。
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_multiworker.py [--workers 1 2 4 8] [--requests 200] [--backends json wal tables sqlite]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def worker(worker_id, count):
+    """在子行程中以 Flask test client 送出 count 筆新增個案"""
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["staff_id"] = "bench"
+    failures = 0
+    for i in range(count):
+        response = client.post("/auto-save-step1", json={
+            "medical_record_no": f"W{worker_id:02d}{i:06d}",
+            "patient_name": "王小明",
+            "birth_date": "1980-01-01",
+        })
+        if not response.get_json().get("success"):
+            failures += 1
+    os._exit(1 if failures else 0)
+
+
+def run(backend, workers, count, workdir):
+    import domdb
+
+    path = os.path.join(workdir, f"{backend}-{workers}.db")
+    domdb.registry.close_all()
+    domdb.registry.configure(path, backend)
+    # 子行程啟動前先建立資料庫，避免計入開檔與種子資料的時間
+    domdb.get_db()
+    domdb.registry.close_all()
+
+    started = time.perf_counter()
+    pids = []
+    for worker_id in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker(worker_id, count)
+        pids.append(pid)
+    failed = sum(1 for pid in pids if os.waitpid(pid, 0)[1] != 0)
+    elapsed = time.perf_counter() - started
+
+    total = len(domdb.get_db().table("patients"))
+    domdb.registry.close_all()
+    return workers * count / elapsed, total, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=200, help="每個行程的請求數")
+    parser.add_argument("--backends", nargs="+", default=["json", "wal", "tables", "sqlite"])
+    args = parser.parse_args()
+
+    # app 以相對路徑讀取 module_status.json，需在專案目錄下執行
+    os.chdir(ROOT)
+    workdir = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(workdir, "seed.json")
+    try:
+        import app  # noqa: F401  預先載入，讓子行程共用已匯入的模組
+
+        print(f"{'backend':<8}{'workers':>8}{'req/s':>10}{'patients':>10}  lost")
+        for backend in args.backends:
+            for workers in args.workers:
+                rate, total, failed = run(backend, workers, args.requests, workdir)
+                lost = workers * args.requests - total
+                print(f"{backend:<8}{workers:>8}{rate:>10.1f}{total:>10}  {lost}"
+                      + (f"（{failed} 個行程有失敗請求）" if failed else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
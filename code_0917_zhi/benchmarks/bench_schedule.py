@@ -0,0 +1,123 @@
+"""
+每月電話關懷排程（patients.phone_due_date）的成本
+
+建立 N 筆合成個案（建檔日分散在一年內、平均每案一筆電話關懷紀錄、約一成結案），量測：
+- 回填全部個案應關懷日的時間
+- 「應關懷日落在某個月」的期間查詢：phone_due_date 排序索引 vs. 讀出全部個案逐筆推算
+- 新增一筆電話關懷紀錄（同時重新計算該個案應關懷日）的平均時間，與不維護排程時比較
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_schedule.py [--cases 50000] [--submits 200] [--backend json]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import domdb  # noqa: E402
+from domdb_schedule import PHONE_DUE_FIELD, due_dates  # noqa: E402
+
+# 查詢的月份：phone_due_date 的 [當月一日, 下個月一日)
+DUE_RANGE = ("2024-07-01", "2024-08-01")
+
+
+def populate(count):
+    rnd = random.Random(0)
+    patients, followups = [], []
+    for i in range(count):
+        record_no = f"P{i:08d}"
+        patients.append({
+            "medical_record_no": record_no,
+            "patient_name": "王小明",
+            "phone_status": "結案" if rnd.random() < 0.1 else rnd.choice(["已完成", "待完成"]),
+            "created_at": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T09:00:00",
+        })
+        for _ in range(rnd.choice([0, 1, 2])):
+            followups.append({"case_id": record_no, "note": "電話關懷",
+                              "created_at": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T10:00:00"})
+    with domdb.batch():
+        domdb.phone_followups.insert_multiple(followups)
+        domdb.patients.insert_multiple(patients)
+
+
+def timed(func, repeat=5):
+    """執行 repeat 次，回傳最短時間（秒）與最後一次的結果"""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def window_by_index():
+    return domdb.page_patients(order="phone_due_date", due_range=DUE_RANGE)
+
+
+def window_by_scan():
+    docs = domdb.patients.all()
+    due = [(d, doc) for d, doc in zip(due_dates(domdb.get_db(), docs), docs) if d and DUE_RANGE[0] <= d < DUE_RANGE[1]]
+    return sorted(due, key=lambda item: item[0])
+
+
+def submit_cost(count, submits, maintain):
+    """新增 submits 筆電話關懷紀錄的平均時間（毫秒）"""
+    rnd = random.Random(1)
+    listeners = domdb.DomTable.change_listeners
+    saved = {name: list(items) for name, items in listeners.items()}
+    if not maintain:
+        for name in ("patients", "phone_followups"):
+            listeners[name] = [listener for listener in listeners.get(name, [])
+                               if getattr(listener, "__self__", None) is not domdb.followup_scheduler]
+    try:
+        started = time.perf_counter()
+        for _ in range(submits):
+            domdb.phone_followups.insert({"case_id": f"P{rnd.randrange(count):08d}", "note": "電話關懷",
+                                          "created_at": "2025-01-15T10:00:00"})
+        return (time.perf_counter() - started) / submits * 1000
+    finally:
+        listeners.clear()
+        listeners.update(saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=50000)
+    parser.add_argument("--submits", type=int, default=200)
+    parser.add_argument("--backend", default="json", choices=["json", "wal", "tables", "sqlite"])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        domdb.registry.configure(os.path.join(workdir, "schedule.json"), args.backend)
+        started = time.perf_counter()
+        populate(args.cases)
+        print(f"建立 {args.cases} 筆個案: {time.perf_counter() - started:.1f} s（{args.backend}）\n")
+
+        domdb.patients.update({PHONE_DUE_FIELD: "-"})
+        started = time.perf_counter()
+        count = domdb.backfill_phone_schedule()
+        print(f"回填應關懷日          {time.perf_counter() - started:8.2f} s  （{count} 筆）")
+
+        indexed, page = timed(window_by_index)
+        scanned, rows = timed(window_by_scan)
+        assert [doc["medical_record_no"] for doc in page.docs] == [doc["medical_record_no"] for _, doc in rows]
+        print(f"{DUE_RANGE[0][:7]} 到期的個案    索引 {indexed * 1000:8.1f} ms   逐筆推算 {scanned * 1000:8.1f} ms"
+              f"   （{len(page.docs)} 筆）")
+
+        without = submit_cost(args.cases, args.submits, maintain=False)
+        with_schedule = submit_cost(args.cases, args.submits, maintain=True)
+        print(f"新增電話關懷紀錄      {with_schedule:8.2f} ms/筆（不維護排程 {without:.2f} ms/筆）")
+        domdb.registry.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+各儲存後端的單筆寫入延遲
+
+在預先放入 N 筆個案（以及與實際資料庫相當的約 1,200 筆參考資料）的資料庫上，
+量測 create_patient 式的單筆 insert 平均耗時，觀察寫入成本是否隨資料庫大小成長。
+
+使用方式（在 code_0917_zhi 目錄下）:
+python benchmarks/bench_write_latency.py [--sizes 1000 5000 20000] [--writes 200]
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from domdb_index import IndexedTable  # noqa: E402
+from domdb_storage import CachedJSONStorage, SQLiteStorage, TableFilesStorage, WALJSONStorage  # noqa: E402
+from tinydb import TinyDB  # noqa: E402
+
+
+class BenchTable(IndexedTable):
+    index_definitions = {"patients": {"medical_record_no": True}}
+
+
+class BenchDB(TinyDB):
+    table_class = BenchTable
+
+
+BACKENDS = {
+    "json": lambda path: BenchDB(path, storage=CachedJSONStorage),
+    "wal": lambda path: BenchDB(path, storage=WALJSONStorage),
+    "tables": lambda path: BenchDB(path, storage=TableFilesStorage, reference_tables=("zipcode",)),
+    "sqlite": lambda path: BenchDB(path + ".sqlite3", storage=SQLiteStorage),
+}
+
+
+REFERENCE_ROWS = 1200
+
+
+def make_patient(i):
+    return {
+        "medical_record_no": f"P{i:08d}",
+        "patient_name": "王小明",
+        "birth_date": "1980-01-01",
+        "gender": "1",
+        "id_document_type": "1",
+        "id_document_no": f"A{i:09d}",
+        "created_at": "2025-01-01T00:00:00",
+    }
+
+
+def run(backend, size, writes, workdir):
+    path = os.path.join(workdir, f"{backend}-{size}.json")
+    db = BACKENDS[backend](path)
+    reference_writes = getattr(db.storage, "reference_writes", contextlib.nullcontext)
+    with reference_writes():
+        db.table("zipcode").insert_multiple(
+            {"city_code": i // 40, "city": "臺北市", "zip": f"{i:03d}", "district": "中正區"}
+            for i in range(REFERENCE_ROWS)
+        )
+    patients = db.table("patients")
+    patients.insert_multiple(make_patient(i) for i in range(size))
+
+    started = time.perf_counter()
+    for i in range(size, size + writes):
+        patients.insert(make_patient(i))
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed / writes * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"{'backend':<8}" + "".join(f"{size:>12}" for size in args.sizes))
+        for backend in BACKENDS:
+            row = [run(backend, size, args.writes, workdir) for size in args.sizes]
+            print(f"{backend:<8}" + "".join(f"{ms:>10.3f}ms" for ms in row))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
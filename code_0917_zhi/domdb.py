@@ -8,52 +8,511 @@ from datetime import datetime
 import bcrypt
 import hashlib
 import os
+import atexit
+import threading
 import logging
 from dotenv import load_dotenv
 import json
-import csv
+import base64
+import math
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+from domdb_storage import CachedJSONStorage, SQLiteStorage, TableFilesStorage, WALJSONStorage, remove_files
+from domdb_index import IndexedTable, project, text_rank
+from domdb_cases import CaseAggregateCache
+from domdb_completion import COMPLETION_BITS, COMPLETION_FIELD, CompletionTracker, count_by
+from domdb_dashboard import DashboardCounters, creation_trend
+from domdb_export import EXPORT_FORMATS, export_stream
+from domdb_schedule import PHONE_DUE_FIELD, FollowupScheduler
+from domdb_status import CASE_STATUS_FIELD, CASE_STATUSES, STATUS_LABELS, doc_status, status_of_mask
 
 # 載入環境變量
 load_dotenv()
 
-TinyDB("domdb.json").close()
 
 
-
-# 設定日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+# 日誌輸出（app.log）由應用程式設定（app.configure_logging），匯入本模組不會建立檔案
 logger = logging.getLogger("domdb")
 
 # === 資料庫初始化 ===
 DB_PATH = os.getenv("DB_PATH", "domdb.json")
+# 儲存後端：json（預設，單一 JSON 檔）、wal（JSON 快照 + 追加式日誌）、
+# tables（每個資料表一個 JSON 檔）或 sqlite
+DB_BACKEND = os.getenv("DB_BACKEND", "json")
+# wal 後端的日誌超過此大小（位元組）就在背景壓實成新快照
+DB_WAL_COMPACT_BYTES = int(os.getenv("DB_WAL_COMPACT_BYTES", 4 * 1024 * 1024))
+# JSON 檔案的編碼方式：fast（預設，orjson / 中文不跳脫）或 stdlib（與 TinyDB 預設相同）
+DB_JSON_CODEC = os.getenv("DB_JSON_CODEC", "fast")
+
+# === 次要索引：{資料表: {欄位: 索引設定}} ===
+# True / False：雜湊索引（是否唯一）；"sorted" / "sorted_unique"：可查範圍與分頁的排序索引；
+# "ngram"：子字串搜尋索引，欄位可為多個欄位的 tuple（也用於其中部分欄位的搜尋）；
+# ("composite", 排序欄位)：多個欄位（tuple）的複合索引，等值查詢的結果已依排序欄位排列，可查範圍與計數
+PATIENT_SEARCH_FIELDS = ("medical_record_no", "patient_name")
+PATIENT_TEXT_FIELDS = PATIENT_SEARCH_FIELDS + ("id_document_no",)
+# 電話關懷狀態 + 應關懷日的複合索引欄位：狀態的等值查詢與計數、待完成清單與月報依應關懷日的走訪
+# 都由這個索引處理，phone_status 不另建雜湊索引
+PHONE_STATUS_FIELDS = ("phone_status",)
+TABLE_INDEXES = {
+    "case_managers": {"staff_id": True, "email": False},
+    "patients": {
+        "medical_record_no": "sorted_unique",
+        "created_at": "sorted",
+        "case_status": False,
+        "completion": False,
+        "phone_due_date": "sorted",
+        PATIENT_TEXT_FIELDS: "ngram",
+        PHONE_STATUS_FIELDS: ("composite", "phone_due_date"),
+    },
+    "interviews": {"medical_record_no": True},
+    "case_step3": {"medical_record_no": False},
+    "step4": {"medical_record_no": False},
+    "phone_followups": {"case_id": False},
+    "service_records": {"case_id": False},
+    "adl_iadl_assessments": {"case_id": False},
+    "return_to_work_records": {"case_id": False},
+    "options": {"type": False},
+    "case_sources": {"source_code": False},
+}
+
+# === 參考資料表：內容只由種子資料匯入，tables 後端會將其常駐記憶體並設為唯讀 ===
+REFERENCE_TABLES = (
+    "zipcode",
+    "industry_minor_categories",
+    "industry_major_categories",
+    "occupation_codes",
+    "options",
+)
 
-def get_db():
+
+class DomTable(IndexedTable):
+    """依 TABLE_INDEXES 維護索引的資料表"""
+    index_definitions = TABLE_INDEXES
+    change_listeners = {}
+
+
+class DomDB(TinyDB):
+    """使用 DomTable 的 TinyDB"""
+    table_class = DomTable
+
+    def table(self, name, **kwargs):
+        # 寫入 listener 需要透過資料表存取同一資料庫的其他資料表
+        table = super().table(name, **kwargs)
+        table.db = self
+        return table
+
+
+# === 完成項目遮罩：個案與各紀錄資料表寫入時同步更新 patients.completion 與由其推得的 case_status ===
+completion_tracker = CompletionTracker(derived={CASE_STATUS_FIELD: status_of_mask})
+completion_tracker.register(DomTable)
+
+# === 電話關懷排程：個案與電話關懷紀錄寫入時同步更新 patients.phone_due_date ===
+followup_scheduler = FollowupScheduler()
+followup_scheduler.register(DomTable)
+
+# === 首頁統計：patients 寫入時同步更新計數 ===
+dashboard = DashboardCounters()
+dashboard.register(DomTable)
+
+# === 個案彙整資料快取：相關資料表寫入時移除受影響的個案 ===
+case_cache = CaseAggregateCache()
+case_cache.register(DomTable)
+
+
+class DatabaseRegistry:
+    """行程內共用的資料庫連線登錄表，每個資料庫檔案只開啟一次"""
+
+    def __init__(self, default_path, backend="json"):
+        self.default_path = default_path
+        self.backend = backend
+        self._databases = {}
+        self._lock = threading.RLock()
+
+    def configure(self, path, backend=None):
+        """變更預設資料庫路徑與後端（測試或部署設定用）"""
+        with self._lock:
+            self.default_path = path
+            if backend:
+                self.backend = backend
+
+    def _storage_class(self):
+        storages = {"json": CachedJSONStorage, "wal": WALJSONStorage,
+                    "tables": TableFilesStorage, "sqlite": SQLiteStorage}
+        if self.backend not in storages:
+            raise ValueError(f"不支援的資料庫後端: {self.backend}")
+        return storages[self.backend]
+
+    def _open(self, path):
+        if self.backend == "sqlite":
+            return DomDB(path, storage=SQLiteStorage, indexes=TABLE_INDEXES)
+        if self.backend == "wal":
+            return DomDB(path, storage=WALJSONStorage, compact_threshold=DB_WAL_COMPACT_BYTES,
+                         codec=DB_JSON_CODEC)
+        if self.backend == "tables":
+            return DomDB(path, storage=TableFilesStorage, reference_tables=REFERENCE_TABLES,
+                         codec=DB_JSON_CODEC)
+        if self.backend == "json":
+            return DomDB(path, storage=CachedJSONStorage, codec=DB_JSON_CODEC)
+        raise ValueError(f"不支援的資料庫後端: {self.backend}")
+
+    def get_db(self, path=None):
+        """取得指定路徑的資料庫，尚未開啟時才建立"""
+        key = os.path.abspath(path or self.default_path)
+        with self._lock:
+            db = self._databases.get(key)
+            if db is None:
+                db = self._open(key)
+                self._databases[key] = db
+                logger.info(f"成功連接到資料庫 {key}")
+            return db
+
+    def reset(self, path=None):
+        """關閉並刪除資料庫，連同目前後端的附屬檔案（WAL 日誌、鎖檔、分資料表目錄等），回傳刪除的路徑"""
+        key = os.path.abspath(path or self.default_path)
+        with self._lock:
+            db = self._databases.pop(key, None)
+            if db is not None:
+                db.close()
+            return remove_files(self._storage_class().database_files(key))
+
+    def table(self, name, path=None):
+        """取得資料表，同一資料庫的同名資料表共用同一個實例"""
+        return self.get_db(path).table(name)
+
+    def close_all(self):
+        """關閉所有已開啟的資料庫"""
+        with self._lock:
+            for key, db in self._databases.items():
+                try:
+                    db.close()
+                except Exception as e:
+                    logger.error(f"關閉資料庫 {key} 時出錯: {e}")
+            self._databases.clear()
+
+    def _after_fork(self):
+        """子行程不可沿用父行程的檔案與 SQLite 連線，直接捨棄並於下次使用時重新開啟"""
+        self._lock = threading.RLock()
+        self._databases = {}
+
+
+registry = DatabaseRegistry(DB_PATH, DB_BACKEND)
+atexit.register(registry.close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+class TableProxy:
+    """模組層級的資料表存取器，每次使用時才向 registry 取得目前的資料表"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(registry.table(self.name), attr)
+
+    def __iter__(self):
+        return iter(registry.table(self.name))
+
+    def __len__(self):
+        return len(registry.table(self.name))
+
+    def __repr__(self):
+        return f"<TableProxy {self.name}>"
+
+
+def get_db(path=None):
     """獲取資料庫連接，確保只有一個資料庫實例"""
     try:
-        db = TinyDB(DB_PATH)
-        logger.info(f"成功連接到資料庫 {DB_PATH}")
-        return db
+        return registry.get_db(path)
     except Exception as e:
         logger.error(f"連接資料庫時出錯: {e}")
         raise
 
-# 獲取資料庫連接
-db = get_db()
+
+def reset_db(path=None):
+    """刪除資料庫與附屬檔案（init_db.py --reset 使用），回傳刪除的路徑"""
+    return registry.reset(path)
+
+
+@contextmanager
+def batch(path=None):
+    """
+    批次寫入：區塊內對各資料表的新增、更新、upsert、刪除先在記憶體套用，
+    離開區塊時以一次儲存層寫入提交；區塊內發生例外則全部捨棄。
+    區塊內的讀取會看到尚未提交的變更。
+
+        with batch():
+            phone_followups.insert(record)
+            patients.update({"call_progress": 100}, where("medical_record_no") == case_id)
+    """
+    db = get_db(path)
+    storage_batch = getattr(db.storage, "batch", None)
+    with (storage_batch() if storage_batch else nullcontext()):
+        yield db
+
+
+@contextmanager
+def reference_data_writable(path=None):
+    """暫時允許寫入參考資料表（只在匯入種子資料時使用）"""
+    reference_writes = getattr(get_db(path).storage, "reference_writes", None)
+    with (reference_writes() if reference_writes else nullcontext()):
+        yield
+
+
+def get_dashboard_counters(path=None):
+    """首頁統計計數（個案總數、各進度個案數、每月新增個案數、最新個案）"""
+    return dashboard.get(get_db(path))
+
+
+def get_case_aggregate(medical_record_no, path=None):
+    """個案的彙整資料（個案、訪談、Step3 與各項進度，見 domdb_cases），查無個案時回傳 None"""
+    return case_cache.get(get_db(path), medical_record_no)
+
+
+def backfill_completion(path=None):
+    """回填既有個案的 completion 與 case_status 欄位，回傳更新的筆數"""
+    return completion_tracker.backfill(get_db(path))
+
+
+def backfill_phone_schedule(path=None):
+    """回填既有個案的 phone_due_date 欄位，回傳更新的筆數"""
+    return followup_scheduler.backfill(get_db(path))
+
+
+def get_patients_by_completion(done=0, missing=0, columns=None, path=None):
+    """
+    以 completion 索引取得已完成 done 所有項目、且尚未完成 missing 任何項目的個案（依新增順序），
+    done / missing 為 COMPLETION_BITS 的位元組合；指定 columns 時每筆為這些欄位值的 tuple
+    """
+    db = get_db(path)
+    table = db.table("patients")
+    # 還有尚未回填的個案時逐筆計算遮罩（不寫入）
+    doc_ids = None if completion_tracker.has_pending(db) else table.match_bits(COMPLETION_FIELD, done, missing)
+    if doc_ids is None:
+        def matches(doc):
+            mask = completion_tracker.fill(db, doc).get(COMPLETION_FIELD)
+            return isinstance(mask, int) and mask & done == done and not mask & missing
+        docs = table.search(matches)
+    else:
+        docs = table.get(doc_ids=doc_ids)
+    return docs if columns is None else [project(doc, columns) for doc in docs]
+
+
+def get_patients_by_status(statuses, columns=None, path=None):
+    """以 case_status 索引取得指定進度的個案（依新增順序）；指定 columns 時每筆為這些欄位值的 tuple"""
+    db = get_db(path)
+    table = db.table("patients")
+    if completion_tracker.has_pending(db):
+        # 還有尚未回填的個案時逐筆判斷（不寫入）
+        allowed = set(statuses)
+        docs = table.search(lambda doc: doc_status(db, doc) in allowed)
+    else:
+        docs = [doc for status in statuses for doc in table.search(where(CASE_STATUS_FIELD) == status)]
+    docs.sort(key=lambda doc: doc.doc_id)
+    return docs if columns is None else [project(doc, columns) for doc in docs]
+
+
+def search_patients(keyword, fields=PATIENT_SEARCH_FIELDS, columns=None, path=None):
+    """
+    病歷號或姓名含有 keyword 的個案（不分大小寫），依完全相符、開頭相符、包含排序；
+    keyword 只做文字比對，不會被當成正規表示式。指定 columns 時每筆為這些欄位值的 tuple
+    """
+    return get_db(path).table("patients").search_text(fields, keyword, columns)
+
+
+# === 個案列表的 keyset 分頁 ===
+# 排序欄位，前綴 - 為遞減
+PATIENT_ORDERS = ("-created_at", "created_at", "medical_record_no", "-medical_record_no",
+                  "phone_due_date", "-phone_due_date")
+# columns 為 None 時 docs 為完整的個案文件，否則每筆為 columns 各欄位值的 tuple
+PatientPage = namedtuple("PatientPage", ["docs", "next_cursor", "total", "total_estimated", "columns"],
+                         defaults=[None])
+
+
+def encode_cursor(key):
+    """分頁游標：上一頁最後一筆的排序鍵 (值, 文件 ID)，編碼成不透明字串"""
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """解析分頁游標，格式錯誤時拋出 ValueError"""
+    try:
+        value, doc_id = json.loads(base64.urlsafe_b64decode(str(cursor).encode("ascii")))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"無效的分頁游標: {cursor}") from e
+    if (not isinstance(doc_id, int) or isinstance(doc_id, bool)
+            or not (value is None or isinstance(value, (str, int))) or isinstance(value, bool)):
+        raise ValueError(f"無效的分頁游標: {cursor}")
+    return value, doc_id
+
+
+def _range_filter(field, start, end):
+    """欄位值（字串）在 [start, end) 的條件，start / end 為 None 表示不限"""
+    return lambda doc: (isinstance(doc.get(field), str)
+                        and (start is None or doc[field] >= start)
+                        and (end is None or doc[field] < end))
+
+
+def page_patients(limit=None, cursor=None, order="-created_at", keyword=None,
+                  fields=PATIENT_SEARCH_FIELDS, statuses=None, created_range=None,
+                  due_range=None, doc_filter=None, columns=None, phone_status=None, path=None):
+    """
+    個案列表的一頁（keyset 分頁，cursor 為上一頁回傳的 next_cursor；limit 為 None 時回傳全部）。
+    有 keyword 時依相符程度排序（同 search_patients），否則依 order 排序。
+    篩選條件：statuses 為進度（以 case_status 索引取得候選），created_range 為
+    created_at 的 [起, 迄)、due_range 為電話關懷應關懷日 phone_due_date 的 [起, 迄)
+    （依該欄位排序時直接限定索引範圍），phone_status 為電話關懷狀態（依應關懷日排序時
+    由複合索引只走訪該狀態的個案），doc_filter(doc) 為其他條件。
+    指定 columns（欄位名稱的 tuple）時每筆只取這些欄位的值，不複製整份文件。
+
+    total 為符合條件的總筆數；有 doc_filter 等無法直接計數的條件、又無法一次走訪完時，
+    依走訪過的個案中符合的比例估計（total_estimated 為 True）
+    """
+    if order not in PATIENT_ORDERS:
+        raise ValueError(f"不支援的排序: {order}")
+    if columns is not None:
+        columns = tuple(columns)
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and isinstance(after[0], int) != bool(keyword):
+        raise ValueError(f"無效的分頁游標: {cursor}")
+    db = get_db(path)
+    table = db.table("patients")
+    field = order.lstrip("-")
+    ranges = {"created_at": created_range, PHONE_DUE_FIELD: due_range}
+    # 用到的衍生欄位還有尚未回填的個案時，改以補上計算值的複本篩選與排序（不寫入、不用這些欄位的索引）
+    trackers = []
+    if due_range is not None or field == PHONE_DUE_FIELD:
+        trackers.append(followup_scheduler)
+    if statuses is not None:
+        trackers.append(completion_tracker)
+    trackers = [tracker for tracker in trackers if tracker.has_pending(db)]
+
+    def fill(doc):
+        for tracker in trackers:
+            doc = tracker.fill(db, doc)
+        return doc
+
+    bounded = ranges.get(field) is not None and not keyword
+    low, high = ranges[field] if bounded else (None, None)
+    filters = [doc_filter] if doc_filter is not None else []
+    for name, value_range in ranges.items():
+        if value_range is not None and not (bounded and name == field):
+            filters.append(_range_filter(name, *value_range))
+    status_filter = None
+    if statuses is not None:
+        allowed = set(statuses)
+        status_filter = lambda doc: doc.get(CASE_STATUS_FIELD) in allowed
+    phone_filter = None
+    if phone_status is not None:
+        phone_filter = lambda doc: doc.get("phone_status") == phone_status
+
+    if keyword:
+        if phone_filter is not None:
+            filters.append(phone_filter)
+        if status_filter is not None:
+            filters.append(status_filter)
+        check = _all_of(filters)
+        if trackers and check is not None:
+            check = lambda doc, check=check: check(fill(doc))
+        docs, last, total = table.page_text(fields, keyword, limit, after, check, columns)
+        return PatientPage(docs, encode_cursor(last) if last is not None else None, total, False, columns)
+
+    # 進度篩選：由 case_status 索引取得各進度的文件；符合的個案不多時只排序這些候選文件，
+    # 否則沿排序索引走訪並以欄位值篩選
+    doc_ids = None
+    source = None
+    population = len(table)
+    exact = status_filter is None
+    if trackers:
+        source = {str(doc.doc_id): fill(doc) for doc in table.all()}
+        if status_filter is not None:
+            filters.append(status_filter)
+        exact = False
+    elif status_filter is not None:
+        groups = [table.value_ids(CASE_STATUS_FIELD, status) for status in set(statuses)]
+        if any(ids is None for ids in groups):
+            filters.append(status_filter)
+        else:
+            population = sum(len(ids) for ids in groups)
+            exact = True
+            if population * 8 < len(table):
+                doc_ids = {doc_id for ids in groups for doc_id in ids}
+            else:
+                filters.append(status_filter)
+    if bounded:
+        if exact and status_filter is None:
+            population = table.count_range(field, low, high)
+        else:
+            exact = False
+    # 電話關懷狀態：依應關懷日排序時由複合索引取得該狀態、期間內的個案數並依序走訪
+    composite = None
+    if phone_status is not None:
+        if field == PHONE_DUE_FIELD and source is None and status_filter is None:
+            composite = table.count_composite(PHONE_STATUS_FIELDS, (phone_status,), low, high)
+        if composite is None:
+            filters.append(phone_filter)
+    check = _all_of(filters)
+    if composite is not None:
+        population = composite
+        docs, last, scanned = table.page_composite(PHONE_STATUS_FIELDS, (phone_status,),
+                                                   math.inf if limit is None else limit, after,
+                                                   order.startswith("-"), check, columns, low, high)
+    else:
+        docs, last, scanned = table.page(field, math.inf if limit is None else limit, after,
+                                         order.startswith("-"), check, doc_ids, low, high, columns, source)
+    if exact and (check is None or check is status_filter):
+        total, estimated = population, False
+    elif after is None and last is None:
+        total, estimated = len(docs), False
+    else:
+        hits = len(docs) + (1 if last is not None else 0)
+        total, estimated = max(round(population * hits / scanned) if scanned else 0, len(docs)), True
+    return PatientPage(docs, encode_cursor(last) if last is not None else None, total, estimated, columns)
+
+
+def _all_of(filters):
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return lambda doc: all(f(doc) for f in filters)
+
+
+def get_creation_trend(start, end, granularity="month", path=None):
+    """start ~ end（date，含）之間每日 / 週 / 月新增的個案數"""
+    return creation_trend(get_db(path), start, end, granularity)
+
+
+def export_cases(fmt, start=None, end=None, path=None):
+    """
+    匯出 created_at 在 [start, end) 的個案與其訪談、電話關懷、復工紀錄（csv 或 jsonl），
+    回傳逐段產生 bytes 的 generator（見 domdb_export）
+    """
+    return export_stream(get_db(path), fmt, start, end)
+
+
+def get_table(name):
+    """取得共用的資料表存取器"""
+    return TableProxy(name)
+
 
 # === 各資料表 ===
-case_managers = db.table("case_managers")    # 個管師資料
-patients = db.table("patients")              # 個案資料
-interviews = db.table("interviews")          # Step2
-step3_table = db.table("case_step3")         # Step3
-case_sources = db.table("case_sources")
-options_table = db.table("options")
+case_managers = get_table("case_managers")    # 個管師資料
+patients = get_table("patients")              # 個案資料
+interviews = get_table("interviews")          # Step2
+step3_table = get_table("case_step3")         # Step3
+step4_table = get_table("step4")              # Step4
+case_sources = get_table("case_sources")
+options_table = get_table("options")
+zipcode_table = get_table("zipcode")
+occupation_codes = get_table("occupation_codes")
+industry_major_table = get_table("industry_major_categories")
+industry_minor_table = get_table("industry_minor_categories")
+phone_followups = get_table("phone_followups")              # 電話關懷紀錄
+service_records = get_table("service_records")              # 服務紀錄
+adl_iadl_table = get_table("adl_iadl_assessments")          # ADL/IADL 評估
+return_to_work_records = get_table("return_to_work_records")  # 復工紀錄
 
 # 其他表格可再擴充...
 
@@ -191,153 +650,52 @@ def create_patient(patient_data):
     except Exception as e:
         logger.error(f"創建/更新病患時出錯: {e}")
         return False, str(e)
-    
-    
-
-db = TinyDB("domdb.json")
-zipcode_table = db.table("zipcode")
-
-
-# === 匯入郵遞區號 CSV ===
-try:
-    zipcode_table.truncate()
-    with open("zipcode.csv", newline="", encoding="utf-8-sig") as csvfile:
-        reader = csv.DictReader(csvfile)
-        count = 0
-        for row in reader:
-            zipcode_table.insert({
-                "city_code": int(row["縣市代碼"].strip()),
-                "city": row["縣市"].strip(),
-                "zip": row["郵遞區號"].strip(),
-                "district": row["名稱"].strip()
-            })
-            count += 1
-        print(f"已成功匯入 {count} 筆 ZIPCODE 資料")
-except Exception as e:
-    print(f"郵遞區號匯入失敗：{e}")
-
-# === 匯入 injury_types ===
-try:
-    options_table.upsert({
-        "type": "injury_types",
-        "values": [
-            "墜落、滾落", "跌倒", "衝撞", "物體飛落", "物體倒塌、崩塌",
-            "被撞", "被夾、壓捲", "被刺、割、擦傷", "踩踏", "溺水",
-            "與高溫、低溫之接觸", "與有害物質接觸", "感電", "爆炸", "物體破裂",
-            "火災", "不當動作", "其他（不能分類如化膿、破傷風、中風）", "無法歸類者（資料欠缺）",
-            "公路交通事故（上下班交通事故）", "鐵路交通事故（上下班交通事故）",
-            "船舶航空交通事故（上下班交通事故）", "其他交通事故（上下班交通事故）",
-            "公路交通事故（公出交通事故）", "鐵路交通事故（公出交通事故）",
-            "船舶航空交通事故（公出交通事故）", "其他交通事故（公出交通事故）"
-        ]
-    }, Query().type == "injury_types")
-    print("職傷類型已成功匯入")
-except Exception as e:
-    print(f"injury_types 匯入錯誤：{e}")
-
-# === 轉換 ICD10.csv 成 icd10.json 並匯入 ===
-# try:
-#     data = []
-#     with open("ICD10.csv", newline="", encoding="utf-8-sig") as f:
-#         reader = csv.DictReader(f)
-#         for row in reader:
-#             code = row["代碼"].strip()
-#             desc = row["名稱"].strip()
-#             data.append(f"{code} - {desc}")
-
-#     icd10_data = {
-#         "type": "icd10",
-#         "values": data
-#     }
-
-#     options_table.upsert(icd10_data, Query().type == "icd10")
-#     print(f"ICD10 已成功匯入，共 {len(data)} 筆")
-# except Exception as e:
-#     print(f"ICD10 匯入錯誤：{e}")
-
-# 匯入職業分類碼
-from tinydb import TinyDB
-
-db = TinyDB("domdb.json")
-occupation_codes = db.table("occupation_codes")
-occupation_codes.truncate()
-
-data = [
-    {"code": "1", "label": "民意代表、主管及經理人員"},
-    {"code": "2", "label": "專業人員"},
-    {"code": "3", "label": "技術員及助理專業人員"},
-    {"code": "4", "label": "事務支援人員"},
-    {"code": "5", "label": "服務及銷售工作人員"},
-    {"code": "6", "label": "農、林、漁、牧業生產人員"},
-    {"code": "7", "label": "技藝有關工作人員"},
-    {"code": "8", "label": "機械設備操作及組裝人員"},
-    {"code": "9", "label": "基層技術工及勞力工"},
-    {"code": "10", "label": "軍人"}
-]
-
-occupation_codes.insert_multiple(data)
-print("已成功匯入職業分類碼")
-
-
-from tinydb import TinyDB
-
-db = TinyDB("domdb.json")
-industry_table = db.table("industry_major_categories")
-industry_table.truncate()
-
-data = [
-    {"code": "A", "label": "農、林、漁、牧業"},
-    {"code": "B", "label": "礦業及土石採取業"},
-    {"code": "C", "label": "製造業"},
-    {"code": "D", "label": "電力及燃氣供應業"},
-    {"code": "E", "label": "用水供應及污染整治業"},
-    {"code": "F", "label": "營建工程業"},
-    {"code": "G", "label": "批發及零售業"},
-    {"code": "H", "label": "運輸及倉儲業"},
-    {"code": "I", "label": "住宿及餐飲業"},
-    {"code": "J", "label": "出版影音及資通訊業"},
-    {"code": "K", "label": "金融及保險業"},
-    {"code": "L", "label": "不動產業"},
-    {"code": "M", "label": "專業、科學及技術服務業"},
-    {"code": "N", "label": "支援服務業"},
-    {"code": "O", "label": "公共行政及國防；強制性社會安全"},
-    {"code": "P", "label": "教育業"},
-    {"code": "Q", "label": "醫療保健及社會工作服務業"},
-    {"code": "R", "label": "藝術、娛樂及休閒服務業"},
-    {"code": "S", "label": "其他服務業"},
-]
-
-industry_table.insert_multiple(data)
-print("已匯入行業別大類選項")
-
-
-# 路徑設定
-CSV_FILE = "industry_minor_categories.csv"
-DB_FILE = "domdb.json"
-
-import csv
-from tinydb import TinyDB
-
-db = TinyDB("domdb.json")
-table = db.table("industry_minor_categories")
-table.truncate()
-
-with open("industry_minor_categories.csv", newline='', encoding='utf-8-sig') as csvfile:
-    reader = csv.DictReader(csvfile)
-    print("實際欄位名稱：", reader.fieldnames)  # 調試用，可刪
-
-    rows = []
-    for row in reader:
-        major_code = row["大類代碼"].strip()
-        minor_code = row["細類代碼"].strip()
-        label = row["細類"].strip()
-
-        rows.append({
-            "major_code": major_code,
-            "minor_code": minor_code,
-            "label": label
-        })
 
-    table.insert_multiple(rows)
 
-print(f"已成功匯入 {len(rows)} 筆行業細類資料")
\ No newline at end of file
+# === 電話關懷狀態更新（單筆與批次共用） ===
+# 一次批次更新最多的個案數
+PHONE_STATUS_BATCH_LIMIT = 500
+
+
+def update_phone_statuses(items, path=None):
+    """
+    更新多筆個案的電話關懷狀態：items 為 [{"medical_record_no", "status", "reason"}, ...]，
+    未填狀態為「未完成」、未填原因為「-」。病歷號以索引一次確認，符合的個案以一次儲存層寫入提交；
+    同一病歷號出現多次時以最後一筆為準。
+    回傳與 items 順序相同的 [{"medical_record_no", "success", "message"}]，缺少或查無病歷號的
+    項目標示失敗，不影響其他項目
+    """
+    record_nos = [item.get("medical_record_no") if isinstance(item, dict) else None for item in items]
+    record_nos = [no if isinstance(no, str) and no else None for no in record_nos]
+    results, updates = [], []
+    with batch(path) as db:
+        counts = count_by(db, "patients", "medical_record_no", [no for no in record_nos if no])
+        for item, record_no in zip(items, record_nos):
+            if record_no is None:
+                results.append({"medical_record_no": record_no, "success": False, "message": "缺少病歷號"})
+            elif not counts.get(record_no):
+                results.append({"medical_record_no": record_no, "success": False, "message": "查無病歷號"})
+            else:
+                fields = {"phone_status": item.get("status") or "未完成", "phone_reason": item.get("reason") or "-"}
+                updates.append((fields, where("medical_record_no") == record_no))
+                results.append({"medical_record_no": record_no, "success": True, "message": "更新成功"})
+        if updates:
+            db.table("patients").update_multiple(updates)
+    return results
+
+
+def count_phone_statuses(statuses, due_range=None, path=None):
+    """
+    應關懷日在 due_range [起, 迄) 的個案依電話關懷狀態計數 {狀態: 筆數}。
+    以 phone_status + phone_due_date 複合索引計數；還有尚未回填應關懷日的個案時改為逐筆計算
+    """
+    db = get_db(path)
+    table = db.table("patients")
+    low, high = due_range or (None, None)
+    if due_range is None or not followup_scheduler.has_pending(db):
+        counts = {status: table.count_composite(PHONE_STATUS_FIELDS, (status,), low, high) for status in statuses}
+        if None not in counts.values():
+            return counts
+    page = page_patients(order=PHONE_DUE_FIELD, due_range=due_range, columns=("phone_status",), path=path)
+    found = Counter(status for status, in page.docs)
+    return {status: found[status] for status in statuses}
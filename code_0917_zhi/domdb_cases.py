@@ -0,0 +1,202 @@
+"""
+個案彙整資料快取
+
+Step2 / Step3 表單、個案詳情頁與 Step3 後的摘要產生，每次請求都要分別查詢
+patients、interviews、case_step3、step4、phone_followups、service_records、
+return_to_work_records 再合併。現在以病歷號為鍵，把合併結果（CaseAggregate）放在 LRU 快取中：
+- 讀取時先查快取，沒有才由各資料表載入並存入；超過 CACHE_SIZE 筆時淘汰最久未使用的個案
+- 上述資料表寫入時，由寫入 listener 依新舊文件的病歷號（medical_record_no / case_id）
+  移除相關個案，只影響被改動的個案
+- 載入期間若有寫入，載入結果不存入快取，避免寫入前讀到的舊資料留在快取中
+- 其他行程寫入（儲存層 generation 改變）時清空該資料庫的快取
+
+快取回傳的是複本，呼叫端可以直接修改。
+
+各項進度都由 progress_many 計算：訪談進度取自個案文件的完成項目遮罩（completion，
+見 domdb_completion），電話關懷、服務、復工進度由各紀錄資料表以索引一次取得整頁病歷號的
+筆數（沒有索引時掃描資料表一次），不逐筆查詢。
+"""
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+
+from tinydb import where
+
+from domdb_completion import count_by, interview_progress, stored_masks
+
+CACHE_SIZE = 1024
+# (資料表, 對應病歷號的欄位)
+SOURCE_TABLES = (
+    ("patients", "medical_record_no"),
+    ("interviews", "medical_record_no"),
+    ("case_step3", "medical_record_no"),
+    ("step4", "medical_record_no"),
+    ("phone_followups", "case_id"),
+    ("service_records", "case_id"),
+    ("return_to_work_records", "case_id"),
+)
+# 以筆數計算進度的紀錄資料表 (進度名稱, 資料表, 對應病歷號的欄位)
+RECORD_TABLES = (
+    ("call_progress", "phone_followups", "case_id"),
+    ("service_progress", "service_records", "case_id"),
+    ("return_progress", "return_to_work_records", "case_id"),
+)
+# 每筆電話關懷 / 服務 / 復工紀錄代表的進度百分比
+RECORD_PROGRESS = 25
+
+
+def records_progress(count):
+    """電話關懷、服務、復工紀錄進度：每筆 RECORD_PROGRESS%，最多 100"""
+    return min(count * RECORD_PROGRESS, 100)
+
+
+def progress_many(db, record_nos):
+    """
+    多筆個案的各項進度 {病歷號: progress}：訪談進度取自完成項目遮罩，
+    其他進度依紀錄筆數，每個資料表只查詢一次
+    """
+    record_nos = list(dict.fromkeys(record_nos))
+    masks = stored_masks(db, record_nos)
+    counts = {key: count_by(db, name, field, record_nos) for key, name, field in RECORD_TABLES}
+    return {
+        record_no: {
+            "interview_progress": interview_progress(masks[record_no]),
+            **{key: records_progress(counts[key][record_no]) for key, _, _ in RECORD_TABLES},
+        }
+        for record_no in record_nos
+    }
+
+
+class CaseAggregate(namedtuple("CaseAggregate", "patient interview step3 progress")):
+    """
+    單一個案的彙整資料：patient、interview（Step2）、step3 為 dict，沒有資料時為 None；
+    progress 為 {"interview_progress", "call_progress", "service_progress", "return_progress"}
+    """
+    __slots__ = ()
+
+    def merged(self):
+        """個案與訪談合併後的資料，欄位相同時以訪談為準（Step2 / Step3 表單使用）"""
+        return {**self.patient, **(self.interview or {})}
+
+    def copy(self):
+        return CaseAggregate(
+            dict(self.patient),
+            dict(self.interview) if self.interview is not None else None,
+            dict(self.step3) if self.step3 is not None else None,
+            dict(self.progress),
+        )
+
+
+def load_case(db, medical_record_no):
+    """由各資料表載入個案的彙整資料，查無個案時回傳 None"""
+    patient = db.table("patients").get(where("medical_record_no") == medical_record_no)
+    if patient is None:
+        return None
+    interview = db.table("interviews").get(where("medical_record_no") == medical_record_no)
+    step3 = db.table("case_step3").get(where("medical_record_no") == medical_record_no)
+    return CaseAggregate(
+        dict(patient),
+        dict(interview) if interview is not None else None,
+        dict(step3) if step3 is not None else None,
+        progress_many(db, [medical_record_no])[medical_record_no],
+    )
+
+
+def _storage_stamp(db):
+    """來源資料表目前的 generation；儲存層不支援時回傳 None（不使用快取）"""
+    storage = db.storage
+    storage.read()
+    table_generation = getattr(storage, "table_generation", None)
+    if table_generation is None:
+        return getattr(storage, "generation", None)
+    return tuple(table_generation(name) for name, _ in SOURCE_TABLES)
+
+
+class _CacheState:
+    """單一資料庫的快取內容"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        # 每次寫入遞增；載入前後不同表示載入期間有寫入
+        self.version = 0
+        self.stamp = None
+
+
+class CaseAggregateCache:
+    """以病歷號為鍵的個案彙整資料 LRU 快取，由寫入 listener 失效"""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._states = weakref.WeakKeyDictionary()
+
+    def register(self, table_class):
+        for name, field in SOURCE_TABLES:
+            table_class.change_listeners.setdefault(name, []).append(self._listener(field))
+
+    def _state(self, db):
+        state = self._states.get(db)
+        if state is None:
+            state = self._states[db] = _CacheState()
+        return state
+
+    def _listener(self, field):
+        def on_change(table, old_docs, new_docs):
+            record_nos = {
+                doc.get(field)
+                for doc in list(old_docs.values()) + list(new_docs.values())
+                if doc and doc.get(field)
+            }
+            if not record_nos:
+                return None
+            state = self._state(table.db)
+            self._invalidate(state, record_nos)
+            # 寫入後再移除一次：寫入前到寫入完成之間載入的個案可能是舊資料
+            return lambda: self._invalidate(state, record_nos)
+        return on_change
+
+    def _invalidate(self, state, record_nos):
+        with self._lock:
+            state.version += 1
+            for record_no in record_nos:
+                state.entries.pop(record_no, None)
+
+    def get(self, db, medical_record_no):
+        """個案的彙整資料（複本），查無個案時回傳 None"""
+        stamp = _storage_stamp(db)
+        if stamp is None:
+            aggregate = load_case(db, medical_record_no)
+            return aggregate.copy() if aggregate is not None else None
+        state = self._state(db)
+        with self._lock:
+            if state.stamp != stamp:
+                state.entries.clear()
+                state.stamp = stamp
+                state.version += 1
+            aggregate = state.entries.get(medical_record_no)
+            if aggregate is not None:
+                state.entries.move_to_end(medical_record_no)
+                self.hits += 1
+                return aggregate.copy()
+            self.misses += 1
+            version = state.version
+        aggregate = load_case(db, medical_record_no)
+        if aggregate is None:
+            return None
+        with self._lock:
+            if state.version == version:
+                state.entries[medical_record_no] = aggregate
+                while len(state.entries) > self.maxsize:
+                    state.entries.popitem(last=False)
+        return aggregate.copy()
+
+    def clear(self, db=None):
+        """清空指定資料庫（未指定時為全部）的快取"""
+        with self._lock:
+            states = [self._states.get(db)] if db is not None else list(self._states.values())
+            for state in states:
+                if state is not None:
+                    state.entries.clear()
+                    state.version += 1
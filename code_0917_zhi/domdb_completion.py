@@ -0,0 +1,165 @@
+"""
+個案完成項目位元遮罩（patients.completion）與個案進度（patients.case_status）
+
+訪談進度以前要分別查詢 patients、interviews、case_step3、step4 四個資料表。
+現在每個個案文件保存一個整數 completion，每個位元代表一個項目是否已有資料：
+
+    step1 (1)   個案基本資料（patients）
+    step2 (2)   訪談（interviews）
+    step3 (4)   Step3（case_step3）
+    step4 (8)   Step4（step4）
+    call (16)   電話關懷紀錄（phone_followups）
+    service (32) 服務紀錄（service_records）
+    adl (64)    ADL/IADL 評估（adl_iadl_assessments）
+    return_to_work (128) 復工紀錄（return_to_work_records）
+
+由遮罩推得的欄位（case_status，見 domdb_status）與遮罩一起維護，不另外查詢資料表。
+新增或修改個案時補上欄位；上述資料表寫入時重新計算相關個案，
+與原本的寫入在同一個批次中提交（見 domdb_derived）。
+
+completion 建有雜湊索引，遮罩最多 256 種值；「已完成某些項目、尚未完成另一些項目」
+的查詢（例如已訪談但尚無電話關懷）只需逐一檢查索引中出現過的遮罩值，不掃描文件。
+
+既有資料以本檔回填（init_db.py 與 python app.py 啟動時也會執行，已正確的資料不會寫入）；
+回填前依遮罩或進度的查詢改為逐筆計算，不會寫入。
+
+使用方式:
+python domdb_completion.py
+"""
+from collections import Counter
+
+from tinydb import where
+
+from domdb_derived import PatientFieldTracker
+COMPLETION_FIELD = "completion"
+COMPLETION_BITS = {
+    "step1": 1,
+    "step2": 2,
+    "step3": 4,
+    "step4": 8,
+    "call": 16,
+    "service": 32,
+    "adl": 64,
+    "return_to_work": 128,
+}
+# (資料表, 對應病歷號的欄位, 位元)
+SOURCE_TABLES = (
+    ("interviews", "medical_record_no", COMPLETION_BITS["step2"]),
+    ("case_step3", "medical_record_no", COMPLETION_BITS["step3"]),
+    ("step4", "medical_record_no", COMPLETION_BITS["step4"]),
+    ("phone_followups", "case_id", COMPLETION_BITS["call"]),
+    ("service_records", "case_id", COMPLETION_BITS["service"]),
+    ("adl_iadl_assessments", "case_id", COMPLETION_BITS["adl"]),
+    ("return_to_work_records", "case_id", COMPLETION_BITS["return_to_work"]),
+)
+
+
+def steps_progress(has_step1, has_step2, has_step3, has_step4):
+    """訪談進度：完成 step1～step4 分別為 25 / 50 / 75 / 100"""
+    if has_step4:
+        return 100
+    if has_step3:
+        return 75
+    if has_step2:
+        return 50
+    if has_step1:
+        return 25
+    return 0
+
+
+def count_by(db, table_name, field, values):
+    """{值: 筆數}；有索引時直接取索引中的筆數，否則掃描資料表一次"""
+    table = db.table(table_name)
+    counts = table.count_by(field, values)
+    if counts is None:
+        wanted = set(values)
+        found = Counter(doc.get(field) for doc in table.all() if doc.get(field) in wanted)
+        counts = {value: found[value] for value in values}
+    return counts
+
+
+def parse_items(items):
+    """項目名稱（逗號分隔字串或清單）轉為位元遮罩；未知的名稱拋出 ValueError"""
+    if not items:
+        return 0
+    if isinstance(items, str):
+        items = items.split(",")
+    mask = 0
+    for item in items:
+        item = str(item).strip()
+        if item not in COMPLETION_BITS:
+            raise ValueError(f"不支援的完成項目: {item}")
+        mask |= COMPLETION_BITS[item]
+    return mask
+
+
+def mask_items(mask):
+    """位元遮罩中已完成的項目名稱"""
+    return [name for name, bit in COMPLETION_BITS.items() if mask & bit]
+
+
+def interview_progress(mask):
+    """由位元遮罩算出訪談進度（step1～step4 分別為 25 / 50 / 75 / 100）"""
+    return steps_progress(*(bool(mask & COMPLETION_BITS[f"step{i}"]) for i in range(1, 5)))
+
+
+def completion_masks(db, record_nos):
+    """由各資料表算出多筆個案的遮罩 {病歷號: 遮罩}（不含 step1），每個資料表只查詢一次"""
+    record_nos = list(dict.fromkeys(record_nos))
+    masks = dict.fromkeys(record_nos, 0)
+    for table, field, bit in SOURCE_TABLES:
+        for record_no, count in count_by(db, table, field, record_nos).items():
+            if count:
+                masks[record_no] |= bit
+    return masks
+
+
+def stored_masks(db, record_nos):
+    """
+    多筆個案的遮罩 {病歷號: 遮罩}：個案文件已有 completion 時直接使用，
+    尚未回填或查無個案的病歷號才由各資料表算出（查無個案時不含 step1），不寫入
+    """
+    record_nos = list(dict.fromkeys(record_nos))
+    patients = db.table("patients")
+    masks, missing = {}, []
+    for record_no in record_nos:
+        patient = patients.get(where("medical_record_no") == record_no)
+        if patient is not None and isinstance(patient.get(COMPLETION_FIELD), int):
+            masks[record_no] = patient[COMPLETION_FIELD]
+        else:
+            missing.append((record_no, patient is not None))
+    if missing:
+        computed = completion_masks(db, [record_no for record_no, _ in missing])
+        for record_no, exists in missing:
+            masks[record_no] = computed[record_no] | (COMPLETION_BITS["step1"] if exists else 0)
+    return {record_no: masks[record_no] for record_no in record_nos}
+
+
+class CompletionTracker(PatientFieldTracker):
+    """
+    在 patients 與各紀錄資料表的寫入路徑上維護 completion 欄位；
+    derived 為 {欄位: 函式(遮罩)}，這些欄位由遮罩推得並一起寫入
+    """
+    source_tables = {name: field for name, field, _ in SOURCE_TABLES}
+
+    def __init__(self, derived=None):
+        super().__init__()
+        self.derived = dict(derived or {})
+        self.fields = (COMPLETION_FIELD,) + tuple(self.derived)
+
+    def compute(self, db, docs):
+        masks = completion_masks(db, [doc.get("medical_record_no") for doc in docs
+                                      if doc.get("medical_record_no")])
+        values = []
+        for doc in docs:
+            mask = COMPLETION_BITS["step1"] | masks.get(doc.get("medical_record_no"), 0)
+            values.append({COMPLETION_FIELD: mask,
+                           **{field: derive(mask) for field, derive in self.derived.items()}})
+        return values
+
+
+if __name__ == "__main__":
+    from domdb import completion_tracker, get_db
+
+    count = completion_tracker.backfill(get_db())
+    print(f"已回填 {count} 筆個案完成項目與進度" if count else "個案完成項目與進度皆已正確")
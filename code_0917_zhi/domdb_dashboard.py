@@ -0,0 +1,245 @@
+"""
+首頁統計的增量計數
+
+首頁的 /dashboard-data、/api/dashboard-stats、/dashboard-recent-cases 以前每次請求都
+讀出 patients、interviews、case_step3 三個資料表重新計算。現在 patients 的每次寫入
+（create_patient、訪談或 Step3 寫入時更新的 case_status 欄位，見 domdb_completion）都會
+同步更新 dashboard_counters 資料表中的一筆計數，並與原本的寫入在同一個批次中提交；
+首頁只需讀取這一筆。
+
+計數內容：
+- total：個案總數
+- status：有病歷號的個案依進度分為 waiting（尚無訪談）、interviewed（有訪談、尚無 Step3）、
+  closed（已有 Step3）
+- monthly_new：各月份（created_at 的 YYYY-MM）新增的個案數
+- recent：created_at 最新的 RECENT_LIMIT 筆個案與其進度
+
+首頁需要的所有數字都在同一筆文件中，一次讀取即為一致的快照。
+
+資料庫中還沒有計數（舊資料庫）時，第一次讀取會全表重算一次。
+
+任意期間的新增個案趨勢（creation_trend）不走計數，而是在 patients.created_at 的
+排序索引上以二分搜尋計算每個日 / 週 / 月區間的筆數，不需掃描或逐筆解析日期。
+
+使用方式:
+python domdb_dashboard.py [--verify]   # 重算並修正計數；--verify 只比對、不寫入
+"""
+import heapq
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from tinydb.table import Document
+
+from domdb_status import CASE_STATUSES, doc_status
+
+COUNTERS_TABLE = "dashboard_counters"
+COUNTERS_DOC_ID = 1
+RECENT_LIMIT = 20
+RECENT_FIELDS = ("medical_record_no", "patient_name", "created_at")
+GRANULARITIES = ("day", "week", "month")
+# 單次趨勢查詢最多的區間數（以日為單位約 10 年）
+MAX_BUCKETS = 3700
+
+
+def created_month(doc):
+    """created_at 的 YYYY-MM，沒有建立時間時回傳 None"""
+    created = doc.get("created_at") or ""
+    if not isinstance(created, str) or not created:
+        return None
+    return "-".join(created.split("T")[0].split("-")[:2])
+
+
+def _recent_entry(doc_id, doc):
+    entry = {field: doc[field] for field in RECENT_FIELDS if field in doc}
+    entry["doc_id"] = str(doc_id)
+    return entry
+
+
+def _with_status(db, entries, docs):
+    """為挑出的最新個案附上進度，docs 為 {文件 ID: 個案文件}"""
+    return [dict(entry, status=doc_status(db, docs[entry["doc_id"]])) for entry in entries]
+
+
+def _recent_key(entry):
+    # created_at 新的在前；相同時依文件 ID（新增順序），與 sorted(..., reverse=True) 的結果一致
+    return (entry.get("created_at") or "", -int(entry["doc_id"]))
+
+
+def _tally(db, docs, sign, totals, status, months):
+    for doc in docs:
+        totals["total"] += sign
+        month = created_month(doc)
+        if month:
+            months[month] += sign
+        if doc.get("medical_record_no"):
+            status[doc_status(db, doc)] += sign
+
+
+def compute_counters(db):
+    """由資料表全表計算計數"""
+    totals, status, months = Counter(), Counter(), Counter()
+    all_patients = db.table("patients").all()
+    _tally(db, all_patients, 1, totals, status, months)
+    return {
+        "total": totals["total"],
+        "status": {name: status[name] for name in CASE_STATUSES},
+        "monthly_new": dict(sorted(months.items())),
+        "recent": _latest(db, all_patients),
+    }
+
+
+def _latest(db, docs):
+    """created_at 最新的 RECENT_LIMIT 筆個案（含進度）"""
+    by_id = {str(doc.doc_id): doc for doc in docs}
+    entries = heapq.nlargest(
+        RECENT_LIMIT,
+        (_recent_entry(doc_id, doc) for doc_id, doc in by_id.items()),
+        key=_recent_key,
+    )
+    return _with_status(db, entries, by_id)
+
+
+def bucket_starts(start, end, granularity):
+    """start ~ end（date，含）之間各區間的起始日；週以星期一為起點"""
+    if granularity == "month":
+        current, step = start.replace(day=1), relativedelta(months=1)
+    elif granularity == "week":
+        current, step = start - timedelta(days=start.weekday()), timedelta(weeks=1)
+    elif granularity == "day":
+        current, step = start, timedelta(days=1)
+    else:
+        raise ValueError(f"不支援的區間單位: {granularity}")
+    starts = []
+    while current <= end:
+        starts.append(current)
+        if len(starts) > MAX_BUCKETS:
+            raise ValueError(f"查詢期間過長，最多 {MAX_BUCKETS} 個區間")
+        current += step
+    return starts
+
+
+def creation_trend(db, start, end, granularity="month"):
+    """
+    start ~ end（date，含）之間每個區間新增的個案數 {區間標籤: 個案數}。
+    月的標籤為 YYYY-MM，日與週為 YYYY-MM-DD（週為該週星期一）；
+    頭尾不完整的區間只計算期間內的個案
+    """
+    patients = db.table("patients")
+    starts = bucket_starts(start, end, granularity)
+    # ISO 字串可直接比較：2025-03-01 <= 2025-03-01T09:00:00 < 2025-03-02
+    bounds = [max(day, start).isoformat() for day in starts] + [(end + timedelta(days=1)).isoformat()]
+    trend = {}
+    for day, low, high in zip(starts, bounds, bounds[1:]):
+        label = day.strftime("%Y-%m") if granularity == "month" else day.isoformat()
+        trend[label] = patients.count_range("created_at", low, high)
+    return trend
+
+
+def _comparable(counters):
+    return {key: counters.get(key) for key in ("total", "status", "monthly_new", "recent")}
+
+
+class DashboardCounters:
+    """在 patients 的寫入路徑上維護首頁計數"""
+
+    def register(self, table_class):
+        table_class.change_listeners.setdefault("patients", []).append(self._on_change)
+
+    # ---------- 讀取 ----------
+
+    def get(self, db):
+        """目前的計數；尚未建立時全表重算並寫入"""
+        counters = db.table(COUNTERS_TABLE).get(doc_id=COUNTERS_DOC_ID)
+        if counters is None:
+            counters = self.rebuild(db)
+        return counters
+
+    # ---------- 重算 ----------
+
+    def rebuild(self, db):
+        """全表重算並寫入計數"""
+        storage_batch = getattr(db.storage, "batch", None)
+        with (storage_batch() if storage_batch else nullcontext()):
+            counters = compute_counters(db)
+            self._save(db, counters)
+        return counters
+
+    def verify(self, db):
+        """比對目前的計數與全表重算的結果，回傳不一致的欄位（一致時為空 dict）"""
+        stored = db.table(COUNTERS_TABLE).get(doc_id=COUNTERS_DOC_ID)
+        expected = _comparable(compute_counters(db))
+        if stored is None:
+            return {key: (None, value) for key, value in expected.items()}
+        stored = _comparable(stored)
+        return {key: (stored[key], value) for key, value in expected.items() if stored[key] != value}
+
+    def _save(self, db, counters):
+        counters["updated_at"] = datetime.now().isoformat()
+        db.table(COUNTERS_TABLE).upsert(Document(counters, doc_id=COUNTERS_DOC_ID))
+
+    # ---------- 增量更新 ----------
+
+    def _on_change(self, table, old_docs, new_docs):
+        db = table.db
+        if db.table(COUNTERS_TABLE).get(doc_id=COUNTERS_DOC_ID) is None:
+            return None  # 尚未建立，第一次讀取時會全表重算
+        totals, status, months = Counter(), Counter(), Counter()
+        _tally(db, [doc for doc in old_docs.values() if doc], -1, totals, status, months)
+
+        def finish():
+            _tally(db, [doc for doc in new_docs.values() if doc], 1, totals, status, months)
+            self._apply(db, totals, status, months, old_docs, new_docs)
+        return finish
+
+    def _apply(self, db, totals, status, months, old_docs, new_docs):
+        counters = db.table(COUNTERS_TABLE).get(doc_id=COUNTERS_DOC_ID)
+        total = counters["total"] + totals["total"]
+        new_status = {name: counters["status"].get(name, 0) + status[name] for name in CASE_STATUSES}
+        new_months = Counter(counters["monthly_new"])
+        new_months.update(months)
+        recent = self._update_recent(db, counters["recent"], total, old_docs, new_docs)
+        if (totals["total"] == 0 and not any(months.values())
+                and new_status == counters["status"] and recent == counters["recent"]):
+            return  # 計數沒有變化（例如只更新個案的電話進度）
+        self._save(db, {
+            "total": total,
+            "status": new_status,
+            "monthly_new": {month: count for month, count in sorted(new_months.items()) if count},
+            "recent": recent,
+        })
+
+    def _update_recent(self, db, recent, total, old_docs, new_docs):
+        changed = set(old_docs)
+        kept = [entry for entry in recent if entry["doc_id"] not in changed]
+        # 清單內的個案被刪除或建立時間改變時，清單外可能有更新的個案，需重新挑選
+        dropped = any(
+            new_docs.get(entry["doc_id"]) is None
+            or new_docs[entry["doc_id"]].get("created_at") != entry.get("created_at")
+            for entry in recent if entry["doc_id"] in changed
+        )
+        if dropped and total > RECENT_LIMIT:
+            return _latest(db, db.table("patients").all())
+        added = {doc_id: doc for doc_id, doc in new_docs.items() if doc}
+        kept.extend(_with_status(db, [_recent_entry(doc_id, doc) for doc_id, doc in added.items()], added))
+        return sorted(kept, key=_recent_key, reverse=True)[:RECENT_LIMIT]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from domdb import dashboard, get_db
+
+    parser = argparse.ArgumentParser(description="重算首頁統計計數")
+    parser.add_argument("--verify", action="store_true", help="只比對目前的計數，不寫入")
+    args = parser.parse_args()
+    database = get_db()
+    differences = dashboard.verify(database)
+    for key, (stored, expected) in differences.items():
+        print(f"{key}: 目前 {stored}，應為 {expected}")
+    if not differences:
+        print("計數正確")
+    elif not args.verify:
+        dashboard.rebuild(database)
+        print("已重算並寫入計數")
@@ -0,0 +1,118 @@
+"""
+個案文件上的衍生欄位
+
+patients 文件中有些欄位由其他資料表算出並建立索引，列表與篩選直接以索引查詢：
+completion 與 case_status（domdb_completion）、phone_due_date（domdb_schedule）。
+PatientFieldTracker 是這些欄位共用的維護方式：
+- 新增或修改個案時，影響計算的欄位有變才在寫入前補上欄位（整批一次計算）
+- 來源資料表寫入時重新計算相關個案，與原本的寫入在同一個批次中提交
+- backfill 回填既有資料，已正確的資料不會寫入（init_db.py 與每個行程的第一個請求時執行）
+
+讀取路徑不寫入：資料庫還有尚未回填的個案時，查詢以 fill 補上計算值的複本篩選與排序
+（逐筆計算，較慢），回填後才改用索引。
+"""
+import weakref
+from contextlib import nullcontext
+
+from tinydb import where
+
+
+class PatientFieldTracker:
+    """
+    在 patients 與來源資料表的寫入路徑上維護衍生欄位。子類別設定：
+    - fields：維護的欄位
+    - depends_on：patients 文件中影響計算的欄位
+    - source_tables：{來源資料表: 對應病歷號的欄位}
+    並實作 compute(db, docs)，回傳每筆個案文件的 {欄位: 值}（與 docs 順序相同）
+    """
+    fields = ()
+    depends_on = ("medical_record_no",)
+    source_tables = {}
+
+    def __init__(self):
+        # 已確認所有個案都有欄位的資料庫；之後新寫入的個案都由 listener 維護
+        self._complete = weakref.WeakSet()
+
+    def compute(self, db, docs):
+        raise NotImplementedError
+
+    def is_current(self, doc):
+        """文件是否已有全部欄位（已回填或已由 listener 維護）"""
+        return all(field in doc for field in self.fields)
+
+    def fill(self, db, doc):
+        """尚未回填的文件回傳補上計算值的複本（不寫入），其餘直接回傳 doc"""
+        if self.is_current(doc):
+            return doc
+        return {**doc, **self.compute(db, [doc])[0]}
+
+    def has_pending(self, db):
+        """資料庫是否還有尚未回填的個案（只讀取）；確認過全部已回填之後不再檢查"""
+        if db in self._complete:
+            return False
+        if any(not self.is_current(doc) for doc in db.table("patients").all()):
+            return True
+        self._complete.add(db)
+        return False
+
+    def register(self, table_class):
+        table_class.change_listeners.setdefault("patients", []).append(self._on_patient_change)
+        for name in self.source_tables:
+            table_class.change_listeners.setdefault(name, []).append(self._on_source_change)
+
+    def _on_patient_change(self, table, old_docs, new_docs):
+        # 寫入前直接補上新文件的欄位；影響計算的欄位都沒變時沿用原值
+        pending = []
+        for doc_id, doc in new_docs.items():
+            if doc is None:
+                continue
+            old = old_docs.get(doc_id)
+            if (old is not None and self.is_current(doc)
+                    and all(old.get(field) == doc.get(field) for field in self.depends_on)):
+                continue
+            pending.append(doc)
+        for doc, values in zip(pending, self.compute(table.db, pending)):
+            doc.update(values)
+        return None
+
+    def _on_source_change(self, table, old_docs, new_docs):
+        field = self.source_tables[table.name]
+        record_nos = {
+            doc.get(field)
+            for doc in list(old_docs.values()) + list(new_docs.values())
+            if doc and doc.get(field)
+        }
+        if not record_nos:
+            return None
+        patients = table.db.table("patients")
+        # 尚未回填的個案先寫入變更前的值，讓其他 listener（例如首頁統計）看得到舊值
+        self._write(patients, [doc for doc in self._patient_docs(patients, record_nos)
+                               if not self.is_current(doc)])
+
+        def finish():
+            self._write(patients, self._patient_docs(patients, record_nos))
+        return finish
+
+    @staticmethod
+    def _patient_docs(patients, record_nos):
+        return [doc for record_no in record_nos
+                for doc in patients.search(where("medical_record_no") == record_no)]
+
+    def _write(self, patients, docs):
+        """重新計算 docs 的欄位，只寫入有變的文件（相同值的文件一起更新），回傳更新的筆數"""
+        changes = {}
+        for doc, values in zip(docs, self.compute(patients.db, docs)):
+            if any(field not in doc or doc[field] != value for field, value in values.items()):
+                changes.setdefault(tuple(values.items()), []).append(doc.doc_id)
+        for items, doc_ids in changes.items():
+            patients.update(dict(items), doc_ids=doc_ids)
+        return sum(len(doc_ids) for doc_ids in changes.values())
+
+    def backfill(self, db):
+        """回填所有個案的欄位，回傳更新的筆數"""
+        patients = db.table("patients")
+        storage_batch = getattr(db.storage, "batch", None)
+        with (storage_batch() if storage_batch else nullcontext()):
+            count = self._write(patients, patients.all())
+        self._complete.add(db)
+        return count
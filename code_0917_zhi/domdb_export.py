@@ -0,0 +1,155 @@
+"""
+個案資料匯出（勞動主管機關通報用）
+
+把個案與其 Step2 訪談（interviews）、電話關懷紀錄（phone_followups）、
+復工紀錄（return_to_work_records）合併後逐筆輸出：
+- jsonl：每行一個個案 {"patient", "interview", "phone_followups", "return_to_work_records"}，
+  保留所有紀錄
+- csv：每列一個個案；訪談欄位加上 interview. 前綴，電話關懷與復工紀錄附上筆數與
+  最新一筆（依新增順序）的欄位。清單或物件的欄位值以 JSON 字串輸出
+
+個案依 created_at 排序，以排序索引的 keyset 分頁每次取 CHUNK_SIZE 筆，
+再以病歷號索引查詢相關紀錄。輸出邊產生邊送出，不會一次組成全部結果，
+記憶體用量不隨匯出筆數成長。
+
+使用方式:
+python domdb_export.py [--format csv|jsonl] [--from YYYY-MM-DD] [--to YYYY-MM-DD] > export.csv
+"""
+import csv
+import json
+
+from tinydb import where
+
+from domdb_storage import JSONCodec
+
+EXPORT_FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 500
+# 累積到這個大小才送出一段輸出，避免每筆個案都是一次小寫入
+FLUSH_BYTES = 64 * 1024
+# (JSON Lines 的鍵, 資料表, 對應病歷號的欄位, CSV 欄位前綴)
+RELATED_TABLES = (
+    ("phone_followups", "phone_followups", "case_id", "phone_followup"),
+    ("return_to_work_records", "return_to_work_records", "case_id", "return_to_work"),
+)
+
+
+def iter_cases(db, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    依建檔時間（舊到新）逐筆產生合併後的個案；start / end 限定 created_at 在 [start, end)，
+    指定期間時沒有建立時間的個案不匯出
+    """
+    patients = db.table("patients")
+    after = None
+    while True:
+        docs, after, _ = patients.page("created_at", chunk_size, after, low=start, high=end)
+        # 每批個案的相關紀錄一次由病歷號索引取出
+        record_nos = {doc["medical_record_no"] for doc in docs if doc.get("medical_record_no")}
+        interviews = related_records(db, "interviews", "medical_record_no", record_nos)
+        related = {key: related_records(db, table, field, record_nos)
+                   for key, table, field, _ in RELATED_TABLES}
+        for doc in docs:
+            record_no = doc.get("medical_record_no")
+            found = interviews.get(record_no) if record_no else None
+            case = {"patient": dict(doc), "interview": dict(found[0]) if found else None}
+            for key, groups in related.items():
+                case[key] = [dict(record) for record in groups.get(record_no, ())] if record_no else []
+            yield case
+        if after is None:
+            return
+
+
+def related_records(db, table_name, field, record_nos):
+    """{病歷號: [紀錄, ...]}；沒有可用的索引時逐一查詢"""
+    table = db.table(table_name)
+    groups = table.group_by(field, record_nos)
+    if groups is None:
+        groups = {record_no: table.search(where(field) == record_no) for record_no in record_nos}
+    return groups
+
+
+def csv_columns(db):
+    """CSV 的欄位：(區段, 欄位名稱, 標題)，由各資料表出現過的欄位組成"""
+    columns = [("patient", name, name) for name in db.table("patients").field_names()]
+    columns += [("interview", name, f"interview.{name}") for name in db.table("interviews").field_names()]
+    for key, table, _, prefix in RELATED_TABLES:
+        columns.append((key, None, f"{prefix}_count"))
+        columns += [(key, name, f"{prefix}.{name}") for name in db.table(table).field_names()]
+    return columns
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def csv_row(case, columns):
+    row = []
+    for section, name, _ in columns:
+        record = case[section]
+        if isinstance(record, list):
+            if name is None:
+                row.append(len(record))
+                continue
+            record = record[-1] if record else None
+        row.append(csv_value(record.get(name)) if record else "")
+    return row
+
+
+class _Echo:
+    """讓 csv.writer 直接回傳格式化後的一列"""
+
+    def write(self, line):
+        return line
+
+
+def _lines(db, fmt, start, end):
+    """匯出內容的每一行（bytes）；CSV 第一行前加上 BOM，讓 Excel 正確辨識 UTF-8"""
+    if fmt == "jsonl":
+        codec = JSONCodec()
+        for case in iter_cases(db, start, end):
+            yield codec.dumps(case) + b"\n"
+        return
+    writer = csv.writer(_Echo())
+    columns = csv_columns(db)
+    yield ("\ufeff" + writer.writerow([title for *_, title in columns])).encode("utf-8")
+    for case in iter_cases(db, start, end):
+        yield writer.writerow(csv_row(case, columns)).encode("utf-8")
+
+
+def export_stream(db, fmt, start=None, end=None):
+    """匯出內容，每次產生約 FLUSH_BYTES 的一段（bytes）；格式錯誤時立即拋出 ValueError"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}")
+
+    def chunks():
+        buffer, size = [], 0
+        for line in _lines(db, fmt, start, end):
+            buffer.append(line)
+            size += len(line)
+            if size >= FLUSH_BYTES:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+    return chunks()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from datetime import date, timedelta
+
+    from domdb import get_db
+
+    parser = argparse.ArgumentParser(description="匯出個案資料")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="建檔日起（含）")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="建檔日迄（含）")
+    args = parser.parse_args()
+    start = args.date_from.isoformat() if args.date_from else None
+    end = (args.date_to + timedelta(days=1)).isoformat() if args.date_to else None
+    for chunk in export_stream(get_db(), args.format, start, end):
+        sys.stdout.buffer.write(chunk)
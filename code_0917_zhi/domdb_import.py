@@ -0,0 +1,332 @@
+"""
+個案資料批次匯入（CSV）
+
+合作醫院提供的既有個案清單以 CSV 匯入 patients：
+- 欄位名稱可用中文標題（病歷號、姓名、出生日期、性別、身分證號類別、身分證號、手機、電話、建檔日期）
+  或資料庫欄位名稱；其他欄位略過，列在結果的 ignored_columns
+- 每列先驗證並正規化（日期轉為 YYYY-MM-DD，可接受民國年；性別與證件類別轉為表單使用的代碼；
+  身分證號檢查格式與檢查碼），有錯誤的列不匯入，錯誤逐列列在結果中
+- 依病歷號 upsert：已有的個案只更新 CSV 中有值的欄位，新個案沒有建檔日期時以匯入時間為準
+- 每 CHUNK_SIZE 列以一次寫入（IndexedTable.upsert_by）提交，不會一次讀入整個檔案
+
+匯入進度記在 import_jobs 資料表（以檔案內容的雜湊值識別），與每一批資料在同一次寫入中提交。
+中途失敗後以同一個檔案重新執行，會從最後提交的列之後繼續；已完成的檔案不會重複匯入（--force 除外）。
+
+使用方式:
+python domdb_import.py patients.csv [--chunk-size 1000] [--force]
+"""
+import codecs
+import csv
+import hashlib
+import io
+import logging
+import re
+import time
+from datetime import date, datetime
+
+from tinydb import where
+
+from domdb import batch, get_db
+
+logger = logging.getLogger("domdb")
+
+IMPORT_JOBS_TABLE = "import_jobs"
+CHUNK_SIZE = 1000
+# 結果與 import_jobs 中保留的錯誤列數上限
+MAX_REPORTED_ERRORS = 500
+
+# CSV 標題 → patients 欄位
+HEADER_ALIASES = {
+    "病歷號": "medical_record_no",
+    "姓名": "patient_name",
+    "個案姓名": "patient_name",
+    "出生日期": "birth_date",
+    "生日": "birth_date",
+    "性別": "gender",
+    "身分證號類別": "id_document_type",
+    "證件類別": "id_document_type",
+    "身分證號": "id_document_no",
+    "證件號碼": "id_document_no",
+    "手機": "mobile_phone",
+    "行動電話": "mobile_phone",
+    "電話": "telephone",
+    "市話": "telephone",
+    "建檔日期": "created_at",
+}
+IMPORT_FIELDS = ("medical_record_no", "patient_name", "birth_date", "gender", "id_document_type",
+                 "id_document_no", "mobile_phone", "telephone", "created_at")
+
+GENDER_CODES = {"1": "1", "男": "1", "男性": "1", "m": "1", "male": "1",
+                "2": "2", "女": "2", "女性": "2", "f": "2", "female": "2"}
+ID_DOCUMENT_TYPES = {"1": "1", "身分證": "1", "身分證號": "1", "身分證字號": "1",
+                     "2": "2", "護照": "2", "護照號碼": "2",
+                     "3": "3", "居留證": "3", "居留證號": "3"}
+# 身分證號首字母對應的數值（檢查碼計算用）
+ID_LETTER_VALUES = dict(zip("ABCDEFGHJKLMNPQRSTUVXYWZIO", range(10, 36)))
+ID_PATTERNS = {
+    "1": re.compile(r"[A-Z][12]\d{8}"),
+    "2": re.compile(r"[A-Z0-9]{5,20}"),
+    "3": re.compile(r"[A-Z][A-D89]\d{8}"),
+}
+
+
+class RowError(ValueError):
+    """單一欄位的驗證錯誤"""
+
+
+def parse_date(text):
+    """
+    日期字串轉為 date：YYYY-MM-DD、YYYY/MM/DD、YYYYMMDD，或民國年（69/1/1、0690101）；
+    時間部分（Excel 的 1980-01-01 00:00:00）忽略
+    """
+    text = text.strip().split("T")[0].split(" ")[0]
+    match = re.fullmatch(r"(\d{2,4})[-/.](\d{1,2})[-/.](\d{1,2})", text)
+    if match:
+        year, month, day = map(int, match.groups())
+    elif re.fullmatch(r"\d{8}", text):
+        year, month, day = int(text[:4]), int(text[4:6]), int(text[6:])
+    elif re.fullmatch(r"\d{6,7}", text):
+        year, month, day = int(text[:-4]), int(text[-4:-2]), int(text[-2:])
+    else:
+        raise RowError(f"無法辨識的日期: {text}")
+    if year < 1000:
+        year += 1911  # 民國年
+    try:
+        return date(year, month, day)
+    except ValueError:
+        raise RowError(f"日期不存在: {text}") from None
+
+
+def valid_national_id(value):
+    """身分證號檢查碼"""
+    digits = ID_LETTER_VALUES[value[0]]
+    total = digits // 10 + digits % 10 * 9
+    total += sum(int(d) * w for d, w in zip(value[1:9], range(8, 0, -1)))
+    return (total + int(value[9])) % 10 == 0
+
+
+def normalize_row(row):
+    """CSV 的一列（{欄位: 字串}）驗證並正規化，回傳 (個案資料, 錯誤訊息清單)"""
+    values = {field: (row.get(field) or "").strip() for field in IMPORT_FIELDS}
+    doc, errors = {}, []
+
+    def check(field, convert):
+        if not values[field]:
+            return
+        try:
+            doc[field] = convert(values[field])
+        except RowError as e:
+            errors.append(f"{field}: {e}")
+
+    def record_no(value):
+        value = re.sub(r"\.0$", "", value)  # Excel 把病歷號當成數字時
+        if not re.fullmatch(r"\d{1,8}", value):
+            raise RowError(f"病歷號需為 1 ~ 8 位數字: {value}")
+        return value
+
+    def birth_date(value):
+        day = parse_date(value)
+        if not date(1900, 1, 1) <= day <= date.today():
+            raise RowError(f"出生日期不合理: {value}")
+        return day.isoformat()
+
+    def created_at(value):
+        # ISO 格式（含 Step1 送出的 ...Z）原樣保留，其他日期格式轉為當天 00:00
+        try:
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return value
+        except ValueError:
+            return datetime.combine(parse_date(value), datetime.min.time()).isoformat()
+
+    def code(table, label):
+        def convert(value):
+            if value.lower() not in table:
+                raise RowError(f"無法辨識的{label}: {value}")
+            return table[value.lower()]
+        return convert
+
+    def mobile(value):
+        digits = re.sub(r"[\s()-]", "", value)
+        if re.fullmatch(r"9\d{8}", digits):
+            digits = "0" + digits  # Excel 去掉開頭的 0
+        if not re.fullmatch(r"09\d{8}", digits):
+            raise RowError(f"手機號碼格式錯誤: {value}")
+        return digits
+
+    if not values["medical_record_no"]:
+        errors.append("medical_record_no: 病歷號為必填")
+    check("medical_record_no", record_no)
+    check("patient_name", str)
+    check("birth_date", birth_date)
+    check("gender", code(GENDER_CODES, "性別"))
+    check("id_document_type", code(ID_DOCUMENT_TYPES, "證件類別"))
+    check("id_document_no", lambda value: re.sub(r"\s", "", value).upper())
+    check("mobile_phone", mobile)
+    check("telephone", str)
+    check("created_at", created_at)
+
+    id_no = doc.get("id_document_no")
+    if id_no:
+        id_type = doc.get("id_document_type")
+        if id_type is None and ID_PATTERNS["1"].fullmatch(id_no):
+            id_type = doc["id_document_type"] = "1"
+        pattern = ID_PATTERNS.get(id_type)
+        if pattern is not None and not pattern.fullmatch(id_no):
+            errors.append(f"id_document_no: 證件號碼格式錯誤: {id_no}")
+        elif id_type == "1" and not valid_national_id(id_no):
+            errors.append(f"id_document_no: 身分證號檢查碼錯誤: {id_no}")
+    return doc, errors
+
+
+def file_digest(stream, block_size=1 << 20):
+    """檔案內容的 SHA-256，並判斷編碼：UTF-8（含 BOM）或 Excel 常用的 cp950（Big5）"""
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    encoding = "utf-8-sig"
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        digest.update(block)
+        if encoding == "utf-8-sig":
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                encoding = "cp950"
+    if encoding == "utf-8-sig":
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            encoding = "cp950"
+    return digest.hexdigest(), encoding
+
+
+def header_map(fieldnames):
+    """CSV 標題 → patients 欄位，與略過的標題"""
+    mapping, ignored = {}, []
+    for name in fieldnames or []:
+        key = (name or "").strip()
+        field = HEADER_ALIASES.get(key, key if key in IMPORT_FIELDS else None)
+        if field is None or field in mapping.values():
+            ignored.append(name)
+        else:
+            mapping[name] = field
+    if "medical_record_no" not in mapping.values():
+        raise ValueError("CSV 缺少病歷號欄位")
+    return mapping, ignored
+
+
+def import_patients(stream, name="", chunk_size=CHUNK_SIZE, force=False, progress=None, path=None):
+    """
+    由 CSV（可 seek 的二進位檔案）匯入個案，回傳結果 dict：
+    job_id、rows（資料列數）、imported（匯入的列數，含之前已提交的）、inserted、updated、
+    skipped（從上次進度繼續而略過的列數）、error_count、errors（[{row, medical_record_no, errors}]）、
+    ignored_columns、elapsed、rows_per_sec、status（done / already_done）。
+    progress(result) 在每一批提交後呼叫。檔案格式錯誤（例如缺少病歷號欄位）時拋出 ValueError
+    """
+    started = time.perf_counter()
+    digest, encoding = file_digest(stream)
+    stream.seek(0)
+    db = get_db(path)
+    jobs = db.table(IMPORT_JOBS_TABLE)
+    job = jobs.get(where("file_hash") == digest)
+    if job is not None and job["status"] == "done" and not force:
+        return dict(job, job_id=job.doc_id, status="already_done", skipped=job["rows"])
+    if job is None or force:
+        fresh = {
+            "file_hash": digest, "file_name": name, "status": "running", "rows": 0,
+            "imported": 0, "inserted": 0, "updated": 0, "error_count": 0, "errors": [],
+            "started_at": datetime.now().isoformat(),
+        }
+        if job is None:
+            job_id = jobs.insert(fresh)
+        else:
+            job_id = job.doc_id
+            jobs.update(fresh, doc_ids=[job_id])
+        job = jobs.get(doc_id=job_id)
+    resume_after = job["rows"]
+    state = {key: job[key] for key in ("imported", "inserted", "updated", "error_count", "errors")}
+
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        reader = csv.DictReader(text)
+        mapping, ignored = header_map(reader.fieldnames)
+        result = {"job_id": job.doc_id, "ignored_columns": ignored, "skipped": resume_after}
+        rows, chunk, processed = 0, [], 0
+
+        def commit():
+            # 這一批的個案與匯入進度在同一次寫入中提交
+            with batch(path):
+                if chunk:
+                    inserted, updated = db.table("patients").upsert_by(
+                        "medical_record_no", chunk, defaults={"created_at": datetime.now().isoformat()})
+                    state["inserted"] += inserted
+                    state["updated"] += updated
+                    state["imported"] += len(chunk)
+                jobs.update(dict(state, rows=rows, updated_at=datetime.now().isoformat()),
+                            doc_ids=[job.doc_id])
+            chunk.clear()
+            if progress is not None:
+                progress(_report(result, state, rows, processed, started))
+
+        for line_no, raw in enumerate(reader, start=2):  # 第 1 行為標題
+            rows += 1
+            if rows <= resume_after:
+                continue
+            processed += 1
+            row = {field: raw.get(column) for column, field in mapping.items()}
+            doc, errors = normalize_row(row)
+            if errors:
+                state["error_count"] += 1
+                if len(state["errors"]) < MAX_REPORTED_ERRORS:
+                    state["errors"].append({"row": line_no, "errors": errors,
+                                            "medical_record_no": (row["medical_record_no"] or "").strip()})
+            else:
+                chunk.append(doc)
+            if processed % chunk_size == 0:
+                commit()
+        commit()
+        jobs.update({"status": "done", "finished_at": datetime.now().isoformat()}, doc_ids=[job.doc_id])
+    except Exception as e:
+        jobs.update({"status": "failed", "message": str(e)}, doc_ids=[job.doc_id])
+        logger.error(f"個案匯入失敗（{name or digest[:12]}）: {e}")
+        raise
+    finally:
+        text.detach()
+    report = dict(_report(result, state, rows, processed, started), status="done")
+    logger.info(f"個案匯入完成（{name or digest[:12]}）: {report['imported']} 列，"
+                f"新增 {report['inserted']}、更新 {report['updated']}、錯誤 {report['error_count']}，"
+                f"{report['rows_per_sec']:.0f} 列/秒")
+    return report
+
+
+def _report(result, state, rows, processed, started):
+    elapsed = time.perf_counter() - started
+    return dict(result, **state, rows=rows, elapsed=round(elapsed, 3),
+                rows_per_sec=round(processed / elapsed, 1) if elapsed else 0.0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="由 CSV 批次匯入個案")
+    parser.add_argument("csv_path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--force", action="store_true", help="已匯入完成的檔案也重新匯入")
+    args = parser.parse_args()
+
+    def show_progress(report):
+        print(f"  已處理 {report['rows']} 列（錯誤 {report['error_count']}），{report['rows_per_sec']:.0f} 列/秒")
+
+    with open(args.csv_path, "rb") as f:
+        report = import_patients(f, args.csv_path, args.chunk_size, args.force, show_progress)
+    if report["status"] == "already_done":
+        print(f"此檔案已於 {report.get('finished_at', '-')} 匯入完成（--force 可重新匯入）")
+    else:
+        for error in report["errors"]:
+            print(f"第 {error['row']} 列 {error['medical_record_no']}: {'；'.join(error['errors'])}")
+        if report["error_count"] > len(report["errors"]):
+            print(f"... 另有 {report['error_count'] - len(report['errors'])} 列錯誤未列出")
+        print(f"完成：{report['rows']} 列，匯入 {report['imported']}（新增 {report['inserted']}、"
+              f"更新 {report['updated']}），錯誤 {report['error_count']}，"
+              f"{report['elapsed']:.1f} 秒，{report['rows_per_sec']:.0f} 列/秒")
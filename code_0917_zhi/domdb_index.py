@@ -0,0 +1,1409 @@
+"""
+domdb 的索引資料表
+
+TinyDB 的 get / search 每次都會掃描整個資料表。IndexedTable 依照
+index_definitions 為指定欄位維護雜湊索引，並在所有寫入路徑
+（insert / update / upsert / remove / truncate）同步更新。
+
+查詢條件若含有索引欄位的等值比對（例如 where("medical_record_no") == mrn，
+或以 & 組合的條件），會先由索引取得候選文件再套用完整條件，
+因此既有的 domdb 函式與路由不需修改即可使用索引。
+
+change_listeners 讓其他模組在特定資料表寫入時維護衍生資料（例如首頁統計），
+衍生資料的寫入與原本的寫入在同一個批次中提交。
+"""
+import bisect
+import threading
+from collections import Counter
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+
+from tinydb.table import Table
+
+from domdb_storage import TableChange, apply_to_tables, field_expr, loads, table_scope
+
+_MISSING = object()
+# 只對可雜湊的純量值建立索引
+_INDEXABLE = (str, int, float, bool, type(None))
+
+
+class HashIndex:
+    """
+    單一欄位的雜湊索引：欄位值 → 文件 ID。
+    文件 ID 存在依加入順序的 dict 中，值相同的文件很多時（例如進度欄位）移除也是 O(1)
+    """
+
+    def __init__(self, field, unique=False):
+        self.field = field
+        self.unique = unique
+        self._entries = {}
+        self._keys = {}
+
+    def clear(self):
+        self._entries.clear()
+        self._keys.clear()
+
+    def key_of(self, doc):
+        value = doc.get(self.field, _MISSING)
+        if value is _MISSING or not isinstance(value, _INDEXABLE):
+            return _MISSING
+        return value
+
+    def add(self, doc_id, doc):
+        value = self.key_of(doc)
+        if value is _MISSING:
+            return
+        self._keys[doc_id] = value
+        self._entries.setdefault(value, {})[doc_id] = None
+
+    def discard(self, doc_id):
+        value = self._keys.pop(doc_id, _MISSING)
+        if value is _MISSING:
+            return
+        ids = self._entries.get(value)
+        if ids:
+            ids.pop(doc_id, None)
+            if not ids:
+                del self._entries[value]
+
+    def key_for_id(self, doc_id):
+        return self._keys.get(doc_id, _MISSING)
+
+    def ids(self, value):
+        """符合欄位值的文件 ID（不排序、不複製，只供讀取）"""
+        return self._entries.get(value, ())
+
+    def values(self):
+        """索引中出現過的欄位值"""
+        return list(self._entries)
+
+    def lookup(self, value):
+        """回傳符合欄位值的文件 ID（依 ID 排序，與全表掃描順序一致）"""
+        ids = self._entries.get(value)
+        if not ids:
+            return []
+        if len(ids) == 1:
+            return list(ids)
+        return sorted(ids, key=int)
+
+    def load(self, docs):
+        """以 {文件 ID: 文件} 重建整個索引"""
+        self.clear()
+        for doc_id, doc in docs.items():
+            self.add(doc_id, doc)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SortedIndex:
+    """
+    單一欄位的排序索引：(欄位值, 文件 ID) 依序排列，可用二分搜尋查範圍與依序分頁。
+    只索引字串值（例如 ISO 格式的 created_at），不同型別的值無法互相比較
+    """
+
+    def __init__(self, field, unique=False):
+        self.field = field
+        self.unique = unique
+        self._items = []
+        self._keys = {}
+
+    def clear(self):
+        self._items = []
+        self._keys.clear()
+
+    def key_of(self, doc):
+        value = doc.get(self.field, _MISSING)
+        return value if isinstance(value, str) else _MISSING
+
+    def add(self, doc_id, doc):
+        value = self.key_of(doc)
+        if value is _MISSING:
+            return
+        self._keys[doc_id] = value
+        bisect.insort(self._items, (value, int(doc_id)))
+
+    def load(self, docs):
+        """以 {文件 ID: 文件} 重建整個索引（排序一次，不逐筆插入）"""
+        self.clear()
+        for doc_id, doc in docs.items():
+            value = self.key_of(doc)
+            if value is not _MISSING:
+                self._keys[doc_id] = value
+                self._items.append((value, int(doc_id)))
+        self._items.sort()
+
+    def discard(self, doc_id):
+        value = self._keys.pop(doc_id, _MISSING)
+        if value is _MISSING:
+            return
+        item = (value, int(doc_id))
+        i = bisect.bisect_left(self._items, item)
+        if i < len(self._items) and self._items[i] == item:
+            del self._items[i]
+
+    def key_for_id(self, doc_id):
+        return self._keys.get(doc_id, _MISSING)
+
+    def _bounds(self, low, high):
+        # (值,) 排在所有 (值, 文件 ID) 之前
+        start = 0 if low is None else bisect.bisect_left(self._items, (low,))
+        end = len(self._items) if high is None else bisect.bisect_left(self._items, (high,))
+        return start, max(start, end)
+
+    def lookup(self, value):
+        """符合欄位值的文件 ID；非字串的值不在索引中，回傳 None 表示需掃描"""
+        if not isinstance(value, str):
+            return None
+        start = bisect.bisect_left(self._items, (value,))
+        end = bisect.bisect_right(self._items, (value, float("inf")))
+        return [str(doc_id) for _, doc_id in self._items[start:end]]
+
+    def count_range(self, low=None, high=None):
+        """欄位值在 [low, high) 的文件數"""
+        start, end = self._bounds(low, high)
+        return end - start
+
+    def range_ids(self, low=None, high=None):
+        """欄位值在 [low, high) 的文件 ID，依欄位值排序"""
+        start, end = self._bounds(low, high)
+        return [str(doc_id) for _, doc_id in self._items[start:end]]
+
+    def walk(self, after=None, descending=False, doc_ids=(), low=None, high=None):
+        """
+        依 (欄位值, 文件 ID) 的順序產生鍵，從 after 之後開始（不含 after）。
+        doc_ids 為資料表所有文件 ID；沒有字串值的文件以 (None, 文件 ID) 排在最前面。
+        low / high 限定欄位值在 [low, high)，此時不含沒有字串值的文件
+        """
+        bounded = low is not None or high is not None
+
+        def missing():
+            if bounded or len(self._keys) == len(doc_ids):
+                return []
+            return sorted(int(i) for i in doc_ids if i not in self._keys)
+
+        items = self._items
+        if not descending:
+            if after is None or after[0] is None:
+                for doc_id in missing():
+                    if after is None or doc_id > after[1]:
+                        yield (None, doc_id)
+                start = 0
+            else:
+                start = bisect.bisect_right(items, tuple(after))
+            if low is not None:
+                start = max(start, bisect.bisect_left(items, (low,)))
+            for i in range(start, len(items)):
+                if high is not None and items[i][0] >= high:
+                    return
+                yield items[i]
+            return
+        if after is None:
+            start = len(items) - 1
+        elif after[0] is None:
+            start = -1
+        else:
+            start = bisect.bisect_left(items, tuple(after)) - 1
+        if high is not None:
+            start = min(start, bisect.bisect_left(items, (high,)) - 1)
+        for i in range(start, -1, -1):
+            if low is not None and items[i][0] < low:
+                return
+            yield items[i]
+        for doc_id in reversed(missing()):
+            if after is None or after[0] is not None or doc_id < after[1]:
+                yield (None, doc_id)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CompositeIndex:
+    """
+    多個欄位的複合索引：欄位值的組合 → 該組文件依 order_by 欄位的排序索引（SortedIndex）。
+    等值條件（例如 phone_status）直接依 order_by 的順序走訪該組文件、查範圍或計數，
+    不需先取出全部候選再排序。任一欄位缺少或不是純量值的文件不索引；
+    order_by 沒有字串值的文件與 SortedIndex 相同，排在該組最前面
+    """
+
+    unique = False
+
+    def __init__(self, fields, order_by):
+        self.fields = tuple(fields)
+        self.order_by = order_by
+        self._groups = {}   # 欄位值組合 → SortedIndex
+        self._members = {}  # 欄位值組合 → {文件 ID: None}
+        self._keys = {}     # 文件 ID → 欄位值組合
+
+    def clear(self):
+        self._groups.clear()
+        self._members.clear()
+        self._keys.clear()
+
+    def key_of(self, doc):
+        values = tuple(doc.get(field, _MISSING) for field in self.fields)
+        if any(value is _MISSING or not isinstance(value, _INDEXABLE) for value in values):
+            return _MISSING
+        return values
+
+    def add(self, doc_id, doc):
+        values = self.key_of(doc)
+        if values is _MISSING:
+            return
+        self._keys[doc_id] = values
+        self._members.setdefault(values, {})[doc_id] = None
+        self._groups.setdefault(values, SortedIndex(self.order_by)).add(doc_id, doc)
+
+    def load(self, docs):
+        """以 {文件 ID: 文件} 重建整個索引（每組排序一次，不逐筆插入）"""
+        self.clear()
+        groups = {}
+        for doc_id, doc in docs.items():
+            values = self.key_of(doc)
+            if values is not _MISSING:
+                self._keys[doc_id] = values
+                groups.setdefault(values, {})[doc_id] = doc
+        for values, group in groups.items():
+            self._members[values] = dict.fromkeys(group)
+            self._groups[values] = SortedIndex(self.order_by)
+            self._groups[values].load(group)
+
+    def discard(self, doc_id):
+        values = self._keys.pop(doc_id, _MISSING)
+        if values is _MISSING:
+            return
+        self._groups[values].discard(doc_id)
+        members = self._members[values]
+        members.pop(doc_id, None)
+        if not members:
+            del self._members[values]
+            del self._groups[values]
+
+    def key_for_id(self, doc_id):
+        return self._keys.get(doc_id, _MISSING)
+
+    def lookup(self, values):
+        """欄位值組合為 values 的文件 ID（依 ID 排序，與全表掃描順序一致）"""
+        return sorted(self._members.get(tuple(values), ()), key=int)
+
+    def count(self, values, low=None, high=None):
+        """欄位值組合為 values 的文件數；low / high 限定排序值在 [low, high)"""
+        values = tuple(values)
+        if values not in self._groups:
+            return 0
+        if low is None and high is None:
+            return len(self._members[values])
+        return self._groups[values].count_range(low, high)
+
+    def walk(self, values, after=None, descending=False, low=None, high=None):
+        """欄位值組合為 values 的 (排序值, 文件 ID)，參數同 SortedIndex.walk"""
+        values = tuple(values)
+        if values not in self._groups:
+            return iter(())
+        return self._groups[values].walk(after, descending, self._members[values], low, high)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class NgramIndex:
+    """
+    一或多個文字欄位的 n-gram 倒排索引（單字與雙字 → 文件 ID），用於子字串搜尋。
+    中文姓名多為二、三個字，單字與雙字已足以縮小候選範圍；候選文件再以實際內容確認。
+    比對不分大小寫。
+
+    整個重建的成本較高（10 萬筆約 2 秒），因此 load() 只標記為過期，
+    等第一次搜尋時才由 IndexedTable.search_text 以當時的資料重建
+    """
+
+    unique = False
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._postings = {}
+        self._grams = {}
+        self.stale = False
+
+    @staticmethod
+    def grams(text):
+        text = text.casefold()
+        return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def clear(self):
+        self._postings.clear()
+        self._grams.clear()
+
+    def key_for_id(self, doc_id):
+        return _MISSING
+
+    def doc_grams(self, doc):
+        """文件在索引欄位中的所有 n-gram"""
+        grams = set()
+        for text in field_texts(doc, self.fields):
+            grams |= self.grams(text)
+        return grams
+
+    @staticmethod
+    def needle_grams(needle):
+        """搜尋 needle（已 casefold）時需要全部出現的 n-gram"""
+        if len(needle) == 1:
+            return {needle}
+        return {needle[i:i + 2] for i in range(len(needle) - 1)}
+
+    def add(self, doc_id, doc):
+        if self.stale:
+            return
+        grams = self.doc_grams(doc)
+        if not grams:
+            return
+        self._grams[doc_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(doc_id)
+
+    def discard(self, doc_id):
+        for gram in self._grams.pop(doc_id, ()):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def load(self, docs):
+        self.clear()
+        self.stale = True
+
+    def build(self, docs):
+        self.clear()
+        self.stale = False
+        for doc_id, doc in docs.items():
+            self.add(doc_id, doc)
+
+    def candidates(self, needle):
+        """可能含有 needle（已 casefold）的文件 ID"""
+        postings = [self._postings.get(gram) for gram in self.needle_grams(needle)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        ids = set(postings[0])
+        for other in postings[1:]:
+            ids &= other
+            if not ids:
+                break
+        return ids
+
+    def __len__(self):
+        return len(self._grams)
+
+
+def field_texts(doc, fields):
+    """文件中可供文字搜尋的欄位值（字串或整數）"""
+    texts = []
+    for field in fields:
+        value = doc.get(field)
+        if isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool)):
+            texts.append(str(value))
+    return texts
+
+
+def project(doc, columns):
+    """文件在 columns 各欄位的值（缺少的欄位為 None），用於只需要少數欄位的列表"""
+    return tuple(doc.get(column) for column in columns)
+
+
+def text_rank(doc, fields, needle):
+    """needle（已 casefold）與文件的相符程度：0 完全相符、1 開頭相符、2 包含；不符合為 None"""
+    best = None
+    for text in field_texts(doc, fields):
+        text = text.casefold()
+        if text == needle:
+            return 0
+        if text.startswith(needle):
+            best = 1
+        elif best is None and needle in text:
+            best = 2
+    return best
+
+
+def docs_by_id(table, doc_ids):
+    """資料表中 doc_ids 的文件 {文件 ID: 文件}；SQLite 的資料表以一次查詢取出"""
+    get_many = getattr(table, "get_many", None)
+    if get_many is not None:
+        return get_many(doc_ids)
+    return {doc_id: table[doc_id] for doc_id in doc_ids if doc_id in table}
+
+
+def make_index(field, spec):
+    """
+    依 index_definitions 的設定建立索引：True / False 為雜湊索引（是否唯一），
+    "sorted" / "sorted_unique" 為排序索引，"ngram" 為文字搜尋索引
+    （field 可為多個欄位的 tuple），("composite", 排序欄位) 為多個欄位（tuple）的複合索引
+    """
+    if isinstance(spec, tuple) and spec[0] == "composite":
+        return CompositeIndex(field, order_by=spec[1])
+    if spec == "ngram":
+        return NgramIndex(field if isinstance(field, tuple) else (field,))
+    if spec in ("sorted", "sorted_unique"):
+        return SortedIndex(field, unique=spec == "sorted_unique")
+    return HashIndex(field, spec)
+
+
+
+class SQLiteIndex:
+    """
+    SQLiteStorage 的索引：資料與索引都在 SQLite 中（見 domdb_storage.create_schema），
+    查詢時才向 SQLite 取結果，記憶體中不保留任何項目；寫入時由 SQLite 自行維護運算式索引。
+    查詢條件的寫法需與 create_schema 建立的索引一致（field_expr、table_scope）
+    """
+
+    # 不需由 IndexedTable 以文件重建
+    persistent = True
+    # 走訪時每批取出的列數，第一批小（多數分頁只要幾十筆），之後逐批加倍
+    FIRST_BATCH = 64
+    MAX_BATCH = 2048
+
+    def attach(self, storage, table):
+        self.storage = storage
+        self.table = table
+        self.scope = table_scope(table)
+
+    def clear(self):
+        pass
+
+    def add(self, doc_id, doc):
+        pass
+
+    def discard(self, doc_id):
+        pass
+
+    def load(self, docs):
+        pass
+
+    def key_for_id(self, doc_id):
+        doc = self.storage.read().get(self.table).get(doc_id)
+        return _MISSING if doc is None else self.key_of(doc)
+
+    @staticmethod
+    def _equals(field, value):
+        """field 等於 value 的條件與參數；JSON 的 null 與缺少欄位在 json_extract 中都是 NULL"""
+        expr = field_expr(field)
+        if value is None:
+            return f"{expr} IS NULL AND json_type(body, '$.{field}') = 'null'", []
+        return f"{expr} = ?", [value]
+
+    def _where(self, conds):
+        return " AND ".join([self.scope, *conds])
+
+    def _ids(self, conds, params):
+        """符合條件的文件 ID（依 ID 排序）"""
+        return [str(doc_id) for doc_id, in self.storage.query(
+            f"SELECT doc_id FROM documents WHERE {self._where(conds)} ORDER BY doc_id", params)]
+
+    def _count(self, conds, params):
+        return self.storage.query(
+            f"SELECT COUNT(*) FROM documents WHERE {self._where(conds)}", params)[0][0]
+
+    def _batches(self, conds, params, keys, after=None, descending=False):
+        """依 keys 的順序分批取出 (keys..., body)，每批從上一批的最後一列之後開始"""
+        order = " DESC" if descending else ""
+        size = self.FIRST_BATCH
+        while True:
+            where, args = list(conds), list(params)
+            if after is not None:
+                where.append(f"({', '.join(keys)}) {'<' if descending else '>'} ({', '.join('?' * len(keys))})")
+                args += after
+            rows = self.storage.query(
+                f"SELECT {', '.join(keys)}, body FROM documents WHERE {self._where(where)}"
+                f" ORDER BY {', '.join(key + order for key in keys)} LIMIT {size}", args)
+            yield from rows
+            if len(rows) < size:
+                return
+            after = rows[-1][:-1]
+            size = min(size * 2, self.MAX_BATCH)
+
+    def _walk(self, conds, params, field, after=None, descending=False, low=None, high=None):
+        """
+        依 (field 的字串值, 文件 ID) 的順序產生 (值, 文件 ID, 文件)，參數與順序同 SortedIndex.walk。
+        SQLite 中 NULL 與數字排在字串之前，以 expr >= '' 只取字串值
+        """
+        expr = field_expr(field)
+        text_conds = [*conds, f"{expr} >= ?"]
+        text_params = [*params, "" if low is None else low]
+        if high is not None:
+            text_conds.append(f"{expr} < ?")
+            text_params.append(high)
+        bounded = low is not None or high is not None
+
+        def texts(start):
+            for value, doc_id, body in self._batches(
+                    text_conds, text_params, [expr, "doc_id"], start, descending):
+                yield value, doc_id, loads(body)
+
+        def missing(start):
+            if bounded:
+                return
+            for doc_id, body in self._batches(
+                    [*conds, f"({expr} IS NULL OR {expr} < '')"], params, ["doc_id"], start, descending):
+                yield None, doc_id, loads(body)
+
+        if after is not None:
+            after = (after[0], int(after[1]))
+        if not descending:
+            if after is None or after[0] is None:
+                yield from missing(None if after is None else after[1:])
+                yield from texts(None)
+            else:
+                yield from texts(after)
+        elif after is not None and after[0] is None:
+            yield from missing(after[1:])
+        else:
+            yield from texts(after)
+            yield from missing(None)
+
+
+class SQLiteHashIndex(SQLiteIndex, HashIndex):
+    """HashIndex 的 SQLite 版本，以欄位的運算式索引查詢"""
+
+    def ids(self, value):
+        return self.lookup(value)
+
+    def lookup(self, value):
+        return self._ids(*self._one(value))
+
+    def _one(self, value):
+        cond, params = self._equals(self.field, value)
+        return [cond], params
+
+    def values(self):
+        expr = field_expr(self.field)
+        return [value for value, in self.storage.query(
+            f"SELECT DISTINCT {expr} FROM documents WHERE {self._where([f'{expr} IS NOT NULL'])}")]
+
+    def __len__(self):
+        expr = field_expr(self.field)
+        return self.storage.query(
+            f"SELECT COUNT(DISTINCT {expr}) FROM documents WHERE {self.scope}")[0][0]
+
+
+class SQLiteSortedIndex(SQLiteIndex, SortedIndex):
+    """SortedIndex 的 SQLite 版本，範圍查詢、計數與依序走訪都沿運算式索引進行"""
+
+    def _range(self, low, high):
+        expr = field_expr(self.field)
+        conds, params = [f"{expr} >= ?"], ["" if low is None else low]
+        if high is not None:
+            conds.append(f"{expr} < ?")
+            params.append(high)
+        return conds, params
+
+    def lookup(self, value):
+        if not isinstance(value, str):
+            return None
+        return self._ids([f"{field_expr(self.field)} = ?"], [value])
+
+    def count_range(self, low=None, high=None):
+        return self._count(*self._range(low, high))
+
+    def range_ids(self, low=None, high=None):
+        conds, params = self._range(low, high)
+        return [str(doc_id) for doc_id, in self.storage.query(
+            f"SELECT doc_id FROM documents WHERE {self._where(conds)}"
+            f" ORDER BY {field_expr(self.field)}, doc_id", params)]
+
+    def walk(self, after=None, descending=False, doc_ids=(), low=None, high=None):
+        """同 SortedIndex.walk；沒有字串值的文件由 SQLite 查出，不需要 doc_ids"""
+        return self._walk([], [], self.field, after, descending, low, high)
+
+    def __len__(self):
+        return self.count_range()
+
+
+class SQLiteCompositeIndex(SQLiteIndex, CompositeIndex):
+    """CompositeIndex 的 SQLite 版本，以 (各欄位, 排序欄位, 文件 ID) 的運算式索引查詢"""
+
+    def _group(self, values):
+        conds, params = [], []
+        for field, value in zip(self.fields, values):
+            cond, args = self._equals(field, value)
+            conds.append(cond)
+            params += args
+        return conds, params
+
+    def lookup(self, values):
+        return self._ids(*self._group(values))
+
+    def count(self, values, low=None, high=None):
+        conds, params = self._group(values)
+        if low is not None or high is not None:
+            expr = field_expr(self.order_by)
+            conds.append(f"{expr} >= ?")
+            params.append("" if low is None else low)
+            if high is not None:
+                conds.append(f"{expr} < ?")
+                params.append(high)
+        return self._count(conds, params)
+
+    def walk(self, values, after=None, descending=False, low=None, high=None):
+        conds, params = self._group(values)
+        return self._walk(conds, params, self.order_by, after, descending, low, high)
+
+    def __len__(self):
+        return self._count([f"json_type(body, '$.{field}') IS NOT NULL" for field in self.fields], [])
+
+
+class SQLiteNgramIndex(SQLiteIndex, NgramIndex):
+    """
+    NgramIndex 的 SQLite 版本：n-gram 存在 text_grams 資料表，隨文件寫入在同一交易中更新。
+    尚未建立（新資料庫、整份覆寫或搬移後）時由第一次搜尋在寫入交易中建立
+    """
+
+    def attach(self, storage, table):
+        super().attach(storage, table)
+        self.key = ",".join(self.fields)
+        self._built = None  # (table_generation, 是否已建立)
+
+    def key_for_id(self, doc_id):
+        return _MISSING
+
+    def is_built(self):
+        generation = self.storage.table_generation(self.table)
+        if self._built is not None and self._built[0] == generation:
+            return self._built[1]
+        built = bool(self.storage.query(
+            "SELECT 1 FROM text_grams_built WHERE tbl = ? AND fields = ?", (self.table, self.key)))
+        if not self.storage.in_transaction():
+            # 交易中看得到尚未提交的內容，不給其他執行緒沿用
+            self._built = (generation, built)
+        return built
+
+    def add(self, doc_id, doc):
+        grams = self.doc_grams(doc)
+        if grams and self.is_built():
+            self.storage.execute_many(
+                "INSERT OR IGNORE INTO text_grams (tbl, fields, gram, doc_id) VALUES (?, ?, ?, ?)",
+                [(self.table, self.key, gram, int(doc_id)) for gram in grams])
+
+    def discard(self, doc_id):
+        if self.is_built():
+            self.storage.execute_many(
+                "DELETE FROM text_grams WHERE tbl = ? AND fields = ? AND doc_id = ?",
+                [(self.table, self.key, int(doc_id))])
+
+    def load(self, docs):
+        """整個資料表被取代時（truncate / replace_all）以新的文件重建"""
+        self.build(docs)
+
+    def build(self, docs):
+        self.storage.execute_many(
+            "DELETE FROM text_grams WHERE tbl = ? AND fields = ?", [(self.table, self.key)])
+        self.storage.execute_many(
+            "INSERT OR IGNORE INTO text_grams (tbl, fields, gram, doc_id) VALUES (?, ?, ?, ?)",
+            [(self.table, self.key, gram, int(doc_id))
+             for doc_id, doc in docs.items() for gram in self.doc_grams(doc)])
+        self.storage.execute_many(
+            "INSERT OR IGNORE INTO text_grams_built (tbl, fields) VALUES (?, ?)", [(self.table, self.key)])
+
+    def candidates(self, needle):
+        """可能含有 needle（已 casefold）的文件 ID；需在資料表鎖外呼叫（可能要建立索引）"""
+        if not self.is_built():
+            with self.storage.write_lock():
+                self._built = None
+                if not self.is_built():
+                    self.build(self.storage.read().get(self.table))
+            self._built = None
+        grams = sorted(self.needle_grams(needle))
+        sql = " INTERSECT ".join(
+            ["SELECT doc_id FROM text_grams WHERE tbl = ? AND fields = ? AND gram = ?"] * len(grams))
+        params = [arg for gram in grams for arg in (self.table, self.key, gram)]
+        return {str(doc_id) for doc_id, in self.storage.query(sql, params)}
+
+    def __len__(self):
+        return self.storage.query(
+            "SELECT COUNT(DISTINCT doc_id) FROM text_grams WHERE tbl = ? AND fields = ?",
+            (self.table, self.key))[0][0]
+
+
+def make_sqlite_index(storage, table, field, spec):
+    """make_index 的 SQLiteStorage 版本"""
+    if isinstance(spec, tuple) and spec[0] == "composite":
+        index = SQLiteCompositeIndex(field, order_by=spec[1])
+    elif spec == "ngram":
+        index = SQLiteNgramIndex(field if isinstance(field, tuple) else (field,))
+    elif spec in ("sorted", "sorted_unique"):
+        index = SQLiteSortedIndex(field, unique=spec == "sorted_unique")
+    else:
+        index = SQLiteHashIndex(field, spec)
+    index.attach(storage, table)
+    return index
+
+def equality_terms(cond):
+    """從 TinyDB 查詢中取出可用索引的等值條件 (欄位, 值)"""
+    terms = []
+
+    def walk(h):
+        if not isinstance(h, tuple) or not h:
+            return
+        if h[0] == "==" and len(h) == 3 and len(h[1]) == 1 and isinstance(h[1][0], str):
+            if isinstance(h[2], _INDEXABLE):
+                terms.append((h[1][0], h[2]))
+        elif h[0] == "and" and len(h) == 2:
+            for sub in h[1]:
+                walk(sub)
+
+    walk(getattr(cond, "_hash", None))
+    return terms
+
+
+class IndexedTable(Table):
+    """維護次要索引的 TinyDB 資料表"""
+
+    # {資料表名稱: {欄位: 索引設定}}，由 domdb 設定（見 make_index）
+    index_definitions = {}
+    # {資料表名稱: [listener]}；listener(table, old_docs, new_docs) 在寫入前呼叫，
+    # old_docs / new_docs 為 {文件 ID: 寫入前 / 後的內容，不存在為 None}，
+    # 可回傳一個在寫入後呼叫的函式
+    change_listeners = {}
+
+    def __init__(self, storage, name, **kwargs):
+        super().__init__(storage, name, **kwargs)
+        self._lock = threading.RLock()
+        definitions = self.index_definitions.get(name, {})
+        if getattr(storage, "sql_indexes", False):
+            self._indexes = {field: make_sqlite_index(storage, name, field, spec)
+                             for field, spec in definitions.items()}
+        else:
+            self._indexes = {field: make_index(field, spec) for field, spec in definitions.items()}
+        self._indexed_generation = None
+
+    def _raw_table(self):
+        """儲存層中的資料表 dict 本身（不複製），只用於單筆存取"""
+        tables = self._storage.read()
+        table = None if tables is None else tables.get(self.name)
+        return {} if table is None else table
+
+    def _read_table(self):
+        # TinyDB 的全表掃描會走訪整個 dict；給它淺拷貝，避免其他執行緒寫入時 dict 大小改變。
+        # 唯讀的參考資料表不會被改動，直接走訪即可
+        is_read_only = getattr(self._storage, "is_read_only", None)
+        if is_read_only is not None and is_read_only(self.name):
+            return self._raw_table()
+        return self._raw_table().copy()
+
+    def _get_next_id(self):
+        table = self._raw_table()
+        max_id = getattr(table, "max_id", None)
+        if max_id is not None:
+            # SQLite：每次查詢目前最大的 ID（含其他行程新增的文件），本行程發出過的 ID 不重複使用
+            next_id = max(self._next_id or 1, max_id() + 1)
+        elif self._next_id is not None:
+            next_id = self._next_id
+        else:
+            next_id = max(map(int, table), default=0) + 1
+        self._next_id = next_id + 1
+        return next_id
+
+    # ---------- 索引維護 ----------
+
+    def _storage_generation(self):
+        table_generation = getattr(self._storage, "table_generation", None)
+        if table_generation is not None:
+            return table_generation(self.name)
+        return getattr(self._storage, "generation", None)
+
+    def _sync(self):
+        """
+        確認記憶體狀態與儲存層一致：儲存層重新載入過（其他行程寫入）時，
+        重建索引並重新計算下一個文件 ID
+        """
+        self._storage.read()
+        generation = self._storage_generation()
+        if generation is None or self._indexed_generation == generation:
+            return
+        # 先在資料表鎖外讀取：儲存層讀取可能要等寫入中的執行緒，而它可能正在等這個資料表鎖。
+        # SQLite 的索引在資料庫中，不需重建
+        stale = [i for i in self._indexes.values() if not getattr(i, "persistent", False)]
+        docs = self._read_table() if stale else {}
+        with self._lock:
+            if self._indexed_generation == generation:
+                return
+            for index in stale:
+                index.load(docs)
+            self._indexed_generation = generation
+            if not getattr(self._storage, "sql_indexes", False):
+                self._next_id = None
+            self.clear_cache()
+
+    def _indexes_ready(self):
+        """確認索引可用且與儲存層一致；儲存層不支援 generation 時回傳 False"""
+        if not self._indexes:
+            return False
+        self._sync()
+        return self._indexed_generation is not None
+
+    @contextmanager
+    def _write_lock(self):
+        """取得儲存層的跨行程寫入鎖（先於資料表鎖），並同步其他行程的寫入"""
+        write_lock = getattr(self._storage, "write_lock", None)
+        with (write_lock() if write_lock else nullcontext()), self._lock:
+            self._sync()
+            yield
+
+    def _index_docs(self, docs):
+        for doc_id, doc in docs.items():
+            for index in self._indexes.values():
+                index.discard(doc_id)
+                index.add(doc_id, doc)
+
+    def _unindex_docs(self, doc_ids):
+        for doc_id in doc_ids:
+            for index in self._indexes.values():
+                index.discard(doc_id)
+
+    def _check_unique(self, docs):
+        """新增或更新前檢查唯一索引，docs 為 {文件 ID: 寫入後內容}"""
+        if not self._indexes_ready():
+            return
+        for index in self._indexes.values():
+            if not index.unique:
+                continue
+            seen = {}
+            for doc_id, doc in docs.items():
+                value = index.key_of(doc)
+                # 值未改變的文件不檢查，既有資料中的重複值不影響其他欄位的更新
+                if value is _MISSING or index.key_for_id(doc_id) == value:
+                    continue
+                owners = [i for i in index.lookup(value) or () if i not in docs]
+                if owners or value in seen:
+                    raise ValueError(f"{self.name}.{index.field} 唯一索引衝突: {value}")
+                seen[value] = doc_id
+
+    def candidate_ids(self, cond):
+        """
+        依索引取得可能符合條件的文件 ID；無法使用索引時回傳 None。
+        等值條件涵蓋複合索引的所有欄位時也可使用複合索引（候選依 ID 排序，與全表掃描順序一致）
+        """
+        terms = [t for t in equality_terms(cond) if t[0] in self._indexes]
+        composites = self._composite_terms(cond)
+        if not (terms or composites) or not self._indexes_ready():
+            return None
+        best = None
+        candidates = [self._indexes[field].lookup(value) for field, value in terms]
+        candidates += [index.lookup(values) for index, values in composites]
+        for ids in candidates:
+            if ids is not None and (best is None or len(ids) < len(best)):
+                best = ids
+        return best
+
+    def _composite_terms(self, cond):
+        """
+        條件中涵蓋所有欄位的複合索引與對應的欄位值 [(索引, 欄位值 tuple)]；
+        單一欄位另有自己的索引時不使用（結果相同，不需再依排序欄位走訪一次）
+        """
+        indexes = [i for i in self._indexes.values() if isinstance(i, CompositeIndex)
+                   and not (len(i.fields) == 1 and i.fields[0] in self._indexes)]
+        if not indexes:
+            return []
+        values = dict(equality_terms(cond))
+        return [(index, tuple(values[field] for field in index.fields))
+                for index in indexes if all(field in values for field in index.fields)]
+
+    def _matching_ids(self, cond, table):
+        ids = self.candidate_ids(cond)
+        if ids is None:
+            return [doc_id for doc_id, doc in table.items() if cond(doc)]
+        docs = docs_by_id(table, ids)
+        return [doc_id for doc_id in ids if doc_id in docs and cond(docs[doc_id])]
+
+    # ---------- 寫入 ----------
+
+    def _write_changes(self, upserts=None, removes=(), truncate=False):
+        """
+        將變更交給儲存層寫回並更新索引；
+        有 listener 時連同衍生資料以一次批次提交
+        """
+        change = TableChange(self.name, upserts or {}, list(removes), truncate)
+        listeners = self.change_listeners.get(self.name)
+        if not listeners:
+            self._apply_change(change)
+            return
+        table = self._raw_table()
+        if truncate:
+            found = dict(table.items())
+            old_docs = dict(found)
+        else:
+            found = docs_by_id(table, [*change.removes, *change.upserts])
+            old_docs = {doc_id: found.get(doc_id) for doc_id in change.removes}
+        old_docs.update((doc_id, found.get(doc_id)) for doc_id in change.upserts)
+        new_docs = dict.fromkeys(old_docs)
+        new_docs.update(change.upserts)
+        storage_batch = getattr(self._storage, "batch", None)
+        with (storage_batch() if storage_batch else nullcontext()):
+            finishers = [listener(self, old_docs, new_docs) for listener in listeners]
+            self._apply_change(change)
+            for finish in finishers:
+                if finish is not None:
+                    finish()
+
+    def _apply_change(self, change):
+        try:
+            apply = getattr(self._storage, "apply", None)
+            if apply is not None:
+                apply([change])
+            else:
+                tables = self._storage.read() or {}
+                self._storage.write(apply_to_tables(tables, change))
+        finally:
+            self.clear_cache()
+        if change.truncate:
+            for index in self._indexes.values():
+                index.load(change.upserts)
+            return
+        self._unindex_docs(change.removes)
+        self._index_docs(change.upserts)
+
+    def insert(self, document):
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents):
+        with self._write_lock():
+            table = self._raw_table()
+            docs = {}
+            for document in documents:
+                if not isinstance(document, Mapping):
+                    raise ValueError("Document is not a Mapping")
+                if isinstance(document, self.document_class):
+                    doc_id = str(document.doc_id)
+                    if doc_id in table or doc_id in docs:
+                        raise ValueError(f"Document with ID {doc_id} already exists")
+                    self._next_id = None
+                else:
+                    doc_id = str(self._get_next_id())
+                    while doc_id in docs:
+                        doc_id = str(self._get_next_id())
+                docs[doc_id] = dict(document)
+            if not docs:
+                return []
+            self._check_unique(docs)
+            self._write_changes(docs)
+            return [self.document_id_class(doc_id) for doc_id in docs]
+
+    def _update_ids(self, updates, doc_ids):
+        """對指定文件依序套用 (fields, cond) 更新，cond 為 None 表示無條件"""
+        found = docs_by_id(self._raw_table(), doc_ids)
+        docs = {}
+        for doc_id in doc_ids:
+            current = found.get(doc_id)
+            if current is None:
+                continue
+            doc = dict(current)
+            for fields, cond in updates:
+                if cond is not None and not cond(doc):
+                    continue
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(fields)
+                docs[doc_id] = doc
+        if not docs:
+            return []
+        self._check_unique(docs)
+        self._write_changes(docs)
+        return [self.document_id_class(doc_id) for doc_id in docs]
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._write_lock():
+            table = self._raw_table()
+            if doc_ids is not None:
+                ids = [str(doc_id) for doc_id in doc_ids if str(doc_id) in table]
+            elif cond is not None:
+                ids = self._matching_ids(cond, table)
+            else:
+                ids = list(table.keys())
+            return self._update_ids([(fields, None)], ids)
+
+    def update_multiple(self, updates):
+        updates = list(updates)
+        with self._write_lock():
+            table = self._raw_table()
+            ids = set()
+            for _, cond in updates:
+                ids.update(self._matching_ids(cond, table))
+            return self._update_ids(updates, sorted(ids, key=int))
+
+    def upsert(self, document, cond=None):
+        if isinstance(document, self.document_class) and hasattr(document, "doc_id"):
+            doc_ids = [document.doc_id]
+        else:
+            doc_ids = None
+        if doc_ids is None and cond is None:
+            raise ValueError("If you don't specify a search query, you must "
+                             "specify a doc_id. Hint: use a table.Document "
+                             "object.")
+        with self._write_lock():
+            updated = self.update(document, cond, doc_ids)
+            if updated:
+                return updated
+            return [self.insert(document)]
+
+    def upsert_by(self, field, documents, defaults=None):
+        """
+        以 field 的值（例如病歷號）批次 upsert：已有相同值的文件合併更新，其餘新增
+        （新增的文件先套用 defaults），整批一次寫入。同一批中值重複時依序合併。
+        回傳 (新增筆數, 更新筆數)
+        """
+        with self._write_lock():
+            table = self._raw_table()
+            index = self._indexes.get(field)
+            by_value = None
+            if index is None or self._indexed_generation is None:
+                by_value = {}
+                for doc_id, doc in table.items():
+                    by_value.setdefault(doc.get(field), []).append(doc_id)
+            docs, pending, inserted = {}, {}, set()
+            for document in documents:
+                value = document[field]
+                ids = pending.get(value)
+                if ids is None:
+                    ids = by_value.get(value, []) if by_value is not None else index.lookup(value) or []
+                    if not ids:
+                        doc_id = str(self._get_next_id())
+                        while doc_id in docs:
+                            doc_id = str(self._get_next_id())
+                        docs[doc_id] = dict(defaults or {})
+                        inserted.add(doc_id)
+                        ids = [doc_id]
+                    pending[value] = ids
+                for doc_id in ids:
+                    doc = docs.get(doc_id)
+                    if doc is None:
+                        doc = docs[doc_id] = dict(table[doc_id])
+                    doc.update(document)
+            if docs:
+                self._check_unique(docs)
+                self._write_changes(docs)
+            return len(inserted), len(docs) - len(inserted)
+
+    def remove(self, cond=None, doc_ids=None):
+        with self._write_lock():
+            table = self._raw_table()
+            if doc_ids is not None:
+                ids = [str(doc_id) for doc_id in doc_ids if str(doc_id) in table]
+            elif cond is not None:
+                ids = self._matching_ids(cond, table)
+            else:
+                raise RuntimeError("Use truncate() to remove all documents")
+            if not ids:
+                return []
+            self._write_changes(removes=ids)
+            return [self.document_id_class(doc_id) for doc_id in ids]
+
+    def truncate(self):
+        with self._write_lock():
+            self._write_changes(truncate=True)
+            self._next_id = None
+
+    def replace_all(self, documents):
+        """以一次寫入把整個資料表換成 documents，文件 ID 從 1 重新編號"""
+        docs = {}
+        for document in documents:
+            if not isinstance(document, Mapping):
+                raise ValueError("Document is not a Mapping")
+            docs[str(len(docs) + 1)] = dict(document)
+        for index in self._indexes.values():
+            if index.unique:
+                values = [index.key_of(doc) for doc in docs.values()]
+                values = [v for v in values if v is not _MISSING]
+                if len(values) != len(set(values)):
+                    raise ValueError(f"{self.name}.{index.field} 唯一索引衝突")
+        with self._write_lock():
+            self._write_changes(docs, truncate=True)
+            self._next_id = None
+            return [self.document_id_class(doc_id) for doc_id in docs]
+
+    # ---------- 讀取 ----------
+
+    def __len__(self):
+        return len(self._raw_table())
+
+    def field_names(self):
+        """所有文件出現過的欄位名稱（依第一次出現的順序）"""
+        self._sync()
+        names = {}
+        with self._lock:
+            for doc in self._raw_table().values():
+                names.update(dict.fromkeys(doc))
+        return list(names)
+
+    def count_range(self, field, low=None, high=None):
+        """field 的值在 [low, high) 之間的文件數；field 有排序索引時以二分搜尋計算"""
+        index = self._indexes.get(field)
+        if isinstance(index, SortedIndex) and self._indexes_ready():
+            return index.count_range(low, high)
+        count = 0
+        for doc in self._read_table().values():
+            value = doc.get(field)
+            if (isinstance(value, str) and (low is None or value >= low)
+                    and (high is None or value < high)):
+                count += 1
+        return count
+
+    def _materialize(self, doc_id, doc, columns):
+        """columns 為 None 時為完整的 Document，否則為投影後的 tuple（見 project）"""
+        if columns is None:
+            return self.document_class(doc, self.document_id_class(doc_id))
+        return project(doc, columns)
+
+    def page(self, field, limit, after=None, descending=False, doc_filter=None,
+             doc_ids=None, low=None, high=None, columns=None, docs=None):
+        """
+        依 field 排序（同值依文件 ID；沒有字串值的文件排在最前）的 keyset 分頁。
+        after 為上一頁最後一筆的 (欄位值, 文件 ID)；doc_ids 為候選文件 ID（例如由其他索引取得），
+        doc_filter(doc) 為 False 的文件略過；low / high 限定欄位值在 [low, high)；
+        指定 columns 時每筆只取這些欄位的值（tuple）；docs 為 {文件 ID: 文件} 時改以這些文件
+        （例如補上尚未回填欄位的複本）排序與篩選，不使用索引。
+        回傳 (文件清單, 下一頁的 after 或 None, 走訪的候選文件數)。
+
+        field 有排序索引時由索引依序走訪，不需排序整個資料表；
+        候選文件遠少於全表時改為只排序候選文件，避免走訪大量不符合的文件
+        """
+        index = self._indexes.get(field)
+        use_index = docs is None and isinstance(index, SortedIndex) and self._indexes_ready()
+        with (self._lock if use_index else nullcontext()):
+            if docs is not None:
+                table = docs
+            else:
+                table = self._raw_table() if use_index else self._read_table()
+            if doc_ids is not None:
+                doc_ids = {str(doc_id) for doc_id in doc_ids}
+            source = table
+            if not use_index or (doc_ids is not None and len(doc_ids) * 8 < len(table)):
+                if doc_ids is not None:
+                    source = docs_by_id(table, doc_ids)
+                    doc_ids = None
+                index = SortedIndex(field)
+                index.load(source)
+            keys = index.walk(after, descending, source, low, high)
+            return self._collect_page(keys, table, limit, doc_filter, doc_ids, columns)
+
+    def page_composite(self, fields, values, limit=None, after=None, descending=False,
+                       doc_filter=None, columns=None, low=None, high=None):
+        """
+        fields（tuple）的複合索引中欄位值為 values 的文件，依索引的排序欄位（同值依文件 ID）
+        排列的 keyset 分頁，after 為上一頁最後一筆的 (排序值, 文件 ID)；low / high 限定排序值在
+        [low, high)。直接依索引順序讀取，不需排序；其餘參數與回傳值同 page。
+        沒有可用的複合索引時回傳 None
+        """
+        index = self._indexes.get(tuple(fields))
+        if not isinstance(index, CompositeIndex) or not self._indexes_ready():
+            return None
+        with self._lock:
+            keys = index.walk(values, after, descending, low, high)
+            return self._collect_page(keys, self._raw_table(), limit, doc_filter, None, columns)
+
+    def count_composite(self, fields, values, low=None, high=None):
+        """fields 的複合索引中欄位值為 values、排序值在 [low, high) 的文件數；沒有可用的複合索引時回傳 None"""
+        index = self._indexes.get(tuple(fields))
+        if not isinstance(index, CompositeIndex) or not self._indexes_ready():
+            return None
+        with self._lock:
+            return index.count(values, low, high)
+
+    def _collect_page(self, keys, table, limit, doc_filter, doc_ids, columns):
+        # SQLite 的索引走訪時連同文件一起取出：(值, 文件 ID, 文件)
+        docs, last, scanned = [], None, 0
+        for key in keys:
+            doc_id = str(key[1])
+            if doc_ids is not None and doc_id not in doc_ids:
+                continue
+            doc = key[2] if len(key) > 2 else table.get(doc_id)
+            if doc is None:
+                continue
+            scanned += 1
+            if doc_filter is not None and not doc_filter(doc):
+                continue
+            if len(docs) == limit:
+                return docs, last, scanned  # 還有下一筆符合的文件
+            docs.append(self._materialize(doc_id, doc, columns))
+            last = key[:2]
+        return docs, None, scanned
+
+    def _rank_text(self, fields, needle):
+        """含有 needle（已 casefold）的 [(相符等級, 文件 ID 數字, 文件 ID, 文件)]，依等級與新增順序排列"""
+        index = next((i for i in self._indexes.values()
+                      if isinstance(i, NgramIndex) and set(fields) <= set(i.fields)), None)
+        if index is not None and self._indexes_ready():
+            if getattr(index, "persistent", False):
+                # SQLite 的索引第一次使用時在寫入交易中建立，不能先取資料表鎖
+                ids = index.candidates(needle)
+            else:
+                with self._lock:
+                    if index.stale:
+                        index.build(self._read_table())
+                    ids = index.candidates(needle)
+            table = docs_by_id(self._raw_table(), ids)
+        else:
+            table = self._read_table()
+            ids = table.keys()
+        ranked = []
+        for doc_id in ids:
+            doc = table.get(doc_id)
+            if doc is None:
+                continue
+            rank = text_rank(doc, fields, needle)
+            if rank is not None:
+                ranked.append((rank, int(doc_id), doc_id, doc))
+        ranked.sort(key=lambda item: item[:2])
+        return ranked
+
+    def search_text(self, fields, keyword, columns=None):
+        """
+        fields 中任一欄位含有 keyword（不分大小寫）的文件，依完全相符、開頭相符、
+        包含的順序排列，同一等級依新增順序。有涵蓋這些欄位的 n-gram 索引時先由索引取得候選。
+        指定 columns 時每筆只取這些欄位的值（tuple）
+        """
+        needle = keyword.casefold()
+        if not needle:
+            return []
+        return [self._materialize(doc_id, doc, columns)
+                for _, _, doc_id, doc in self._rank_text(fields, needle)]
+
+    def count_text(self, fields, keyword, field):
+        """含有 keyword 的文件依 field 的值計數，回傳 Counter（不建立 Document）"""
+        needle = keyword.casefold()
+        if not needle:
+            return Counter()
+        return Counter(doc.get(field) for _, _, _, doc in self._rank_text(fields, needle))
+
+    def page_text(self, fields, keyword, limit, after=None, doc_filter=None, columns=None):
+        """
+        search_text 的 keyset 分頁，after 為上一頁最後一筆的 (相符等級, 文件 ID)。
+        只為這一頁建立 Document（或 columns 的 tuple），符合的文件很多時不會一次複製全部。
+        回傳 (文件清單, 下一頁的 after 或 None, 符合的總筆數)
+        """
+        needle = keyword.casefold()
+        if not needle:
+            return [], None, 0
+        ranked = self._rank_text(fields, needle)
+        if doc_filter is not None:
+            ranked = [item for item in ranked if doc_filter(item[3])]
+        start = 0 if after is None else bisect.bisect_right(ranked, tuple(after), key=lambda item: item[:2])
+        end = len(ranked) if limit is None else min(start + limit, len(ranked))
+        docs = [self._materialize(doc_id, doc, columns) for _, _, doc_id, doc in ranked[start:end]]
+        next_after = ranked[end - 1][:2] if end < len(ranked) else None
+        return docs, next_after, len(ranked)
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        self._sync()
+        if doc_id is not None:
+            doc = self._raw_table().get(str(doc_id))
+            return None if doc is None else self.document_class(doc, doc_id)
+        if doc_ids is not None:
+            # 依文件 ID 直接取出（與 TinyDB 相同依 ID 順序），不走訪整個資料表
+            ids = sorted({str(i) for i in doc_ids}, key=int)
+            table = docs_by_id(self._raw_table(), ids)
+            return [self.document_class(table[i], self.document_id_class(i)) for i in ids if i in table]
+        if cond is not None and doc_ids is None:
+            ids = self.candidate_ids(cond)
+            if ids is not None:
+                table = self._raw_table()
+                for i in ids:
+                    doc = table.get(i)
+                    if doc is not None and cond(doc):
+                        return self.document_class(doc, self.document_id_class(i))
+                return None
+        return super().get(cond=cond, doc_id=doc_id, doc_ids=doc_ids)
+
+    def value_ids(self, field, value):
+        """field 的雜湊索引中值為 value 的文件 ID（不排序）；沒有可用的索引時回傳 None"""
+        index = self._indexes.get(field)
+        if not isinstance(index, HashIndex) or not self._indexes_ready():
+            return None
+        with self._lock:
+            return list(index.ids(value))
+
+    def group_by(self, field, values):
+        """
+        field 的雜湊索引中值在 values 內的文件，依值分組 {值: [Document, ...]}（依文件 ID 排序，
+        沒有文件的值不列出）。整批只同步與取鎖一次，用於批次合併其他資料表；
+        沒有可用的索引時回傳 None
+        """
+        index = self._indexes.get(field)
+        if not isinstance(index, HashIndex) or not self._indexes_ready():
+            return None
+        groups = {}
+        with self._lock:
+            ids = {value: index.lookup(value) for value in values}
+            table = docs_by_id(self._raw_table(), [i for found in ids.values() for i in found])
+            for value in values:
+                docs = [self.document_class(table[i], self.document_id_class(i))
+                        for i in ids[value] if i in table]
+                if docs:
+                    groups[value] = docs
+        return groups
+
+    def match_bits(self, field, required=0, absent=0):
+        """
+        field 為整數位元遮罩時，含有 required 的所有位元、且不含 absent 任何位元的文件 ID
+        （依 ID 排序）。逐一檢查雜湊索引中出現過的遮罩值，不掃描文件；沒有可用的索引時回傳 None
+        """
+        index = self._indexes.get(field)
+        if not isinstance(index, HashIndex) or not self._indexes_ready():
+            return None
+        ids = []
+        with self._lock:
+            for mask in index.values():
+                if (isinstance(mask, int) and not isinstance(mask, bool)
+                        and mask & required == required and not mask & absent):
+                    ids.extend(index.ids(mask))
+        ids.sort(key=int)
+        return ids
+
+    def count_by(self, field, values):
+        """
+        依 field 的索引計算 values 中各值的文件數 {值: 筆數}（沒有文件的值為 0），
+        不建立 Document；整批只同步與取鎖一次。沒有可用的索引時回傳 None
+        """
+        index = self._indexes.get(field)
+        if not isinstance(index, (HashIndex, SortedIndex)) or not self._indexes_ready():
+            return None
+        counts = {}
+        with self._lock:
+            for value in values:
+                if isinstance(index, HashIndex):
+                    counts[value] = len(index.ids(value))
+                    continue
+                ids = index.lookup(value)
+                if ids is None:
+                    return None
+                counts[value] = len(ids)
+        return counts
+
+    def count(self, cond):
+        # 可用索引時只計數，不為每筆符合的文件建立 Document；
+        # 單一欄位的等值條件直接取索引中的筆數
+        self._sync()
+        h = getattr(cond, "_hash", None)
+        if isinstance(h, tuple) and h and h[0] == "==":
+            terms = equality_terms(cond)
+            if terms:
+                ids = self.value_ids(*terms[0])
+                if ids is not None:
+                    return len(ids)
+        ids = self.candidate_ids(cond)
+        if ids is None:
+            return super().count(cond)
+        table = docs_by_id(self._raw_table(), ids)
+        return sum(1 for i in ids if i in table and cond(table[i]))
+
+    def search(self, cond):
+        # 其他行程寫入後需先清除查詢快取
+        self._sync()
+        ids = self.candidate_ids(cond)
+        if ids is None:
+            return super().search(cond)
+        table = docs_by_id(self._raw_table(), ids)
+        docs = [(i, table.get(i)) for i in ids]
+        return [
+            self.document_class(doc, self.document_id_class(i))
+            for i, doc in docs
+            if doc is not None and cond(doc)
+        ]
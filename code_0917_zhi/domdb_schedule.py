@@ -0,0 +1,95 @@
+"""
+每月電話關懷排程（patients.phone_due_date）
+
+每個個案保存下一次電話關懷的應關懷日 phone_due_date（YYYY-MM-DD）：
+- 有電話關懷紀錄時為最近一筆紀錄（created_at）的日期加 FOLLOWUP_INTERVAL（一個月）
+- 尚無紀錄時為建檔日（created_at）加 FOLLOWUP_INTERVAL
+- 電話關懷狀態為結案或排除、或沒有可推算的日期時為 None（不排程）
+
+phone_due_date 建有排序索引，/phone-month 與 /phone-pending 以索引的範圍查詢取得
+「應關懷日落在某期間」的個案並依應關懷日排序，不需讀出全部個案再逐筆推算。
+
+新增電話關懷紀錄、修改個案的建檔日或電話關懷狀態時，只重新計算相關個案，
+與原本的寫入在同一個批次中提交（見 domdb_derived）。
+
+既有資料以本檔回填（init_db.py 與 python app.py 啟動時也會執行，已正確的資料不會寫入）；
+回填前的排程查詢改為逐筆推算，不會寫入。
+
+使用方式:
+python domdb_schedule.py
+"""
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from tinydb import where
+
+from domdb_derived import PatientFieldTracker
+
+PHONE_DUE_FIELD = "phone_due_date"
+FOLLOWUP_INTERVAL = relativedelta(months=1)
+# 不再排程的電話關懷狀態
+INACTIVE_STATUSES = ("結案", "排除")
+# 個案文件中影響應關懷日的欄位
+SCHEDULE_FIELDS = ("medical_record_no", "created_at", "phone_status")
+
+
+def _date_part(value):
+    """ISO 日期或日期時間字串的日期部分，格式不符時回傳 None"""
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def last_followup_date(records):
+    """電話關懷紀錄中最近一筆的日期，沒有時回傳 None"""
+    dates = [d for d in (_date_part(record.get("created_at")) for record in records) if d]
+    return max(dates) if dates else None
+
+
+def next_due_date(patient, last_followup):
+    """個案下一次電話關懷的應關懷日（YYYY-MM-DD），不需排程時回傳 None"""
+    if patient.get("phone_status") in INACTIVE_STATUSES:
+        return None
+    base = last_followup or _date_part(patient.get("created_at"))
+    if base is None:
+        return None
+    return (base + FOLLOWUP_INTERVAL).isoformat()
+
+
+def followups_by_case(db, record_nos):
+    """{病歷號: [電話關懷紀錄, ...]}；沒有可用的索引時逐一查詢"""
+    table = db.table("phone_followups")
+    groups = table.group_by("case_id", record_nos)
+    if groups is None:
+        groups = {record_no: table.search(where("case_id") == record_no) for record_no in record_nos}
+    return groups
+
+
+def due_dates(db, docs):
+    """多筆個案文件的應關懷日（與 docs 順序相同），電話關懷紀錄整批一次取得"""
+    record_nos = {doc.get("medical_record_no") for doc in docs if doc.get("medical_record_no")}
+    groups = followups_by_case(db, record_nos) if record_nos else {}
+    return [
+        next_due_date(doc, last_followup_date(groups.get(doc.get("medical_record_no"), ())))
+        for doc in docs
+    ]
+
+
+class FollowupScheduler(PatientFieldTracker):
+    """在 patients 與 phone_followups 的寫入路徑上維護 phone_due_date 欄位"""
+    fields = (PHONE_DUE_FIELD,)
+    depends_on = SCHEDULE_FIELDS
+    source_tables = {"phone_followups": "case_id"}
+
+    def compute(self, db, docs):
+        return [{PHONE_DUE_FIELD: due} for due in due_dates(db, docs)]
+
+
+if __name__ == "__main__":
+    from domdb import followup_scheduler, get_db
+
+    count = followup_scheduler.backfill(get_db())
+    print(f"已回填 {count} 筆個案的應關懷日" if count else "個案的應關懷日皆已正確")
@@ -0,0 +1,176 @@
+"""
+參考資料（郵遞區號、職傷類型、職業分類碼、行業別）的匯入
+
+以前每次 import domdb 都會清空並逐筆重新匯入這些資料，現在改為明確執行的步驟
+（init_db.py、python app.py 啟動時，或直接執行本檔）。每個資料集會把正規化後
+內容的雜湊值記在 seed_state 資料表，內容沒有變動就略過；有變動時連同
+seed_state 的紀錄以一次寫入（domdb.batch）整批替換。
+
+使用方式:
+python domdb_seed.py [--force]
+"""
+import csv
+import hashlib
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from tinydb import Query
+
+from domdb import batch, get_db, reference_data_writable
+
+logger = logging.getLogger("domdb")
+
+SEED_STATE_TABLE = "seed_state"
+
+# table：寫入的資料表；load：回傳要寫入的文件清單；
+# key：None 表示整個資料表替換，否則為 (欄位, 值)，只 upsert 該筆文件
+Dataset = namedtuple("Dataset", ["name", "table", "load", "key"])
+
+
+def load_zipcodes(path="zipcode.csv"):
+    with open(path, newline="", encoding="utf-8-sig") as csvfile:
+        return [
+            {
+                "city_code": int(row["縣市代碼"].strip()),
+                "city": row["縣市"].strip(),
+                "zip": row["郵遞區號"].strip(),
+                "district": row["名稱"].strip()
+            }
+            for row in csv.DictReader(csvfile)
+        ]
+
+
+def load_injury_types():
+    return [{
+        "type": "injury_types",
+        "values": [
+            "墜落、滾落", "跌倒", "衝撞", "物體飛落", "物體倒塌、崩塌",
+            "被撞", "被夾、壓捲", "被刺、割、擦傷", "踩踏", "溺水",
+            "與高溫、低溫之接觸", "與有害物質接觸", "感電", "爆炸", "物體破裂",
+            "火災", "不當動作", "其他（不能分類如化膿、破傷風、中風）", "無法歸類者（資料欠缺）",
+            "公路交通事故（上下班交通事故）", "鐵路交通事故（上下班交通事故）",
+            "船舶航空交通事故（上下班交通事故）", "其他交通事故（上下班交通事故）",
+            "公路交通事故（公出交通事故）", "鐵路交通事故（公出交通事故）",
+            "船舶航空交通事故（公出交通事故）", "其他交通事故（公出交通事故）"
+        ]
+    }]
+
+
+def load_occupation_codes():
+    return [
+        {"code": "1", "label": "民意代表、主管及經理人員"},
+        {"code": "2", "label": "專業人員"},
+        {"code": "3", "label": "技術員及助理專業人員"},
+        {"code": "4", "label": "事務支援人員"},
+        {"code": "5", "label": "服務及銷售工作人員"},
+        {"code": "6", "label": "農、林、漁、牧業生產人員"},
+        {"code": "7", "label": "技藝有關工作人員"},
+        {"code": "8", "label": "機械設備操作及組裝人員"},
+        {"code": "9", "label": "基層技術工及勞力工"},
+        {"code": "10", "label": "軍人"}
+    ]
+
+
+def load_industry_major():
+    return [
+        {"code": "A", "label": "農、林、漁、牧業"},
+        {"code": "B", "label": "礦業及土石採取業"},
+        {"code": "C", "label": "製造業"},
+        {"code": "D", "label": "電力及燃氣供應業"},
+        {"code": "E", "label": "用水供應及污染整治業"},
+        {"code": "F", "label": "營建工程業"},
+        {"code": "G", "label": "批發及零售業"},
+        {"code": "H", "label": "運輸及倉儲業"},
+        {"code": "I", "label": "住宿及餐飲業"},
+        {"code": "J", "label": "出版影音及資通訊業"},
+        {"code": "K", "label": "金融及保險業"},
+        {"code": "L", "label": "不動產業"},
+        {"code": "M", "label": "專業、科學及技術服務業"},
+        {"code": "N", "label": "支援服務業"},
+        {"code": "O", "label": "公共行政及國防；強制性社會安全"},
+        {"code": "P", "label": "教育業"},
+        {"code": "Q", "label": "醫療保健及社會工作服務業"},
+        {"code": "R", "label": "藝術、娛樂及休閒服務業"},
+        {"code": "S", "label": "其他服務業"},
+    ]
+
+
+def load_industry_minor(path="industry_minor_categories.csv"):
+    with open(path, newline="", encoding="utf-8-sig") as csvfile:
+        return [
+            {
+                "major_code": row["大類代碼"].strip(),
+                "minor_code": row["細類代碼"].strip(),
+                "label": row["細類"].strip()
+            }
+            for row in csv.DictReader(csvfile)
+        ]
+
+
+DATASETS = [
+    Dataset("zipcode", "zipcode", load_zipcodes, None),
+    Dataset("injury_types", "options", load_injury_types, ("type", "injury_types")),
+    Dataset("occupation_codes", "occupation_codes", load_occupation_codes, None),
+    Dataset("industry_major_categories", "industry_major_categories", load_industry_major, None),
+    Dataset("industry_minor_categories", "industry_minor_categories", load_industry_minor, None),
+]
+
+
+def content_hash(rows):
+    """正規化後內容的雜湊值，CSV 的空白或欄位順序變動不影響結果"""
+    payload = json.dumps(rows, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def seed_dataset(dataset, force=False, path=None):
+    """匯入單一資料集，回傳寫入的筆數；內容未變動時回傳 0"""
+    db = get_db(path)
+    rows = dataset.load()
+    digest = content_hash(rows)
+    state = db.table(SEED_STATE_TABLE)
+    Seed = Query()
+    current = state.get(Seed.dataset == dataset.name)
+    table = db.table(dataset.table)
+    if not force and current and current.get("hash") == digest and len(table) > 0:
+        logger.info(f"參考資料 {dataset.name} 未變動，略過匯入")
+        return 0
+
+    with batch(path), reference_data_writable(path):
+        if dataset.key is None:
+            table.replace_all(rows)
+        else:
+            field, value = dataset.key
+            table.upsert(rows[0], Query()[field] == value)
+        state.upsert({
+            "dataset": dataset.name,
+            "hash": digest,
+            "rows": len(rows),
+            "seeded_at": datetime.now().isoformat()
+        }, Seed.dataset == dataset.name)
+    logger.info(f"已匯入參考資料 {dataset.name}: {len(rows)} 筆")
+    return len(rows)
+
+
+def seed_reference_data(force=False, path=None):
+    """依序匯入所有參考資料集，回傳 {資料集: 寫入筆數}；單一資料集失敗不影響其他資料集"""
+    results = {}
+    for dataset in DATASETS:
+        try:
+            results[dataset.name] = seed_dataset(dataset, force, path)
+        except Exception as e:
+            logger.error(f"參考資料 {dataset.name} 匯入失敗: {e}")
+            results[dataset.name] = None
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="匯入參考資料")
+    parser.add_argument("--force", action="store_true", help="忽略雜湊值，全部重新匯入")
+    args = parser.parse_args()
+    for name, count in seed_reference_data(force=args.force).items():
+        status = "失敗" if count is None else ("略過" if count == 0 else f"{count} 筆")
+        print(f"{name}: {status}")
@@ -0,0 +1,43 @@
+"""
+個案進度欄位（patients.case_status）
+
+個案進度以前每次都由 patients、interviews、case_step3 三個資料表比對算出。
+現在保存在 patients 文件的 case_status 欄位並建立索引，列表與篩選直接以索引查詢：
+- waiting：尚無 Step2 訪談（待訪談）
+- interviewed：已有訪談、尚無 Step3（已訪談）
+- closed：已有 Step3（已結案）
+
+case_status 由完成項目遮罩（completion，見 domdb_completion）推得，
+與遮罩由同一個 CompletionTracker 一起維護與回填（python domdb_completion.py）。
+"""
+from domdb_completion import COMPLETION_BITS, COMPLETION_FIELD, completion_masks
+
+CASE_STATUS_FIELD = "case_status"
+CASE_STATUSES = ("waiting", "interviewed", "closed")
+STATUS_LABELS = {"waiting": "待訪談", "interviewed": "已訪談", "closed": "已結案"}
+
+
+def status_of_mask(mask):
+    """由完成項目遮罩判斷個案進度"""
+    if not mask & COMPLETION_BITS["step2"]:
+        return "waiting"
+    if not mask & COMPLETION_BITS["step3"]:
+        return "interviewed"
+    return "closed"
+
+
+def case_status(db, medical_record_no):
+    """由 interviews、case_step3 判斷個案進度"""
+    if not medical_record_no:
+        return "waiting"
+    return status_of_mask(completion_masks(db, [medical_record_no])[medical_record_no])
+
+
+def doc_status(db, doc):
+    """個案文件的進度；尚未回填的文件由遮罩或各資料表即時判斷"""
+    status = doc.get(CASE_STATUS_FIELD)
+    if status in CASE_STATUSES:
+        return status
+    if isinstance(doc.get(COMPLETION_FIELD), int):
+        return status_of_mask(doc[COMPLETION_FIELD])
+    return case_status(db, doc.get("medical_record_no"))
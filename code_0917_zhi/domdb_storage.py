@@ -0,0 +1,1163 @@
+"""
+domdb 使用的 TinyDB 儲存層
+
+TinyDB 內建的 JSONStorage 每一次讀取都會重新解析整個 domdb.json，
+這裡提供常駐記憶體的儲存實作，讓同一行程內的讀取只需查詢記憶體。
+
+除了 TinyDB 的 read / write 之外，儲存層另外提供：
+- apply(changes)：IndexedTable 只交出被異動的文件（TableChange），
+  由各儲存層決定如何把這些變更落地（整檔改寫、追加日誌、寫入資料列等）。
+- write_lock()：跨行程的寫入鎖。取得鎖時會先載入其他行程已寫入的內容，
+  讓多個 worker 同時寫入時不會互相覆蓋。
+- batch()：區塊內的 apply 只更新記憶體，離開時把所有變更以一次寫入提交；
+  發生例外則全部捨棄。
+- generation / table_generation(name)：記憶體內容被外部變更取代時遞增，
+  讀取時若發現檔案已被其他行程修改（mtime / 大小 / data_version）就重新載入。
+
+JSON 的序列化統一經過 JSONCodec：預設（fast）有 orjson 時使用 orjson，
+並以 UTF-8 直接輸出中文、不縮排。
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from tinydb.storages import JSONStorage, Storage
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import orjson
+except ImportError:  # 未安裝時使用標準函式庫
+    orjson = None
+
+logger = logging.getLogger("domdb")
+
+# 單一資料表的變更：upserts 為 {文件 ID: 文件}，removes 為文件 ID 清單
+TableChange = namedtuple("TableChange", ["table", "upserts", "removes", "truncate"])
+
+
+class JSONCodec:
+    """
+    資料庫檔案的 JSON 編解碼，dumps 回傳 UTF-8 bytes
+
+    - fast：有 orjson 時使用 orjson，否則用標準函式庫；中文不跳脫、不縮排
+    - stdlib：與 TinyDB 預設相同，中文跳脫成 \\uXXXX，需要純 ASCII 檔案時使用
+    """
+
+    names = ("fast", "stdlib")
+
+    def __init__(self, name="fast"):
+        if name not in self.names:
+            raise ValueError(f"不支援的 JSON 編碼方式: {name}")
+        self.name = name
+        self.use_orjson = name == "fast" and orjson is not None
+
+    def dumps(self, data):
+        if self.use_orjson:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # 超過 64 位元的整數等 orjson 不支援的值，改用標準函式庫
+                pass
+        if self.name == "fast":
+            return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return json.dumps(data).encode("utf-8")
+
+    def loads(self, content):
+        if self.use_orjson:
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(content)
+
+
+def get_codec(codec):
+    """接受 JSONCodec 或其名稱"""
+    return codec if isinstance(codec, JSONCodec) else JSONCodec(codec)
+
+
+def apply_to_tables(tables, change):
+    """把 TableChange 套用到記憶體中的資料表 dict"""
+    raw = tables.get(change.table)
+    if raw is None or change.truncate:
+        raw = {}
+        tables[change.table] = raw
+    for doc_id in change.removes:
+        raw.pop(doc_id, None)
+    for doc_id, doc in change.upserts.items():
+        raw[doc_id] = doc
+    return tables
+
+
+def remove_files(paths):
+    """刪除存在的檔案或目錄，回傳實際刪除的路徑"""
+    removed = []
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            continue
+        removed.append(path)
+    return removed
+
+
+def file_signature(path):
+    """以 inode、大小與修改時間判斷檔案是否被其他行程變更"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class InterProcessLock:
+    """跨行程的排他檔案鎖（flock / msvcrt），同一行程內可重入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    @contextmanager
+    def hold(self):
+        with self._thread_lock:
+            if self._depth == 0:
+                self._acquire()
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._release()
+
+    def _acquire(self):
+        if self._handle is None:
+            self._handle = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _release(self):
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        with self._thread_lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+class BatchWrites:
+    """
+    batch() 的共用實作：區塊內的 apply 只更新記憶體並暫存變更，
+    離開最外層區塊時交給 _persist 一次寫入；區塊內發生例外則丟棄記憶體內容，
+    由磁碟重新載入。整個區塊持有寫入鎖，其他行程與執行緒的寫入會等到提交後才進行。
+    """
+
+    _batch = None
+
+    @contextmanager
+    def batch(self):
+        with self.write_lock():
+            if self._batch is not None:
+                # 巢狀批次併入外層
+                yield
+                return
+            self._batch = []
+            try:
+                yield
+            except BaseException:
+                self._batch = None
+                self.invalidate()
+                raise
+            changes, self._batch = self._batch, None
+            if changes:
+                try:
+                    self._persist(changes)
+                except Exception:
+                    self.invalidate()
+                    raise
+
+    def _stage(self, changes):
+        """套用到記憶體；批次中只暫存，否則立即寫入"""
+        for change in changes:
+            apply_to_tables(self._cache, change)
+        if self._batch is not None:
+            self._batch.extend(changes)
+            return
+        try:
+            self._persist(changes)
+        except Exception:
+            self.invalidate()
+            raise
+
+
+class CachedJSONStorage(BatchWrites, JSONStorage):
+    """讀取走記憶體快取、寫入即時落檔（write-through）的 JSONStorage"""
+
+    @staticmethod
+    def database_files(path):
+        """path 的資料庫使用的所有檔案（重設資料庫時一併刪除）"""
+        return [path, path + ".lock"]
+
+    def __init__(self, path, codec="fast", **kwargs):
+        # 以二進位模式開檔，編解碼交給 codec
+        super().__init__(path, access_mode="rb+", **kwargs)
+        self.path = path
+        self._codec = get_codec(codec)
+        self._lock = InterProcessLock(path + ".lock")
+        self._cache = None
+        self._loaded = False
+        self._signature = None
+        # 每次由檔案重新載入就遞增，供索引判斷是否需重建；本行程的寫入不會改變
+        self.generation = 0
+
+    def _reload(self):
+        signature = file_signature(self.path)
+        if self._signature is not None and signature is not None \
+                and signature[0] != self._signature[0]:
+            # 檔案被整個替換（例如 fix_db.py），重新開啟才讀得到新內容
+            self._handle.close()
+            self._handle = open(self.path, mode=self._mode)
+        self._handle.seek(0)
+        content = self._handle.read()
+        self._cache = self._codec.loads(content) if content.strip() else None
+        self._signature = signature
+        self._loaded = True
+        self.generation += 1
+
+    def read(self):
+        if not self._loaded or file_signature(self.path) != self._signature:
+            with self._lock.hold():
+                if not self._loaded or file_signature(self.path) != self._signature:
+                    self._reload()
+        return self._cache
+
+    @contextmanager
+    def write_lock(self):
+        with self._lock.hold():
+            self.read()
+            yield
+
+    def write(self, data):
+        with self._lock.hold():
+            self._handle.seek(0)
+            self._handle.write(self._codec.dumps(data))
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+            self._handle.truncate()
+            self._cache = data
+            self._loaded = True
+            self._signature = file_signature(self.path)
+
+    def apply(self, changes):
+        """套用變更後整檔寫回"""
+        with self.write_lock():
+            if self._cache is None:
+                self._cache = {}
+            self._stage(changes)
+
+    def _persist(self, changes):
+        self.write(self._cache)
+
+    def invalidate(self):
+        """丟棄記憶體快取，下次讀取時重新載入檔案"""
+        self._cache = None
+        self._loaded = False
+
+    def close(self):
+        if not self._handle.closed:
+            self._handle.close()
+        self._lock.close()
+
+
+class WALJSONStorage(BatchWrites, Storage):
+    """
+    快照 + 追加式日誌（write-ahead log）的 JSON 儲存層
+
+    domdb.json 是最近一次的完整快照，每次寫入只在 domdb.json.wal 追加一行
+    JSON 記錄被異動的文件，寫入成本與資料庫大小無關。開啟時先載入快照再依序
+    重播日誌。日誌超過 compact_threshold 位元組後，在背景執行緒把記憶體內容
+    寫成新快照並清空日誌；關閉時也會壓實一次，讓 domdb.json 保持完整可讀。
+
+    多個行程共用時，其他行程追加的日誌只需重播新增的部分，
+    只有快照被替換（壓實）時才整份重新載入。
+    """
+
+    @staticmethod
+    def database_files(path):
+        return [path, path + ".wal", path + ".wal.compacting", path + ".lock"]
+
+    def __init__(self, path, compact_threshold=4 * 1024 * 1024, codec="fast", **kwargs):
+        self.path = path
+        self._codec = get_codec(codec)
+        self.log_path = path + ".wal"
+        self.compacting_path = path + ".wal.compacting"
+        self.compact_threshold = compact_threshold
+        self._lock = InterProcessLock(path + ".lock")
+        self._compactor = None
+        self._log = None
+        self.generation = 0
+        self._table_generations = {}
+        with self._lock.hold():
+            self._reload()
+
+    # ---------- 載入與同步 ----------
+
+    def _reload(self):
+        """重新載入快照並重播所有日誌"""
+        tables = {}
+        snapshot_signature = file_signature(self.path)
+        if snapshot_signature and snapshot_signature[1] > 0:
+            with open(self.path, "rb") as f:
+                tables = self._codec.loads(f.read())
+        # 壓實尚未完成時，.compacting 中的記錄尚未併入快照，需先重播
+        replay_log(self.compacting_path, tables, codec=self._codec)
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, "ab")
+        replay_log(self.log_path, tables, codec=self._codec)
+        self._cache = tables
+        self._snapshot_signature = snapshot_signature
+        self._log_inode = os.fstat(self._log.fileno()).st_ino
+        self._log_offset = os.path.getsize(self.log_path)
+        self.generation += 1
+
+    def _refresh(self):
+        """與磁碟同步：快照或日誌被替換就整份重載，日誌變長只重播新增的部分"""
+        log_signature = file_signature(self.log_path)
+        if file_signature(self.path) != self._snapshot_signature \
+                or log_signature is None or log_signature[0] != self._log_inode \
+                or log_signature[1] < self._log_offset:
+            self._reload()
+        elif log_signature[1] > self._log_offset:
+            changed = replay_log(self.log_path, self._cache, self._log_offset, self._codec)
+            for table in changed:
+                self._table_generations[table] = self._table_generations.get(table, 0) + 1
+            self._log_offset = os.path.getsize(self.log_path)
+
+    def _is_stale(self):
+        log_signature = file_signature(self.log_path)
+        return file_signature(self.path) != self._snapshot_signature \
+            or log_signature is None or log_signature[0] != self._log_inode \
+            or log_signature[1] != self._log_offset
+
+    def table_generation(self, table):
+        return self.generation, self._table_generations.get(table, 0)
+
+    def read(self):
+        if self._is_stale():
+            with self._lock.hold():
+                self._refresh()
+        return self._cache
+
+    @contextmanager
+    def write_lock(self):
+        with self._lock.hold():
+            self._refresh()
+            yield
+
+    # ---------- 寫入 ----------
+
+    def write(self, data):
+        """整份資料覆寫：直接產生新快照並清空日誌"""
+        # 背景壓實最後替換檔案時需要寫入鎖，必須在取得鎖之前等待
+        self._wait_for_compaction()
+        with self._lock.hold():
+            self._write_snapshot(data)
+            self._reset_logs()
+            self._cache = data
+            self.generation += 1
+
+    def apply(self, changes):
+        """追加一行日誌記錄本次變更"""
+        with self.write_lock():
+            self._stage(changes)
+
+    def _persist(self, changes):
+        record = self._codec.dumps([
+            {"t": c.table, "u": c.upserts, "r": c.removes, "x": c.truncate}
+            for c in changes
+        ])
+        self._log.write(record + b"\n")
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_offset = self._log.tell()
+        if self._log_offset >= self.compact_threshold:
+            self._start_compaction()
+
+    def invalidate(self):
+        """丟棄記憶體內容，下次讀取時重新載入快照與日誌"""
+        self._log_inode = None
+
+    def _write_snapshot(self, data, tmp_path=None):
+        tmp_path = tmp_path or f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._codec.dumps(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._snapshot_signature = file_signature(self.path)
+
+    def _reset_logs(self):
+        self._log.close()
+        self._log = open(self.log_path, "wb")
+        self._log_inode = os.fstat(self._log.fileno()).st_ino
+        self._log_offset = 0
+        if os.path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+
+    # ---------- 壓實 ----------
+
+    def _start_compaction(self):
+        """在寫入鎖內輪替日誌，快照則交給背景執行緒寫出"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if os.path.exists(self.compacting_path):
+            # 其他行程正在壓實，或前一次壓實失敗，留待關閉或整份寫入時同步處理
+            return
+        snapshot = {table: dict(docs) for table, docs in self._cache.items()}
+        self._log.close()
+        os.replace(self.log_path, self.compacting_path)
+        self._log = open(self.log_path, "ab")
+        self._log_inode = os.fstat(self._log.fileno()).st_ino
+        self._log_offset = 0
+        self._compactor = threading.Thread(
+            target=self._compact, args=(snapshot,), name="domdb-wal-compactor", daemon=True)
+        self._compactor.start()
+
+    def _compact(self, snapshot):
+        tmp_path = f"{self.path}.{os.getpid()}.compact.tmp"
+        try:
+            # 序列化整份快照較慢，在鎖外進行；只有替換檔案時持有寫入鎖
+            with open(tmp_path, "wb") as f:
+                f.write(self._codec.dumps(snapshot))
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock.hold():
+                if not os.path.exists(self.compacting_path):
+                    # 其他行程已同步壓實過，這份快照已過時
+                    os.remove(tmp_path)
+                    return
+                os.replace(tmp_path, self.path)
+                os.remove(self.compacting_path)
+                self._snapshot_signature = file_signature(self.path)
+            logger.info(f"已壓實資料庫日誌 {self.log_path}")
+        except Exception as e:
+            logger.error(f"壓實資料庫日誌時出錯: {e}")
+
+    def _wait_for_compaction(self):
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+    def compact(self):
+        """同步壓實：寫出完整快照並清空日誌"""
+        self._wait_for_compaction()
+        with self._lock.hold():
+            self._refresh()
+            if self._log_offset > 0 or os.path.exists(self.compacting_path) \
+                    or not os.path.exists(self.path):
+                self._write_snapshot(self._cache)
+                self._reset_logs()
+
+    def close(self):
+        if self._log is None or self._log.closed:
+            return
+        self.compact()
+        self._log.close()
+        self._lock.close()
+
+
+def replay_log(log_path, tables, offset=0, codec=None):
+    """
+    從 offset 起依序把日誌記錄套用到 tables，回傳有變更的資料表名稱。
+    結尾不完整的記錄（寫入中斷）會被截掉。
+    """
+    changed = set()
+    codec = codec or JSONCodec()
+    if not os.path.exists(log_path):
+        return changed
+    with open(log_path, "rb+") as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                record = codec.loads(line)
+            except ValueError:
+                logger.warning(f"資料庫日誌 {log_path} 在位置 {offset} 之後的記錄不完整，已略過")
+                f.truncate(offset)
+                break
+            for c in record:
+                apply_to_tables(tables, TableChange(c["t"], c["u"], c["r"], c["x"]))
+                changed.add(c["t"])
+            offset += len(line)
+    return changed
+
+
+class TableFilesStorage(BatchWrites, Storage):
+    """
+    每個資料表一個 JSON 檔的儲存層
+
+    資料放在 <DB_PATH 去掉 .json>.tables/ 目錄，每個資料表一個 <資料表>.json，
+    寫入只改寫被異動資料表的檔案，個案資料的寫入不會連帶重寫郵遞區號等參考資料。
+
+    reference_tables 列出的參考資料表載入一次後常駐記憶體、不再檢查檔案，
+    且為唯讀：只有在 reference_writes() 內（匯入種子資料時）才能寫入。
+
+    每次寫入都會在 .changes 追加一個位元組，其他行程讀取時只需 stat 這個檔案
+    就知道是否要逐一檢查資料表檔案。目錄內還沒有資料表檔案而 DB_PATH 的
+    domdb.json 存在時，第一次開啟會自動拆分（原檔保留不動）。
+    """
+
+    # .changes 超過此大小就換一個新檔，避免無限成長
+    changes_limit = 1024 * 1024
+
+    @staticmethod
+    def tables_directory(path):
+        """資料表檔案所在的目錄"""
+        root, ext = os.path.splitext(path)
+        return (root if ext == ".json" else path) + ".tables"
+
+    @classmethod
+    def database_files(cls, path):
+        # 原本的 domdb.json 也要刪除，否則重新開啟時會再被拆分回來
+        return [cls.tables_directory(path), path]
+
+    def __init__(self, path, reference_tables=(), codec="fast", **kwargs):
+        self.path = path
+        self._codec = get_codec(codec)
+        self.directory = self.tables_directory(path)
+        self.changes_path = os.path.join(self.directory, ".changes")
+        self.reference_tables = frozenset(reference_tables)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = InterProcessLock(os.path.join(self.directory, ".lock"))
+        self._cache = {}
+        self._signatures = {}
+        self._seen_changes = None
+        self._reference_writes = 0
+        self.generation = 0
+        self._table_generations = {}
+        with self._lock.hold():
+            self._split_legacy_file()
+            open(self.changes_path, "a").close()
+            self._refresh()
+
+    def _table_path(self, table):
+        return os.path.join(self.directory, table + ".json")
+
+    def _split_legacy_file(self):
+        """把單一檔案的 domdb.json 拆成各資料表檔案"""
+        if self.path == self.directory or not os.path.isfile(self.path):
+            return
+        if any(name.endswith(".json") for name in os.listdir(self.directory)):
+            return
+        with open(self.path, "rb") as f:
+            content = f.read()
+        tables = self._codec.loads(content) if content.strip() else {}
+        for table, docs in tables.items():
+            self._write_file(table, docs)
+            self._cache[table] = docs
+        self._mark_changed()
+        logger.info(f"已將 {self.path} 拆分為 {len(tables)} 個資料表檔案，存放於 {self.directory}")
+
+    # ---------- 載入與同步 ----------
+
+    def _changes_signature(self):
+        signature = file_signature(self.changes_path)
+        return signature[:2] if signature else None
+
+    def _bump(self, table):
+        self._table_generations[table] = self._table_generations.get(table, 0) + 1
+
+    def _refresh(self):
+        """重新載入其他行程改寫過的資料表檔案；已載入的參考資料表不再檢查"""
+        if self._batch is not None:
+            # 批次期間持有寫入鎖，檔案不會被其他行程改寫，且新資料表的檔案尚未寫出
+            return
+        seen = self._changes_signature()
+        present = set()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            table = entry.name[:-len(".json")]
+            present.add(table)
+            if table in self.reference_tables and table in self._cache:
+                continue
+            signature = file_signature(entry.path)
+            if signature is None or signature == self._signatures.get(table):
+                continue
+            with open(entry.path, "rb") as f:
+                self._cache[table] = self._codec.loads(f.read())
+            self._signatures[table] = signature
+            self._bump(table)
+        for table in list(self._cache):
+            if table not in present and table not in self.reference_tables:
+                del self._cache[table]
+                self._signatures.pop(table, None)
+                self._bump(table)
+        self._seen_changes = seen
+
+    def table_generation(self, table):
+        return self.generation, self._table_generations.get(table, 0)
+
+    def is_read_only(self, table):
+        return table in self.reference_tables and not self._reference_writes
+
+    def read(self):
+        if self._changes_signature() != self._seen_changes:
+            with self._lock.hold():
+                self._refresh()
+        return self._cache
+
+    @contextmanager
+    def write_lock(self):
+        with self._lock.hold():
+            self._refresh()
+            yield
+
+    @contextmanager
+    def reference_writes(self):
+        """暫時允許寫入參考資料表"""
+        with self._lock.hold():
+            self._reference_writes += 1
+            try:
+                yield
+            finally:
+                self._reference_writes -= 1
+
+    # ---------- 寫入 ----------
+
+    def _check_writable(self, tables):
+        for table in tables:
+            if self.is_read_only(table):
+                raise PermissionError(f"參考資料表 {table} 為唯讀，只能在匯入參考資料時寫入")
+
+    def _write_file(self, table, docs):
+        path = self._table_path(table)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._codec.dumps(docs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._signatures[table] = file_signature(path)
+
+    def _mark_changed(self):
+        """通知其他行程有資料表被改寫"""
+        signature = self._changes_signature()
+        if signature and signature[1] >= self.changes_limit:
+            tmp_path = f"{self.changes_path}.{os.getpid()}.tmp"
+            open(tmp_path, "w").close()
+            os.replace(tmp_path, self.changes_path)
+        with open(self.changes_path, "a") as f:
+            f.write("\n")
+        self._seen_changes = self._changes_signature()
+
+    def _write_tables(self, tables):
+        try:
+            for table in tables:
+                if table in self._cache:
+                    self._write_file(table, self._cache[table])
+                elif os.path.exists(self._table_path(table)):
+                    os.remove(self._table_path(table))
+                    self._signatures.pop(table, None)
+        except Exception:
+            # 部分檔案可能已改寫，通知其他行程後整份重新載入
+            self._mark_changed()
+            self.invalidate()
+            raise
+        self._mark_changed()
+
+    def write(self, data):
+        """整份資料覆寫：只改寫內容物件有變動的資料表"""
+        with self._lock.hold():
+            self._refresh()
+            touched = {
+                table for table in set(self._cache) | set(data)
+                if data.get(table) is not self._cache.get(table)
+                or table not in self.reference_tables
+            }
+            self._check_writable(touched)
+            for table in touched:
+                if table in data:
+                    self._cache[table] = data[table]
+                else:
+                    self._cache.pop(table, None)
+            self._write_tables(touched)
+
+    def apply(self, changes):
+        """套用變更後只改寫被異動的資料表檔案"""
+        with self.write_lock():
+            self._check_writable({change.table for change in changes})
+            self._stage(changes)
+
+    def _persist(self, changes):
+        self._write_tables({change.table for change in changes})
+
+    def invalidate(self):
+        """丟棄記憶體快取（含參考資料表），下次讀取時重新載入"""
+        self._cache = {}
+        self._signatures = {}
+        self._seen_changes = None
+        self.generation += 1
+
+    def close(self):
+        self._lock.close()
+
+
+class SQLiteStorage(Storage):
+    """
+    以 SQLite 保存與查詢文件的儲存層
+
+    每份文件是 documents 資料表的一列（資料表名稱、文件 ID、JSON 內容），
+    寫入只異動被修改的列。記憶體中不保留文件：read() 回傳的資料表（SQLiteTable）
+    每次存取都向 SQLite 查詢。依 domdb 的索引設定在 JSON 欄位上建立部分運算式索引，
+    文字搜尋的 n-gram 存在 text_grams 資料表；IndexedTable 的等值查詢、範圍走訪與計數
+    都由這些索引處理（見 domdb_index 的 SQLite*Index），各 worker 不需載入整個資料庫。
+
+    write_lock() 以 BEGIN IMMEDIATE 交易作為跨行程寫入鎖，交易中的執行緒以寫入連線讀取
+    （看得到尚未提交的寫入），其他執行緒各用一個讀取連線，只讀到已提交的內容；
+    啟用 WAL 模式讓讀取不被寫入阻擋。每次寫入同時遞增 table_versions 中被異動資料表的版本：
+    提交後、或發現其他連線提交過變更（PRAGMA data_version 改變）時，版本有變的資料表
+    table_generation 遞增，IndexedTable 據此清除查詢快取。
+    """
+
+    # IndexedTable 依此改用 SQLite 的索引
+    sql_indexes = True
+
+    @staticmethod
+    def database_files(path):
+        return [path, path + "-wal", path + "-shm"]
+
+    def __init__(self, path, indexes=None, **kwargs):
+        self.path = path
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        self._tx_owner = None
+        self._written = set()
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        create_schema(self._conn, indexes or {})
+        self._local = threading.local()
+        self._readers = []
+        self._tables = SQLiteTables(self)
+        self._counts = {}
+        self._data_version = self._current_data_version()
+        self._versions = self._table_versions()
+        self.generation = 0
+        self._table_generations = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    # ---------- 查詢 ----------
+
+    def in_transaction(self):
+        """目前執行緒是否在寫入交易中"""
+        return self._tx_owner == threading.get_ident()
+
+    def _reader(self):
+        """目前執行緒讀取用的連線"""
+        if self.in_transaction():
+            return self._conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def query(self, sql, params=()):
+        """執行查詢並取回全部結果"""
+        return self._reader().execute(sql, params).fetchall()
+
+    def execute_many(self, sql, rows):
+        """在目前執行緒的寫入交易中執行 sql（索引維護用）"""
+        if not self.in_transaction():
+            raise RuntimeError("需在 write_lock() 中寫入")
+        self._conn.executemany(sql, rows)
+
+    def count(self, table):
+        """資料表的文件數；資料表的 generation 改變之前沿用上次的結果"""
+        if self.in_transaction():
+            # 交易中含尚未提交的寫入，不快取
+            return self._count(table)
+        generation = self.table_generation(table)
+        cached = self._counts.get(table)
+        if cached is None or cached[0] != generation:
+            cached = self._counts[table] = (generation, self._count(table))
+        return cached[1]
+
+    def _count(self, table):
+        return self.query("SELECT COUNT(*) FROM documents WHERE tbl = ?", (table,))[0][0]
+
+    # ---------- 版本與同步 ----------
+
+    def _current_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _table_versions(self, tables=None):
+        if tables is None:
+            return dict(self._conn.execute("SELECT tbl, version FROM table_versions"))
+        return {
+            table: version for table, version in self._conn.execute(
+                f"SELECT tbl, version FROM table_versions WHERE tbl IN ({', '.join('?' * len(tables))})",
+                list(tables))
+        }
+
+    def _bump(self, table):
+        self._table_generations[table] = self._table_generations.get(table, 0) + 1
+
+    def table_generation(self, table):
+        return self.generation, self._table_generations.get(table, 0)
+
+    def read(self):
+        """其他連線提交過變更時，遞增版本有變的資料表的 generation"""
+        # 同一行程的其他執行緒正在寫入時不等待（交易開始時已同步過），
+        # 避免與等待 IndexedTable 資料表鎖的寫入執行緒互相等待
+        if not self._lock.acquire(blocking=False):
+            return self._tables
+        try:
+            version = self._current_data_version()
+            if version != self._data_version:
+                self._data_version = version
+                versions = self._table_versions()
+                for table in set(versions) | set(self._versions):
+                    if versions.get(table) != self._versions.get(table):
+                        self._bump(table)
+                self._versions = versions
+            return self._tables
+        finally:
+            self._lock.release()
+
+    def _mark_written(self, tables):
+        """在寫入交易中遞增資料表版本並記下新版本；提交後再遞增這些資料表的 generation"""
+        bump_table_versions(self._conn, tables)
+        self._versions.update(self._table_versions(tables))
+        self._written.update(tables)
+
+    # ---------- 寫入 ----------
+
+    @contextmanager
+    def write_lock(self):
+        """開啟（或沿用）寫入交易，交易內的 apply 在離開時一起提交"""
+        with self._lock:
+            if self._tx_depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._tx_owner = threading.get_ident()
+            self._tx_depth += 1
+            try:
+                self.read()
+                yield
+            except BaseException:
+                # 含 KeyboardInterrupt / GeneratorExit：交易一定要結束，否則其他連線都無法寫入
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._rollback()
+                raise
+            else:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    try:
+                        self._conn.execute("COMMIT")
+                    except BaseException:
+                        self._rollback()
+                        raise
+                    self._end_transaction()
+
+    def _end_transaction(self):
+        self._tx_owner = None
+        written, self._written = self._written, set()
+        for table in written:
+            self._bump(table)
+
+    def _rollback(self):
+        """捨棄交易（提交失敗時交易可能仍開著），交易中記下的版本一併作廢"""
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+        self._versions = self._table_versions()
+        self._end_transaction()
+        self.generation += 1
+
+    def write(self, data):
+        """整份資料覆寫（TinyDB 的 drop_table 等操作會使用）；文字搜尋的 n-gram 在下次搜尋時重建"""
+        with self.write_lock():
+            data = {table: dict(docs.items()) for table, docs in data.items()}
+            tables = set(self._tables) | set(data)
+            self._conn.execute("DELETE FROM documents")
+            for table, docs in data.items():
+                self._conn.executemany(
+                    "INSERT INTO documents (tbl, doc_id, body) VALUES (?, ?, ?)",
+                    [(table, int(doc_id), dumps(doc)) for doc_id, doc in docs.items()]
+                )
+            reset_text_grams(self._conn, tables)
+            self._mark_written(tables)
+
+    def apply(self, changes):
+        """只寫入被異動的文件"""
+        with self.write_lock():
+            for change in changes:
+                if change.truncate:
+                    self._conn.execute("DELETE FROM documents WHERE tbl = ?", (change.table,))
+                if change.removes:
+                    self._conn.executemany(
+                        "DELETE FROM documents WHERE tbl = ? AND doc_id = ?",
+                        [(change.table, int(doc_id)) for doc_id in change.removes]
+                    )
+                if change.upserts:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO documents (tbl, doc_id, body) VALUES (?, ?, ?)",
+                        [(change.table, int(doc_id), dumps(doc))
+                         for doc_id, doc in change.upserts.items()]
+                    )
+            self._mark_written({change.table for change in changes})
+
+    def batch(self):
+        """整個區塊是同一個 SQLite 交易，離開時提交一次"""
+        return self.write_lock()
+
+    def invalidate(self):
+        self.generation += 1
+
+    def close(self):
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            self._conn.close()
+
+
+def _doc_key(doc_id):
+    try:
+        return int(doc_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class SQLiteTables(Mapping):
+    """SQLiteStorage.read() 的結果：{資料表名稱: SQLiteTable}，不載入文件"""
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def get(self, name, default=None):
+        # 不存在的資料表也回傳（空的）SQLiteTable，不需先查詢
+        return SQLiteTable(self._storage, name)
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return SQLiteTable(self._storage, name)
+
+    def __contains__(self, name):
+        return bool(self._storage.query("SELECT 1 FROM documents WHERE tbl = ? LIMIT 1", (name,)))
+
+    def __bool__(self):
+        return bool(self._storage.query("SELECT 1 FROM documents LIMIT 1"))
+
+    def __iter__(self):
+        return iter([table for table, in self._storage.query("SELECT DISTINCT tbl FROM documents")])
+
+    def __len__(self):
+        return self._storage.query("SELECT COUNT(DISTINCT tbl) FROM documents")[0][0]
+
+
+class SQLiteTable(Mapping):
+    """
+    SQLite 中一個資料表的文件 {文件 ID: 文件}，每次存取都向 SQLite 查詢，不快取文件。
+    取出的文件是新的 dict，修改後需經由 IndexedTable 寫回
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self.name = name
+
+    def get(self, doc_id, default=None):
+        key = _doc_key(doc_id)
+        if key is None:
+            return default
+        rows = self._storage.query(
+            "SELECT body FROM documents WHERE tbl = ? AND doc_id = ?", (self.name, key))
+        return loads(rows[0][0]) if rows else default
+
+    def get_many(self, doc_ids):
+        """doc_ids 中存在的文件 {文件 ID: 文件}，每 500 筆一次查詢"""
+        keys = sorted({key for key in map(_doc_key, doc_ids) if key is not None})
+        docs = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            for doc_id, body in self._storage.query(
+                    f"SELECT doc_id, body FROM documents WHERE tbl = ? AND doc_id IN ({', '.join('?' * len(chunk))})",
+                    (self.name, *chunk)):
+                docs[str(doc_id)] = loads(body)
+        return docs
+
+    def __getitem__(self, doc_id):
+        doc = self.get(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __contains__(self, doc_id):
+        key = _doc_key(doc_id)
+        return key is not None and bool(self._storage.query(
+            "SELECT 1 FROM documents WHERE tbl = ? AND doc_id = ?", (self.name, key)))
+
+    def __bool__(self):
+        return bool(self._storage.query("SELECT 1 FROM documents WHERE tbl = ? LIMIT 1", (self.name,)))
+
+    def __len__(self):
+        return self._storage.count(self.name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [str(doc_id) for doc_id, in self._storage.query(
+            "SELECT doc_id FROM documents WHERE tbl = ? ORDER BY doc_id", (self.name,))]
+
+    def items(self):
+        return [(str(doc_id), loads(body)) for doc_id, body in self._storage.query(
+            "SELECT doc_id, body FROM documents WHERE tbl = ? ORDER BY doc_id", (self.name,))]
+
+    def values(self):
+        return [doc for _, doc in self.items()]
+
+    def copy(self):
+        """整個資料表讀成 dict（全表掃描用）"""
+        return dict(self.items())
+
+    def max_id(self):
+        rows = self._storage.query("SELECT MAX(doc_id) FROM documents WHERE tbl = ?", (self.name,))
+        return rows[0][0] or 0
+
+
+_sqlite_codec = JSONCodec("fast")
+
+
+def dumps(doc):
+    """SQLite 以 TEXT 保存文件內容"""
+    return _sqlite_codec.dumps(doc).decode("utf-8")
+
+
+def loads(body):
+    """SQLite 中的文件內容轉回 dict"""
+    return _sqlite_codec.loads(body)
+
+
+class transaction:
+    """在 autocommit 連線上包一個 BEGIN IMMEDIATE … COMMIT 交易"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def field_expr(field):
+    """文件欄位在 SQL 中的運算式；查詢與索引必須寫法相同，SQLite 才會使用運算式索引"""
+    return f"json_extract(body, '$.{field}')"
+
+
+def table_scope(table):
+    """限定資料表的條件。部分索引的 WHERE 只與字面值比對，不能使用參數"""
+    return "tbl = '" + table.replace("'", "''") + "'"
+
+
+def create_schema(conn, indexes):
+    """
+    建立 documents、table_versions 與文字搜尋的 text_grams 資料表，並依 indexes
+    （domdb 的 TABLE_INDEXES）為各資料表的索引欄位建立部分運算式索引
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS documents ("
+        " tbl TEXT NOT NULL,"
+        " doc_id INTEGER NOT NULL,"
+        " body TEXT NOT NULL,"
+        " PRIMARY KEY (tbl, doc_id))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        " tbl TEXT PRIMARY KEY,"
+        " version INTEGER NOT NULL)"
+    )
+    # fields 為 n-gram 索引的欄位（以逗號連接）；text_grams_built 記錄已建立完成的索引
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS text_grams ("
+        " tbl TEXT NOT NULL,"
+        " fields TEXT NOT NULL,"
+        " gram TEXT NOT NULL,"
+        " doc_id INTEGER NOT NULL,"
+        " PRIMARY KEY (tbl, fields, gram, doc_id)) WITHOUT ROWID"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS text_grams_doc ON text_grams (tbl, fields, doc_id)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS text_grams_built ("
+        " tbl TEXT NOT NULL,"
+        " fields TEXT NOT NULL,"
+        " PRIMARY KEY (tbl, fields))"
+    )
+    for table, fields in indexes.items():
+        for field, spec in fields.items():
+            if spec == "ngram":
+                continue
+            if isinstance(spec, tuple) and spec[0] == "composite":
+                # 複合索引：各欄位再加上排序欄位
+                columns = field + (spec[1],)
+            else:
+                columns = (field,)
+            # 最後加上 doc_id，同值的文件依 ID 排列，分頁可直接沿索引走訪
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "documents_{table}_{"_".join(columns)}" ON documents ('
+                + ", ".join(field_expr(column) for column in columns)
+                + f", doc_id) WHERE {table_scope(table)}"
+            )
+
+
+def bump_table_versions(conn, tables):
+    """遞增資料表版本，讓其他連線知道這些資料表有變更（需在寫入交易中呼叫）"""
+    conn.executemany(
+        "INSERT INTO table_versions (tbl, version) VALUES (?, 1)"
+        " ON CONFLICT (tbl) DO UPDATE SET version = version + 1",
+        [(table,) for table in tables]
+    )
+
+
+def reset_text_grams(conn, tables):
+    """清除資料表的 n-gram，下次文字搜尋時重建（需在寫入交易中呼叫）"""
+    rows = [(table,) for table in tables]
+    conn.executemany("DELETE FROM text_grams WHERE tbl = ?", rows)
+    conn.executemany("DELETE FROM text_grams_built WHERE tbl = ?", rows)
@@ -5,6 +5,7 @@
 1. 清理舊的資料庫
 2. 建立新的資料庫結構
 3. 加入初始資料
+4. 匯入參考資料（郵遞區號、職傷類型、職業分類碼、行業別；內容未變動時略過）
 
 使用方式:
 python init_db.py [--reset]
@@ -24,8 +25,10 @@ import json
 import hashlib
 import bcrypt
 from datetime import datetime
-from tinydb import TinyDB
 from dotenv import load_dotenv
+from domdb import backfill_completion, backfill_phone_schedule, get_db, reset_db
+from domdb_seed import seed_reference_data
+from app import configure_logging
 
 # 載入環境變量
 load_dotenv()
@@ -34,23 +37,22 @@ load_dotenv()
 DB_PATH = os.getenv("DB_PATH", "domdb.json")
 
 def reset_database():
-    """完全重置資料庫"""
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-        print(f"已刪除舊的資料庫文件: {DB_PATH}")
+    """完全重置資料庫（連同 WAL 日誌、鎖檔等附屬檔案）"""
+    for path in reset_db(DB_PATH):
+        print(f"已刪除舊的資料庫文件: {path}")
     
     # 創建新的空資料庫
-    db = TinyDB(DB_PATH)
+    db = get_db(DB_PATH)
     print(f"已建立新的資料庫: {DB_PATH}")
     return db
 
 def init_database():
     """初始化資料庫，如果不存在則創建"""
     if os.path.exists(DB_PATH):
-        db = TinyDB(DB_PATH)
+        db = get_db(DB_PATH)
         print(f"使用現有資料庫: {DB_PATH}")
     else:
-        db = TinyDB(DB_PATH)
+        db = get_db(DB_PATH)
         print(f"已建立新的資料庫: {DB_PATH}")
     return db
 
@@ -99,6 +101,9 @@ def create_tables(db):
 
 def main():
     """主程序入口"""
+    # 與系統相同輸出到 app.log，匯入失敗等錯誤才查得到
+    configure_logging()
+
     # 檢查是否要重置資料庫
     reset = "--reset" in sys.argv
     
@@ -115,6 +120,23 @@ def main():
     
     # 添加預設用戶
     add_default_user(db)
+
+    # 匯入參考資料
+    for name, count in seed_reference_data(path=DB_PATH).items():
+        if count is None:
+            print(f"參考資料 {name} 匯入失敗，請查看 app.log")
+        elif count:
+            print(f"已匯入參考資料 {name}: {count} 筆")
+        else:
+            print(f"參考資料 {name} 未變動，略過")
+
+    # 回填個案進度、完成項目與應關懷日欄位
+    count = backfill_completion(path=DB_PATH)
+    if count:
+        print(f"已回填 {count} 筆個案完成項目與進度")
+    count = backfill_phone_schedule(path=DB_PATH)
+    if count:
+        print(f"已回填 {count} 筆個案的應關懷日")
     
     print("資料庫初始化完成！")
     print(f"\n請使用以下帳號登入系統:")
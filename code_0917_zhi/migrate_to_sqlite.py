@@ -0,0 +1,102 @@
+"""
+將 TinyDB 的 domdb.json 匯入 SQLite 資料庫
+
+用途:
+改用 SQLite 後端（DB_BACKEND=sqlite）前，一次性把既有的 JSON 資料匯入。
+匯入後將 DB_PATH 指向 SQLite 檔案即可。
+資料依資料表分批寫入，每批一個交易，並在 migration_progress 記錄進度；
+中途失敗時重新執行同一指令即可從上次完成的批次繼續。
+
+使用方式:
+python migrate_to_sqlite.py [--source domdb.json] [--target domdb.sqlite3] [--batch-size 500]
+"""
+from module_switch import get_module_status
+
+if not get_module_status():
+    print("⚠️ 系統目前為關閉狀態，請在 module_switch.py 啟用後再執行。")
+    exit()
+
+import argparse
+import json
+import sqlite3
+import time
+
+from domdb_storage import bump_table_versions, create_schema, dumps, reset_text_grams, transaction
+
+
+def load_progress(conn):
+    """讀取每個資料表已匯入到的最後文件 ID"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS migration_progress ("
+        " tbl TEXT PRIMARY KEY,"
+        " last_doc_id INTEGER NOT NULL,"
+        " done INTEGER NOT NULL DEFAULT 0)"
+    )
+    return {
+        table: (last_doc_id, bool(done))
+        for table, last_doc_id, done in conn.execute(
+            "SELECT tbl, last_doc_id, done FROM migration_progress")
+    }
+
+
+def migrate(source, target, batch_size=500):
+    """分批匯入，回傳本次寫入的文件數"""
+    with open(source, encoding="utf-8") as f:
+        data = json.load(f)
+
+    conn = sqlite3.connect(target, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # 欄位的運算式索引由應用程式第一次開啟資料庫時建立（見 domdb.TABLE_INDEXES），匯入時不需維護
+    create_schema(conn, {})
+    progress = load_progress(conn)
+
+    total = 0
+    started = time.time()
+    for table, docs in data.items():
+        last_doc_id, done = progress.get(table, (0, False))
+        if done:
+            print(f"略過已完成的資料表 {table}")
+            continue
+
+        pending = sorted(
+            (int(doc_id), doc) for doc_id, doc in docs.items() if int(doc_id) > last_doc_id
+        )
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with transaction(conn):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO documents (tbl, doc_id, body) VALUES (?, ?, ?)",
+                    [(table, doc_id, dumps(doc)) for doc_id, doc in batch]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO migration_progress (tbl, last_doc_id, done) VALUES (?, ?, 0)",
+                    (table, batch[-1][0])
+                )
+                bump_table_versions(conn, [table])
+                reset_text_grams(conn, [table])
+            total += len(batch)
+
+        conn.execute(
+            "INSERT OR REPLACE INTO migration_progress (tbl, last_doc_id, done) "
+            "VALUES (?, COALESCE((SELECT MAX(doc_id) FROM documents WHERE tbl = ?), 0), 1)",
+            (table, table)
+        )
+        print(f"已匯入資料表 {table}: {len(docs)} 筆")
+
+    conn.close()
+    elapsed = time.time() - started
+    print(f"匯入完成，本次寫入 {total} 筆，耗時 {elapsed:.2f} 秒")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將 domdb.json 匯入 SQLite")
+    parser.add_argument("--source", default="domdb.json", help="TinyDB JSON 檔案")
+    parser.add_argument("--target", default="domdb.sqlite3", help="SQLite 資料庫檔案")
+    parser.add_argument("--batch-size", type=int, default=500, help="每個交易寫入的文件數")
+    args = parser.parse_args()
+    migrate(args.source, args.target, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
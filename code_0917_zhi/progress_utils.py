@@ -4,34 +4,28 @@ if not get_module_status():
     print("⚠️ 系統目前為關閉狀態，請在 module_switch.py 啟用後再執行。")
     exit()
 
-from tinydb import TinyDB, where
+from domdb import get_db
+from domdb_cases import progress_many
 
-def calculate_interview_progress(medical_record_no: str, db_path: str = "domdb.json") -> int:
+def calculate_interview_progress(medical_record_no: str, db_path: str = None) -> int:
     """
     根據完成 step1～step4 計算訪談進度條百分比：
     - step1：patients 表中有資料 → 25%
     - step2：interviews 表中有資料 → 50%
     - step3：case_step3 表中有資料 → 75%
     - step4：step4 表中有資料 → 100%
+    由個案文件的完成項目遮罩（completion）算出，與 calculate_progress_many 相同。
+    未指定 db_path 時使用 domdb 共用的資料庫實例。
     """
-    db = TinyDB(db_path)
-    patients = db.table("patients")
-    interviews = db.table("interviews")
-    step3_table = db.table("case_step3")
-    step4_table = db.table("step4")  # 自動建立（如果尚未存在）
+    return calculate_progress_many([medical_record_no], db_path)[medical_record_no]["interview_progress"]
 
-    has_step1 = patients.get(where("medical_record_no") == medical_record_no) is not None
-    has_step2 = interviews.get(where("medical_record_no") == medical_record_no) is not None
-    has_step3 = step3_table.get(where("medical_record_no") == medical_record_no) is not None
-    has_step4 = step4_table.get(where("medical_record_no") == medical_record_no) is not None
 
-    if has_step4:
-        return 100
-    elif has_step3:
-        return 75
-    elif has_step2:
-        return 50
-    elif has_step1:
-        return 25
-    else:
-        return 0
+def calculate_progress_many(medical_record_nos, db_path: str = None) -> dict:
+    """
+    一次計算多筆個案的訪談、電話關懷、服務紀錄、復工追蹤進度條百分比：
+    回傳 {病歷號: {"interview_progress", "call_progress", "service_progress", "return_progress"}}。
+    - 訪談進度同 calculate_interview_progress
+    - 電話關懷、服務紀錄、復工追蹤：每筆紀錄 25%，最多 100%
+    紀錄資料表以索引一次取得整批病歷號的筆數，不逐筆查詢。
+    """
+    return progress_many(get_db(db_path), medical_record_nos)
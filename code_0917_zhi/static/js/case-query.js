@@ -2,8 +2,23 @@
 // === case-query.js ===
 
 // 全域變數
-let allCases = [];
-let filteredCases = [];
+const FETCH_SIZE = 100; // 每次向伺服器載入的筆數
+const SERVER_SORT_FIELDS = ['medical_record_no', 'created_at']; // 由伺服器依索引排序的欄位
+// 列表與匯出用到的欄位，只向伺服器取這些欄位
+const LIST_FIELDS = ['medical_record_no', 'patient_name', 'gender', 'birth_date', 'id_document_no', 'created_at'];
+// 列表進度條：(進度欄位, 名稱)
+const PROGRESS_BARS = [
+    ['interview_progress', '訪談'],
+    ['call_progress', '電話'],
+    ['service_progress', '服務'],
+    ['return_progress', '復工']
+];
+let filteredCases = []; // 目前已載入的查詢結果
+let nextCursor = null;
+let totalCases = 0;
+let totalEstimated = false;
+let currentOrder = '-created_at';
+let requestSeq = 0;
 let currentPage = 1;
 let itemsPerPage = 10;
 let currentSort = { field: null, direction: 'asc' };
@@ -76,28 +91,70 @@ function setupEventListeners() {
     setupViewSwitching();
 }
 
-// 載入所有個案資料
+// 載入第一頁個案資料
 function loadAllCases() {
-    showLoading(true);
-    
-    fetch('/case-query-search', {
+    performSearch();
+}
+
+// 目前的查詢條件；cursor 為上一批最後一筆的游標
+function buildQuery(cursor) {
+    return {
+        keyword: document.getElementById('keyword').value.trim(),
+        search_field: document.getElementById('search_field').value,
+        gender: document.getElementById('gender_filter').value,
+        date_from: document.getElementById('date_from').value,
+        date_to: document.getElementById('date_to').value,
+        order: currentOrder,
+        limit: FETCH_SIZE,
+        cursor: cursor,
+        fields: LIST_FIELDS,
+        with_progress: true
+    };
+}
+
+// 伺服器以 fields（欄位名稱）與 rows（值陣列）回傳列表，轉回物件
+function rowsToCases(data) {
+    return (data.rows || []).map(row => Object.fromEntries(data.fields.map((field, i) => [field, row[i]])));
+}
+
+// 向伺服器取得一批個案；已有較新的查詢時回傳 null
+function fetchCases(cursor) {
+    const seq = ++requestSeq;
+
+    return fetch('/case-query-search', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ keyword: '' })
+        body: JSON.stringify(buildQuery(cursor))
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            allCases = data.data || [];
-            filteredCases = [...allCases];
-            renderResults();
-            updateResultsCount();
-        } else {
-            console.error('載入失敗:', data.message);
-            showError('載入個案資料失敗');
+        if (seq !== requestSeq) {
+            return null;
         }
+        if (!data.success) {
+            throw new Error(data.message || '查詢失敗');
+        }
+        nextCursor = data.next_cursor;
+        totalCases = data.total;
+        totalEstimated = data.total_estimated;
+        const progress = data.progress || {};
+        return rowsToCases(data).map(caseItem => ({ ...caseItem, progress: progress[caseItem.medical_record_no] }));
+    });
+}
+
+// 執行搜尋（篩選條件由伺服器處理）
+function performSearch() {
+    showLoading(true);
+
+    fetchCases(null)
+    .then(cases => {
+        if (cases === null) return;
+        filteredCases = cases;
+        currentPage = 1;
+        renderResults();
+        updateResultsCount();
     })
     .catch(error => {
         console.error('載入錯誤:', error);
@@ -108,65 +165,28 @@ function loadAllCases() {
     });
 }
 
-// 執行搜尋
-function performSearch() {
-    const keyword = document.getElementById('keyword').value.trim();
-    const searchField = document.getElementById('search_field').value;
-    const genderFilter = document.getElementById('gender_filter').value;
-    const dateFrom = document.getElementById('date_from').value;
-    const dateTo = document.getElementById('date_to').value;
-    
+// 載入下一批個案，直到已載入 count 筆或沒有更多資料
+function ensureLoaded(count) {
+    if (filteredCases.length >= count || !nextCursor) {
+        return Promise.resolve();
+    }
+
     showLoading(true);
-    
-    // 從所有資料中篩選
-    filteredCases = allCases.filter(caseItem => {
-        // 關鍵字搜尋
-        if (keyword) {
-            if (searchField) {
-                const fieldValue = (caseItem[searchField] || '').toString().toLowerCase();
-                if (!fieldValue.includes(keyword.toLowerCase())) {
-                    return false;
-                }
-            } else {
-                // 全部欄位搜尋
-                const searchableFields = ['medical_record_no', 'patient_name', 'id_document_no'];
-                const matches = searchableFields.some(field => {
-                    const fieldValue = (caseItem[field] || '').toString().toLowerCase();
-                    return fieldValue.includes(keyword.toLowerCase());
-                });
-                if (!matches) {
-                    return false;
-                }
-            }
-        }
-        
-        // 性別篩選
-        if (genderFilter && caseItem.gender !== genderFilter) {
-            return false;
-        }
-        
-        // 日期範圍篩選
-        if (dateFrom || dateTo) {
-            const createdDate = caseItem.created_at ? caseItem.created_at.split('T')[0] : '';
-            if (dateFrom && createdDate < dateFrom) {
-                return false;
-            }
-            if (dateTo && createdDate > dateTo) {
-                return false;
-            }
-        }
-        
-        return true;
+    return fetchCases(nextCursor)
+    .then(cases => {
+        if (cases === null) return;
+        filteredCases = filteredCases.concat(cases);
+        updateResultsCount();
+        return ensureLoaded(count);
+    })
+    .finally(() => {
+        showLoading(false);
     });
-    
-    // 重設分頁
-    currentPage = 1;
-    
-    // 渲染結果
-    renderResults();
-    updateResultsCount();
-    
-    showLoading(false);
+}
+
+// 符合條件的總筆數：全部載入後為實際筆數
+function knownTotal() {
+    return nextCursor ? Math.max(totalCases, filteredCases.length) : filteredCases.length;
 }
 
 // 渲染結果
@@ -214,7 +234,7 @@ function renderTableView() {
     if (paginatedCases.length === 0) {
         tbody.innerHTML = `
             <tr>
-                <td colspan="7" class="text-center" style="padding: 40px;">
+                <td colspan="8" class="text-center" style="padding: 40px;">
                     <div class="empty-state">
                         <i class="fas fa-search" style="font-size: 2rem; color: #ccc; margin-bottom: 10px;"></i>
                         <p>查無符合條件的個案資料</p>
@@ -249,6 +269,7 @@ function createTableRow(caseItem) {
         <td class="birth-date">${caseItem.birth_date || '未填寫'}</td>
         <td class="id-document">${caseItem.id_document_no || '未填寫'}</td>
         <td class="created-date">${createdDate}</td>
+        <td class="progress-cell">${progressBars(caseItem.progress)}</td>
         <td class="actions">
             <div class="action-buttons">
                 <a href="/case-detail/${caseItem.medical_record_no}" class="btn-action btn-view" title="檢視詳細">
@@ -264,6 +285,17 @@ function createTableRow(caseItem) {
     return row;
 }
 
+// 個案的各項進度條（伺服器一次算出整批個案的進度）
+function progressBars(progress) {
+    if (!progress) return '';
+    return `<div class="mini-progress">${PROGRESS_BARS.map(([key, label]) => `
+        <div class="mini-progress-row" title="${label} ${progress[key] || 0}%">
+            <span class="mini-progress-label">${label}</span>
+            <span class="mini-progress-track"><span class="mini-progress-fill" style="width: ${progress[key] || 0}%"></span></span>
+        </div>`).join('')}
+    </div>`;
+}
+
 // 渲染卡片檢視
 function renderGridView() {
     const gridContainer = document.getElementById('casesGrid');
@@ -376,7 +408,14 @@ function setupTableSorting() {
             }
             
             updateSortIcons();
-            renderResults();
+            if (SERVER_SORT_FIELDS.includes(sortField)) {
+                // 重新向伺服器依此欄位排序載入
+                currentOrder = (currentSort.direction === 'desc' ? '-' : '') + sortField;
+                performSearch();
+            } else {
+                // 其他欄位只排序已載入的資料
+                renderResults();
+            }
         });
     });
 }
@@ -444,7 +483,7 @@ function updateViewButtons() {
 
 // 設定分頁
 function setupPagination() {
-    const totalPages = Math.ceil(filteredCases.length / itemsPerPage);
+    const totalPages = Math.ceil(knownTotal() / itemsPerPage);
     const paginationContainer = document.getElementById('pagination');
     
     if (totalPages <= 1) {
@@ -468,7 +507,7 @@ function updatePaginationInfo() {
     
     document.getElementById('pageStart').textContent = startIndex;
     document.getElementById('pageEnd').textContent = endIndex;
-    document.getElementById('totalRecords').textContent = filteredCases.length;
+    document.getElementById('totalRecords').textContent = formatTotal();
 }
 
 // 更新分頁按鈕
@@ -501,7 +540,7 @@ function updatePaginationButtons(totalPages) {
 
 // 改變頁面
 function changePage(direction) {
-    const totalPages = Math.ceil(filteredCases.length / itemsPerPage);
+    const totalPages = Math.ceil(knownTotal() / itemsPerPage);
     const newPage = currentPage + direction;
     
     if (newPage >= 1 && newPage <= totalPages) {
@@ -509,10 +548,23 @@ function changePage(direction) {
     }
 }
 
-// 跳轉到指定頁面
+// 跳轉到指定頁面；尚未載入的頁面先向伺服器載入
 function goToPage(page) {
-    currentPage = page;
-    renderResults();
+    ensureLoaded(page * itemsPerPage)
+    .then(() => {
+        const loadedPages = Math.max(1, Math.ceil(filteredCases.length / itemsPerPage));
+        currentPage = Math.min(page, loadedPages);
+        renderResults();
+    })
+    .catch(error => {
+        console.error('載入錯誤:', error);
+        showError('載入更多個案失敗，請稍後再試');
+    });
+}
+
+// 總筆數文字；尚未全部載入且為估計值時加上「約」
+function formatTotal() {
+    return (nextCursor && totalEstimated ? '約 ' : '') + knownTotal();
 }
 
 // 更新結果數量
@@ -522,7 +574,7 @@ function updateResultsCount() {
         if (filteredCases.length === 0) {
             countElement.textContent = '查無資料';
         } else {
-            countElement.textContent = `共 ${filteredCases.length} 筆`;
+            countElement.textContent = `共 ${formatTotal()} 筆`;
         }
     }
 }
@@ -552,13 +604,8 @@ function resetSearch() {
     document.getElementById('date_from').value = '';
     document.getElementById('date_to').value = '';
     
-    // 重設篩選結果
-    filteredCases = [...allCases];
-    currentPage = 1;
-    
-    // 重新渲染
-    renderResults();
-    updateResultsCount();
+    // 重新載入第一頁
+    performSearch();
     
     // 隱藏進階搜尋
     const advancedSearch = document.getElementById('advancedSearch');
@@ -574,6 +621,9 @@ function exportResults() {
         alert('沒有資料可以匯出');
         return;
     }
+    if (nextCursor && !confirm(`目前已載入 ${filteredCases.length} 筆（共 ${formatTotal()} 筆），只匯出已載入的資料？`)) {
+        return;
+    }
     
     // 建立 CSV 內容
     const headers = ['病歷號', '姓名', '性別', '出生日期', '身分證號', '建檔日期'];
@@ -33,9 +33,9 @@ function handleKeyDown(e) {
   if (e.key === "Enter") logout();
 }
 
-// 初始化數字卡片
-function initDashboardData() {
-  fetch("/dashboard-data")
+// 首頁資料（數字卡片、圖表、最近個案、提醒）由 /api/dashboard 一次取得
+function loadDashboard() {
+  fetch("/api/dashboard")
     .then((res) => {
       if (!res.ok) {
         throw new Error(`HTTP error! status: ${res.status}`);
@@ -44,165 +44,155 @@ function initDashboardData() {
     })
     .then((data) => {
       console.log("Dashboard data loaded:", data);
-      
-      // 安全更新元素內容
-      const totalCasesEl = document.getElementById("totalCases");
-      const waitingInterviewEl = document.getElementById("waitingInterview");
-      const interviewedCasesEl = document.getElementById("interviewedCases");
-      const closedCasesEl = document.getElementById("closedCases");
-      const monthlyNewCasesEl = document.getElementById("monthlyNewCases");
-
-      if (totalCasesEl) totalCasesEl.textContent = data.total_cases || '0';
-      if (waitingInterviewEl) waitingInterviewEl.textContent = data.waiting_cases || '0';
-      if (interviewedCasesEl) interviewedCasesEl.textContent = data.interviewed_cases || '0';
-      if (closedCasesEl) closedCasesEl.textContent = data.closed_cases || '0';
-      if (monthlyNewCasesEl) monthlyNewCasesEl.textContent = data.monthly_new_cases || '0';
+
+      if (!data.success) {
+        throw new Error("資料載入失敗");
+      }
+
+      initDashboardData(data); // 數值卡片
+      initCharts(data); // 圖表
+      loadRecentCases(data.recent_cases); // 最近個案
+      loadAlerts(data); // 待處理提醒
     })
     .catch((err) => {
-      console.error("統計資料載入錯誤：", err);
-      // 設定預設值
-      const elements = ['totalCases', 'waitingInterview', 'interviewedCases', 'closedCases', 'monthlyNewCases'];
-      elements.forEach(id => {
-        const el = document.getElementById(id);
-        if (el) el.textContent = '0';
-      });
+      console.error("首頁資料載入錯誤：", err);
+      showDashboardError();
     });
 }
 
-// 初始化圖表（Chart.js）
-function initCharts() {
-  fetch("/api/dashboard-stats")
-    .then((res) => {
-      if (!res.ok) {
-        throw new Error(`HTTP error! status: ${res.status}`);
-      }
-      return res.json();
-    })
-    .then((data) => {
-      console.log("Chart data loaded:", data);
-      
-      if (!data.success) {
-        throw new Error("資料載入失敗");
-      }
+// 載入失敗時的預設畫面
+function showDashboardError() {
+  const elements = ['totalCases', 'waitingInterview', 'interviewedCases', 'closedCases', 'monthlyNewCases'];
+  elements.forEach(id => {
+    const el = document.getElementById(id);
+    if (el) el.textContent = '0';
+  });
 
-      const trendCtx = document.getElementById("trendChart");
-      if (trendCtx && data.trend) {
-        try {
-          new Chart(trendCtx, {
-            type: "line",
-            data: {
-              labels: Object.keys(data.trend),
-              datasets: [
-                {
-                  label: "新增個案數",
-                  data: Object.values(data.trend),
-                  borderColor: "#2c3e50",
-                  backgroundColor: "rgba(44, 62, 80, 0.1)",
-                  tension: 0.3,
-                },
-              ],
+  const trendCtx = document.getElementById("trendChart");
+  if (trendCtx) {
+    trendCtx.style.display = 'none';
+    const errorMsg = document.createElement('div');
+    errorMsg.textContent = '圖表載入失敗';
+    errorMsg.style.textAlign = 'center';
+    errorMsg.style.color = '#999';
+    trendCtx.parentNode.appendChild(errorMsg);
+  }
+
+  const tbody = document.getElementById("recentCasesTable");
+  if (tbody) {
+    tbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: #999;">載入失敗</td></tr>';
+  }
+
+  const alertsList = document.getElementById("alertsList");
+  if (alertsList) {
+    alertsList.innerHTML = '<div class="stat-item"><span class="stat-label">載入失敗</span></div>';
+  }
+}
+
+// 初始化數字卡片
+function initDashboardData(data) {
+  // 安全更新元素內容
+  const totalCasesEl = document.getElementById("totalCases");
+  const waitingInterviewEl = document.getElementById("waitingInterview");
+  const interviewedCasesEl = document.getElementById("interviewedCases");
+  const closedCasesEl = document.getElementById("closedCases");
+  const monthlyNewCasesEl = document.getElementById("monthlyNewCases");
+
+  if (totalCasesEl) totalCasesEl.textContent = data.total_cases || '0';
+  if (waitingInterviewEl) waitingInterviewEl.textContent = data.waiting_cases || '0';
+  if (interviewedCasesEl) interviewedCasesEl.textContent = data.interviewed_cases || '0';
+  if (closedCasesEl) closedCasesEl.textContent = data.closed_cases || '0';
+  if (monthlyNewCasesEl) monthlyNewCasesEl.textContent = data.monthly_new_cases || '0';
+}
+
+// 初始化圖表（Chart.js）
+function initCharts(data) {
+  const trendCtx = document.getElementById("trendChart");
+  if (trendCtx && data.trend) {
+    try {
+      new Chart(trendCtx, {
+        type: "line",
+        data: {
+          labels: Object.keys(data.trend),
+          datasets: [
+            {
+              label: "新增個案數",
+              data: Object.values(data.trend),
+              borderColor: "#2c3e50",
+              backgroundColor: "rgba(44, 62, 80, 0.1)",
+              tension: 0.3,
             },
-            options: {
-              responsive: true,
-              maintainAspectRatio: true,
-              scales: {
-                y: {
-                  beginAtZero: true,
-                  ticks: {
-                    stepSize: 1,
-                    callback: function (value) {
-                      return Number.isInteger(value) ? value : null;
-                    },
-                  },
+          ],
+        },
+        options: {
+          responsive: true,
+          maintainAspectRatio: true,
+          scales: {
+            y: {
+              beginAtZero: true,
+              ticks: {
+                stepSize: 1,
+                callback: function (value) {
+                  return Number.isInteger(value) ? value : null;
                 },
               },
             },
-          });
-        } catch (chartError) {
-          console.error("圖表建立失敗:", chartError);
-        }
-      }
+          },
+        },
+      });
+    } catch (chartError) {
+      console.error("圖表建立失敗:", chartError);
+    }
+  }
 
-      const pieCtx = document.getElementById("pieChart");
-      if (pieCtx && data.status) {
-        try {
-          new Chart(pieCtx, {
-            type: "pie",
-            data: {
-              labels: Object.keys(data.status),
-              datasets: [
-                {
-                  label: "個案分布",
-                  data: Object.values(data.status),
-                  backgroundColor: ["#f4aaaa", "#f6c23e", "#1cc88a"],
-                },
-              ],
-            },
-            options: {
-              responsive: true,
-              maintainAspectRatio: true,
+  const pieCtx = document.getElementById("pieChart");
+  if (pieCtx && data.status) {
+    try {
+      new Chart(pieCtx, {
+        type: "pie",
+        data: {
+          labels: Object.keys(data.status),
+          datasets: [
+            {
+              label: "個案分布",
+              data: Object.values(data.status),
+              backgroundColor: ["#f4aaaa", "#f6c23e", "#1cc88a"],
             },
-          });
-        } catch (chartError) {
-          console.error("圓餅圖建立失敗:", chartError);
-        }
-      }
-    })
-    .catch((err) => {
-      console.error("圖表載入失敗:", err);
-      // 顯示錯誤訊息給使用者
-      const trendCtx = document.getElementById("trendChart");
-      if (trendCtx) {
-        trendCtx.style.display = 'none';
-        const errorMsg = document.createElement('div');
-        errorMsg.textContent = '圖表載入失敗';
-        errorMsg.style.textAlign = 'center';
-        errorMsg.style.color = '#999';
-        trendCtx.parentNode.appendChild(errorMsg);
-      }
-    });
+          ],
+        },
+        options: {
+          responsive: true,
+          maintainAspectRatio: true,
+        },
+      });
+    } catch (chartError) {
+      console.error("圓餅圖建立失敗:", chartError);
+    }
+  }
 }
 
-function loadRecentCases() {
-  fetch("/dashboard-recent-cases")
-    .then((res) => {
-      if (!res.ok) {
-        throw new Error(`HTTP error! status: ${res.status}`);
-      }
-      return res.json();
-    })
-    .then((data) => {
-      console.log("Recent cases data loaded:", data);
-      
-      const tbody = document.getElementById("recentCasesTable");
-      if (!tbody) {
-        console.error("找不到最近個案表格元素");
-        return;
-      }
+function loadRecentCases(cases) {
+  const tbody = document.getElementById("recentCasesTable");
+  if (!tbody) {
+    console.error("找不到最近個案表格元素");
+    return;
+  }
 
-      if (!data.success || !data.cases || data.cases.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: #999;">暫無最近個案</td></tr>';
-        return;
-      }
+  if (!cases || cases.length === 0) {
+    tbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: #999;">暫無最近個案</td></tr>';
+    return;
+  }
 
-      tbody.innerHTML = "";
-      data.cases.forEach((c) => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
-          <td>${c.patient_name || '未知'}</td>
-          <td><span class="badge ${getStatusClass(c.status || '未知')}">${c.status || '未知'}</span></td>
-          <td>${formatDate(c.created_at)}</td>
-        `;
-        tbody.appendChild(row);
-      });
-    })
-    .catch((err) => {
-      console.error("載入最近新增個案失敗:", err);
-      const tbody = document.getElementById("recentCasesTable");
-      if (tbody) {
-        tbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: #999;">載入失敗</td></tr>';
-      }
-    });
+  tbody.innerHTML = "";
+  cases.forEach((c) => {
+    const row = document.createElement('tr');
+    row.innerHTML = `
+      <td>${c.patient_name || '未知'}</td>
+      <td><span class="badge ${getStatusClass(c.status || '未知')}">${c.status || '未知'}</span></td>
+      <td>${formatDate(c.created_at)}</td>
+    `;
+    tbody.appendChild(row);
+  });
 }
 
 // 統計數據更新函數
@@ -278,63 +268,31 @@ function formatDate(dateString) {
 }
 
 // 載入待處理提醒
-function loadAlerts() {
-  fetch("/dashboard-data")
-    .then((res) => {
-      if (!res.ok) {
-        throw new Error(`HTTP error! status: ${res.status}`);
-      }
-      return res.json();
-    })
-    .then((data) => {
-      console.log("Alerts data loaded:", data);
-      
-      const alertsList = document.getElementById("alertsList");
-      if (!alertsList) {
-        console.error("找不到提醒列表元素");
-        return;
-      }
+function loadAlerts(data) {
+  const alertsList = document.getElementById("alertsList");
+  if (!alertsList) {
+    console.error("找不到提醒列表元素");
+    return;
+  }
 
-      if (!data.success) {
-        alertsList.innerHTML = '<div class="stat-item"><span class="stat-label">載入失敗</span></div>';
-        return;
-      }
+  // 建立提醒項目
+  const alerts = [];
 
-      // 建立提醒項目
-      const alerts = [];
-      
-      if (data.waiting_cases > 0) {
-        alerts.push({
-          message: "待訪談個案",
-          count: data.waiting_cases
-        });
-      }
-      
-      if (data.monthly_new_cases > 0) {
-        alerts.push({
-          message: "本月新增個案",
-          count: data.monthly_new_cases
-        });
-      }
+  if (data.waiting_cases > 0) {
+    alerts.push({
+      message: "待訪談個案",
+      count: data.waiting_cases
+    });
+  }
 
-      if (alerts.length === 0) {
-        alertsList.innerHTML = '<div class="stat-item"><span class="stat-label">暫無待處理事項</span></div>';
-      } else {
-        alertsList.innerHTML = alerts.map(alert => 
-          `<div class="stat-item">
-            <span class="stat-label">${alert.message}</span>
-            <span class="stat-value">${alert.count}</span>
-          </div>`
-        ).join('');
-      }
-    })
-    .catch((err) => {
-      console.error("載入待處理提醒失敗:", err);
-      const alertsList = document.getElementById("alertsList");
-      if (alertsList) {
-        alertsList.innerHTML = '<div class="stat-item"><span class="stat-label">載入失敗</span></div>';
-      }
+  if (data.monthly_new_cases > 0) {
+    alerts.push({
+      message: "本月新增個案",
+      count: data.monthly_new_cases
     });
+  }
+
+  updateAlerts(alerts);
 }
 
 // ✅ 統一 DOMContentLoaded 初始化區塊
@@ -360,8 +318,5 @@ document.addEventListener("DOMContentLoaded", () => {
     console.warn("缺少必要的 DOM 元素:", missingElements);
   }
 
-  initDashboardData(); // 數值卡片載入
-  initCharts(); // 圖表載入
-  loadRecentCases(); // 最近個案載入
-  loadAlerts(); // 待處理提醒載入
+  loadDashboard(); // 數值卡片、圖表、最近個案、待處理提醒一次載入
 });
\ No newline at end of file
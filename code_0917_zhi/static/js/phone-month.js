@@ -1,3 +1,22 @@
+// 每頁筆數；以游標（keyset）向伺服器取得下一頁
+const PAGE_SIZE = 50;
+// 一次批次更新最多的筆數（同伺服器的 PHONE_STATUS_BATCH_LIMIT）
+const BATCH_LIMIT = 500;
+let pageCursors = [null]; // 各頁第一筆之前的游標
+let pageIndex = 0;
+let nextCursor = null;
+let totalCount = 0;
+let totalEstimated = false;
+let currentQuery = { keyword: "", status_filter: "" };
+let requestSeq = 0;
+// 尚未儲存的狀態變更 {病歷號: {status, reason}}，換頁後仍保留，以批次一次送出
+const pendingChanges = new Map();
+// 名單用到的欄位，只向伺服器取這些欄位
+const LIST_FIELDS = [
+  "medical_record_no", "patient_name", "mobile_phone", "telephone",
+  "assess_date", "phone_status", "phone_reason", "phone_updated_at", "phone_due_date",
+];
+
 document.addEventListener("DOMContentLoaded", () => {
   // 初始化頁面
   initializePage();
@@ -25,8 +44,9 @@ function bindEventListeners() {
   // 全選功能
   document.getElementById("selectAll").addEventListener("change", toggleSelectAll);
 
-  // 狀態篩選
+  // 狀態與應關懷日篩選
   document.getElementById("statusFilter").addEventListener("change", performSearch);
+  document.getElementById("dueFilter").addEventListener("change", performSearch);
 
   // 搜尋框Enter鍵
   document.getElementById("searchInput").addEventListener("keypress", (e) => {
@@ -35,9 +55,28 @@ function bindEventListeners() {
     }
   });
 
+  // 上一頁 / 下一頁
+  document.getElementById("prevBtn").addEventListener("click", () => goToPage(pageIndex - 1));
+  document.getElementById("nextBtn").addEventListener("click", () => goToPage(pageIndex + 1));
+
   // 批量操作按鈕
   document.querySelector(".btn-batch-update").addEventListener("click", showBatchUpdateModal);
   document.querySelector(".btn-export").addEventListener("click", exportToExcel);
+
+  // 狀態 / 原因變更先排入佇列
+  document.getElementById("caseTable").addEventListener("change", (e) => {
+    if (e.target.matches("select.status-select, select.reason-select")) {
+      queueChange(e.target.getAttribute("data-id"));
+    }
+  });
+
+  // 離開頁面前提醒尚未儲存的變更
+  window.addEventListener("beforeunload", (e) => {
+    if (pendingChanges.size > 0) {
+      e.preventDefault();
+      e.returnValue = "";
+    }
+  });
 }
 
 function goHome() {
@@ -48,45 +87,126 @@ function bindSaveButtons() {
   document.querySelectorAll(".save-btn").forEach((btn) => {
     btn.addEventListener("click", () => {
       const id = btn.getAttribute("data-id");
-      const status = document.querySelector(
-        `select[name="status"][data-id="${id}"]`
-      ).value;
-      const reason = document.querySelector(
-        `select[name="reason"][data-id="${id}"]`
-      ).value;
-
-      fetch("/update-phone-status", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ medical_record_no: id, status, reason }),
-      })
-        .then((res) => res.json())
-        .then((data) => {
-          if (data.success) {
-            showNotification("✔️ 儲存成功", "success");
-          } else {
-            showNotification("❌ 儲存失敗：" + (data.message || "未知錯誤"), "error");
-          }
-        })
-        .catch(() => showNotification("⚠️ 系統錯誤，請稍後再試", "error"));
+      saveStatusChanges([{ medical_record_no: id, ...rowStatus(id) }]);
     });
   });
 }
 
+// 畫面上某個案目前選擇的狀態與原因
+function rowStatus(id) {
+  return {
+    status: document.querySelector(`select[name="status"][data-id="${id}"]`).value,
+    reason: document.querySelector(`select[name="reason"][data-id="${id}"]`).value,
+  };
+}
+
+function queueChange(id) {
+  pendingChanges.set(id, rowStatus(id));
+  markPending(id, true);
+  updateBatchButton();
+}
+
+function markPending(id, pending) {
+  const checkbox = document.querySelector(`.case-checkbox[data-id="${id}"]`);
+  if (checkbox) checkbox.closest("tr").classList.toggle("pending-change", pending);
+}
+
+function updateBatchButton() {
+  const label = document.querySelector(".btn-batch-update .pending-count");
+  if (label) label.textContent = pendingChanges.size ? `（${pendingChanges.size}）` : "";
+}
+
+// 以一次批次請求送出多筆狀態變更；成功的項目移出佇列，失敗的保留以便重試
+function saveStatusChanges(items) {
+  return fetch("/update-phone-status-batch", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ items }),
+  })
+    .then((res) => res.json())
+    .then((data) => {
+      if (!data.success) {
+        showNotification("❌ 儲存失敗：" + (data.message || "未知錯誤"), "error");
+        return;
+      }
+      const failed = [];
+      data.results.forEach((result, i) => {
+        const id = items[i].medical_record_no;
+        if (result.success) {
+          pendingChanges.delete(id);
+          markPending(id, false);
+        } else {
+          failed.push(`${id}（${result.message}）`);
+        }
+      });
+      updateBatchButton();
+      if (failed.length === 0) {
+        showNotification(`✔️ 已儲存 ${data.updated} 筆`, "success");
+      } else {
+        showNotification(`已儲存 ${data.updated} 筆，失敗 ${data.failed} 筆：${failed.join("、")}`, "warning");
+      }
+    })
+    .catch(() => showNotification("⚠️ 系統錯誤，請稍後再試", "error"));
+}
+
+// 本地日期 YYYY-MM-DD
+function formatDate(d) {
+  return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, "0")}-${String(d.getDate()).padStart(2, "0")}`;
+}
+
+// 應關懷日篩選對應的期間（含逾期時不限起日）
+function dueWindow(value) {
+  const today = new Date();
+  if (value === "month") {
+    return { due_to: formatDate(new Date(today.getFullYear(), today.getMonth() + 1, 0)) };
+  }
+  if (value === "overdue") {
+    return { due_to: formatDate(new Date(today.getFullYear(), today.getMonth(), today.getDate() - 1)) };
+  }
+  return {};
+}
+
 function performSearch() {
-  const keyword = document.getElementById("searchInput").value.trim();
-  const statusFilter = document.getElementById("statusFilter").value;
+  currentQuery = {
+    keyword: document.getElementById("searchInput").value.trim(),
+    status_filter: document.getElementById("statusFilter").value,
+    ...dueWindow(document.getElementById("dueFilter").value),
+  };
+  pageCursors = [null];
+  loadPage(0);
+}
+
+function goToPage(index) {
+  if (index < 0 || index >= pageCursors.length) return;
+  loadPage(index);
+}
+
+// 伺服器以 fields（欄位名稱）與 rows（值陣列）回傳名單，轉回物件
+function rowsToCases(data) {
+  return (data.rows || []).map((row) => Object.fromEntries(data.fields.map((field, i) => [field, row[i]])));
+}
+
+// 載入第 index 頁（從 0 起算）；第一頁的回應附有統計數字
+function loadPage(index) {
+  const seq = ++requestSeq;
 
   fetch("/phone-month-search", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ keyword, status_filter: statusFilter }),
+    body: JSON.stringify({ ...currentQuery, limit: PAGE_SIZE, cursor: pageCursors[index], fields: LIST_FIELDS }),
   })
     .then((res) => res.json())
     .then((data) => {
+      if (seq !== requestSeq) return; // 已有較新的查詢
       if (data.success) {
-        renderTable(data.data);
-        updateStatistics(calculateStatistics(data.data));
+        pageIndex = index;
+        nextCursor = data.next_cursor;
+        pageCursors = pageCursors.slice(0, index + 1);
+        if (nextCursor) pageCursors.push(nextCursor);
+        totalCount = data.total;
+        totalEstimated = data.total_estimated;
+        renderTable(rowsToCases(data));
+        if (data.stats) updateStatistics(data.stats);
       } else {
         showNotification("查詢失敗：" + (data.message || "未知錯誤"), "error");
       }
@@ -97,6 +217,7 @@ function performSearch() {
 function clearFilters() {
   document.getElementById("searchInput").value = "";
   document.getElementById("statusFilter").value = "";
+  document.getElementById("dueFilter").value = "month";
   loadAllCases();
 }
 
@@ -107,24 +228,6 @@ function updateStatistics(stats) {
   document.getElementById("closedCases").textContent = stats.closed || 0;
 }
 
-function calculateStatistics(cases) {
-  const stats = {
-    total: cases.length,
-    completed: 0,
-    pending: 0,
-    closed: 0
-  };
-
-  cases.forEach(c => {
-    const status = c.phone_status || "未完成";
-    if (status === "已完成") stats.completed++;
-    else if (status === "待完成") stats.pending++;
-    else if (status === "結案") stats.closed++;
-  });
-
-  return stats;
-}
-
 function toggleSelectAll() {
   const selectAll = document.getElementById("selectAll");
   const checkboxes = document.querySelectorAll(".case-checkbox");
@@ -134,15 +237,18 @@ function toggleSelectAll() {
   });
 }
 
+// 批量更新：送出佇列中的變更與勾選個案目前的選擇
 function showBatchUpdateModal() {
-  const selectedCases = getSelectedCases();
-  if (selectedCases.length === 0) {
-    showNotification("請先選擇要更新的個案", "warning");
+  const changes = new Map(pendingChanges);
+  getSelectedCases().forEach((id) => changes.set(id, rowStatus(id)));
+  if (changes.size === 0) {
+    showNotification("請先修改狀態或勾選要更新的個案", "warning");
     return;
   }
-
-  // 這裡可以實作批量更新的彈窗邏輯
-  showNotification(`已選擇 ${selectedCases.length} 個個案進行批量更新`, "info");
+  const items = Array.from(changes, ([id, change]) => ({ medical_record_no: id, ...change }));
+  for (let i = 0; i < items.length; i += BATCH_LIMIT) {
+    saveStatusChanges(items.slice(i, i + BATCH_LIMIT));
+  }
 }
 
 function getSelectedCases() {
@@ -194,17 +300,7 @@ function showNotification(message, type = "info") {
 }
 
 function loadAllCases() {
-  fetch("/phone-month-search", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ keyword: "" }),
-  })
-    .then((res) => res.json())
-    .then((data) => {
-      if (data.success) {
-        renderTable(data.data);
-      }
-    });
+  performSearch();
 }
 
 function renderTable(cases) {
@@ -212,13 +308,18 @@ function renderTable(cases) {
   tableBody.innerHTML = "";
 
   if (!cases || cases.length === 0) {
-    tableBody.innerHTML = `<tr><td colspan="9" style="text-align: center; padding: 40px;">查無資料</td></tr>`;
+    tableBody.innerHTML = `<tr><td colspan="10" style="text-align: center; padding: 40px;">查無資料</td></tr>`;
     updatePaginationInfo(0, 0, 0);
+    updatePaginationButtons();
     return;
   }
 
   cases.forEach((c) => {
+    // 尚未儲存的變更優先顯示
+    const queued = pendingChanges.get(c.medical_record_no);
+    if (queued) c = { ...c, phone_status: queued.status, phone_reason: queued.reason };
     const row = document.createElement("tr");
+    if (queued) row.classList.add("pending-change");
     row.innerHTML = `
       <td>
         <input type="checkbox" class="case-checkbox" data-id="${c.medical_record_no}" />
@@ -250,6 +351,7 @@ function renderTable(cases) {
         </div>
       </td>
       <td>${c.phone_updated_at || '-'}</td>
+      <td class="due-date">${c.phone_due_date || '-'}</td>
       <td>
         <div class="action-buttons">
           <button class="btn-call" data-phone="${c.mobile_phone || c.telephone}" title="撥打電話" ${!c.mobile_phone && !c.telephone ? 'disabled' : ''}>
@@ -269,7 +371,15 @@ function renderTable(cases) {
 
   bindSaveButtons();
   bindCallButtons();
-  updatePaginationInfo(1, cases.length, cases.length);
+  const start = pageIndex * PAGE_SIZE + 1;
+  updatePaginationInfo(start, start + cases.length - 1, (totalEstimated && nextCursor ? "約 " : "") + totalCount);
+  updatePaginationButtons();
+}
+
+function updatePaginationButtons() {
+  document.getElementById("prevBtn").disabled = pageIndex === 0;
+  document.getElementById("nextBtn").disabled = !nextCursor;
+  document.getElementById("pageNumber").textContent = pageIndex + 1;
 }
 
 function bindCallButtons() {
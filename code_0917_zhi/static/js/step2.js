@@ -1,8 +1,11 @@
+// Step2 即時搜索功能（查詢由伺服器處理，每次載入一頁）
 
-// Step2 即時搜索功能
-
+const PAGE_SIZE = 50;
+const LIST_FIELDS = ['medical_record_no', 'patient_name', 'gender', 'birth_date']; // 列表用到的欄位
 let searchTimeout;
 let allCases = [];
+let nextCursor = null;
+let requestSeq = 0;
 
 // 頁面載入時執行
 document.addEventListener('DOMContentLoaded', function() {
@@ -10,21 +13,77 @@ document.addEventListener('DOMContentLoaded', function() {
     setupSearchListeners();
 });
 
-// 載入所有個案資料
+// 目前的查詢條件；cursor 為上一頁最後一筆的游標
+function buildQuery(cursor) {
+    const searchInput = document.querySelector('input[name="keyword"]');
+    const searchField = document.getElementById('search_field');
+    const statusFilter = document.getElementById('status_filter');
+    return {
+        keyword: searchInput ? searchInput.value.trim() : '',
+        search_field: searchField ? searchField.value : '',
+        status: statusFilter ? statusFilter.value : '',
+        limit: PAGE_SIZE,
+        cursor: cursor,
+        fields: LIST_FIELDS
+    };
+}
+
+// 伺服器以 fields（欄位名稱）與 rows（值陣列）回傳列表，轉回物件
+function rowsToCases(data) {
+    return (data.rows || []).map(row => Object.fromEntries(data.fields.map((field, i) => [field, row[i]])));
+}
+
+// 依目前條件重新載入第一頁
 function loadAllCases() {
+    const seq = ++requestSeq;
+    fetch('/step2-search', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(buildQuery(null))
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (seq !== requestSeq) return; // 已有較新的查詢
+        if (data.success) {
+            allCases = rowsToCases(data);
+            nextCursor = data.next_cursor;
+            renderCases(allCases);
+            updateCaseCount(data.total, data.total_estimated);
+            updateLoadMore();
+        } else {
+            showError(data.message || '載入失敗');
+        }
+    })
+    .catch(error => {
+        console.error('載入個案失敗:', error);
+        showError('載入失敗，請重新整理頁面');
+    });
+}
+
+// 載入下一頁並接在目前列表之後
+function loadMoreCases() {
+    if (!nextCursor) return;
+    const seq = ++requestSeq;
+    const button = document.getElementById('loadMoreBtn');
+    if (button) button.disabled = true;
+
     fetch('/step2-search', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ keyword: '' })
+        body: JSON.stringify(buildQuery(nextCursor))
     })
     .then(response => response.json())
     .then(data => {
+        if (seq !== requestSeq) return;
         if (data.success) {
-            allCases = data.data;
+            allCases = allCases.concat(rowsToCases(data));
+            nextCursor = data.next_cursor;
             renderCases(allCases);
-            updateCaseCount(allCases.length);
+            updateCaseCount(data.total, data.total_estimated);
         } else {
             showError(data.message || '載入失敗');
         }
@@ -32,9 +91,21 @@ function loadAllCases() {
     .catch(error => {
         console.error('載入個案失敗:', error);
         showError('載入失敗，請重新整理頁面');
+    })
+    .finally(() => {
+        if (button) button.disabled = false;
+        updateLoadMore();
     });
 }
 
+// 還有下一頁時顯示「載入更多」
+function updateLoadMore() {
+    const button = document.getElementById('loadMoreBtn');
+    if (button) {
+        button.style.display = nextCursor ? 'inline-block' : 'none';
+    }
+}
+
 // 設置搜索監聽器
 function setupSearchListeners() {
     const searchInput = document.querySelector('input[name="keyword"]');
@@ -56,39 +127,24 @@ function setupSearchListeners() {
             performSearch();
         });
     }
-}
 
-// 執行搜索
-function performSearch() {
-    const searchInput = document.querySelector('input[name="keyword"]');
-    const searchField = document.getElementById('search_field');
-    
-    if (!searchInput || !searchField) return;
-    
-    const keyword = searchInput.value.trim();
-    const field = searchField.value;
-    
-    let filteredCases = allCases;
-    
-    if (keyword) {
-        filteredCases = allCases.filter(caseItem => {
-            if (field) {
-                // 指定欄位搜索
-                const fieldValue = caseItem[field] || '';
-                return fieldValue.toString().toLowerCase().includes(keyword.toLowerCase());
-            } else {
-                // 全部欄位搜索
-                const searchableFields = ['medical_record_no', 'patient_name', 'id_document_no'];
-                return searchableFields.some(fieldName => {
-                    const fieldValue = caseItem[fieldName] || '';
-                    return fieldValue.toString().toLowerCase().includes(keyword.toLowerCase());
-                });
-            }
+    const statusFilter = document.getElementById('status_filter');
+    if (statusFilter) {
+        // 進度改變時重新向伺服器取得該進度的個案
+        statusFilter.addEventListener('change', function() {
+            loadAllCases();
         });
     }
-    
-    renderCases(filteredCases);
-    updateCaseCount(filteredCases.length);
+
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    if (loadMoreBtn) {
+        loadMoreBtn.addEventListener('click', loadMoreCases);
+    }
+}
+
+// 執行搜索（關鍵字與欄位由伺服器比對）
+function performSearch() {
+    loadAllCases();
 }
 
 // 渲染個案卡片
@@ -157,11 +213,11 @@ function renderCases(cases) {
     }).join('');
 }
 
-// 更新個案數量顯示
-function updateCaseCount(count) {
+// 更新個案數量顯示；estimated 為 true 時是估計值
+function updateCaseCount(count, estimated) {
     const countElement = document.querySelector('.count-number');
     if (countElement) {
-        countElement.textContent = count;
+        countElement.textContent = (estimated ? '約 ' : '') + count;
     }
 }
 
@@ -187,8 +243,7 @@ function resetSearch() {
     if (searchInput) searchInput.value = '';
     if (searchField) searchField.value = '';
     
-    renderCases(allCases);
-    updateCaseCount(allCases.length);
+    loadAllCases();
 }
 
 // 回首頁
@@ -3,6 +3,8 @@
 
 let searchTimeout;
 let allCases = [];
+// 列表與搜尋用到的欄位，只向伺服器取這些欄位
+const LIST_FIELDS = ['medical_record_no', 'patient_name', 'gender', 'birth_date', 'id_document_no'];
 
 // 頁面載入時執行
 document.addEventListener('DOMContentLoaded', function() {
@@ -17,12 +19,12 @@ function loadAllCases() {
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ keyword: '' })
+        body: JSON.stringify({ keyword: '', fields: LIST_FIELDS })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            allCases = data.data;
+            allCases = rowsToCases(data);
             renderCases(allCases);
             updateCaseCount(allCases.length);
         } else {
@@ -35,6 +37,11 @@ function loadAllCases() {
     });
 }
 
+// 伺服器以 fields（欄位名稱）與 rows（值陣列）回傳列表，轉回物件
+function rowsToCases(data) {
+    return (data.rows || []).map(row => Object.fromEntries(data.fields.map((field, i) => [field, row[i]])));
+}
+
 // 設置搜索監聽器
 function setupSearchListeners() {
     const searchInput = document.getElementById('searchInput');
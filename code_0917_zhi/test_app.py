@@ -1,23 +1,46 @@
 import unittest
 import os
 import tempfile
+import shutil
 import json
+import re
+from unittest import mock
 from app import app
+import domdb
 from domdb import add_new_user, get_db, get_user_by_id
 from tinydb import TinyDB, Query
 import bcrypt
 import hashlib
 
-class AppTestCase(unittest.TestCase):
+class TempDirTestCase(unittest.TestCase):
+    """測試用的臨時目錄；結束時整個目錄（含 .lock、.wal 等附屬檔案）一併刪除"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def open_db(self, name, storage, **kwargs):
+        """以指定儲存層開啟臨時目錄中的資料庫，測試結束時關閉"""
+        db = domdb.DomDB(self.path(name), storage=storage, **kwargs)
+        self.addCleanup(db.close)
+        return db
+
+
+class AppTestCase(TempDirTestCase):
     def setUp(self):
         # 建立臨時資料庫檔案
-        self.db_fd, self.db_path = tempfile.mkstemp()
+        super().setUp()
+        self.db_path = self.path("test.json")
         app.config['TESTING'] = True
         app.config['DB_PATH'] = self.db_path
         os.environ['DB_PATH'] = self.db_path
         
-        # 初始化測試資料庫
-        self.db = TinyDB(self.db_path)
+        # 初始化測試資料庫（與 app 共用 domdb 的資料庫實例）
+        domdb.registry.configure(self.db_path)
+        self.db = get_db()
         self.app = app.test_client()
         
         # 建立測試用戶
@@ -41,16 +64,15 @@ class AppTestCase(unittest.TestCase):
         })
         
     def tearDown(self):
-        # 刪除臨時資料庫
-        os.close(self.db_fd)
-        os.unlink(self.db_path)
+        # 關閉資料庫；臨時目錄由 TempDirTestCase 刪除
+        domdb.registry.close_all()
         
     def test_login_page(self):
         # 測試登入頁面是否可以正常訪問
         response = self.app.get('/')
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'login', response.data.lower())
-        
+
     def test_login_success(self):
         # 測試登入成功
         response = self.app.post('/login', data={
@@ -59,7 +81,7 @@ class AppTestCase(unittest.TestCase):
         }, follow_redirects=True)
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'home', response.data.lower())
-        
+
     def test_login_failed(self):
         # 測試登入失敗
         response = self.app.post('/login', data={
@@ -68,7 +90,7 @@ class AppTestCase(unittest.TestCase):
         })
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'error', response.data.lower())
-        
+
     def test_create_patient(self):
         # 模擬登入狀態
         with self.app as client:
@@ -92,7 +114,7 @@ class AppTestCase(unittest.TestCase):
             patient = patients.get(Query().medical_record_no == 'TEST12345')
             self.assertIsNotNone(patient)
             self.assertEqual(patient['patient_name'], '測試病患')
-    
+
     def test_auto_save_step1(self):
         # 模擬登入狀態
         with self.app as client:
@@ -116,5 +138,696 @@ class AppTestCase(unittest.TestCase):
             self.assertIsNotNone(patient)
             self.assertEqual(patient['patient_name'], '自動儲存測試')
 
+    def test_shared_db_handle(self):
+        # 同一路徑只開啟一次資料庫，資料表存取器共用同一實例
+        self.assertIs(get_db(), get_db(self.db_path))
+        self.assertIs(get_db().table("patients"), self.db.table("patients"))
+
+    def test_patient_index_follows_writes(self):
+        # 索引需隨新增、更新、刪除同步更新
+        from domdb import create_patient, get_patient_by_id, patients
+        create_patient({"medical_record_no": "IDX001", "patient_name": "索引測試"})
+        self.assertEqual(get_patient_by_id("IDX001")["patient_name"], "索引測試")
+        patients.update({"medical_record_no": "IDX002"}, Query().medical_record_no == "IDX001")
+        self.assertIsNone(get_patient_by_id("IDX001"))
+        self.assertIsNotNone(get_patient_by_id("IDX002"))
+        with self.assertRaises(ValueError):
+            patients.insert({"medical_record_no": "IDX002"})
+        patients.remove(Query().medical_record_no == "IDX002")
+        self.assertIsNone(get_patient_by_id("IDX002"))
+
+    def test_reference_seeding_is_idempotent(self):
+        # 參考資料第一次整批匯入，內容未變動時第二次全部略過
+        from domdb_seed import seed_reference_data
+        first = seed_reference_data()
+        self.assertEqual(first["zipcode"], len(self.db.table("zipcode")))
+        self.assertGreater(first["industry_minor_categories"], 0)
+        self.assertEqual(set(seed_reference_data().values()), {0})
+
+    def test_batch_commits_once_or_not_at_all(self):
+        # 批次內跨資料表的寫入只寫檔一次；發生例外則全部捨棄
+        from domdb import batch, patients, phone_followups
+        storage = self.db.storage
+        persisted = []
+        original = storage._persist
+        storage._persist = lambda changes: (persisted.append(len(changes)), original(changes))
+        self.addCleanup(setattr, storage, "_persist", original)
+
+        with batch():
+            patients.insert({"medical_record_no": "B001"})
+            phone_followups.insert({"case_id": "B001"})
+            patients.update({"call_progress": 100}, Query().medical_record_no == "B001")
+        # 第四筆為電話關懷寫入時同步更新的 patients.completion
+        self.assertEqual(persisted, [4])
+
+        with self.assertRaises(RuntimeError):
+            with batch():
+                phone_followups.remove(Query().case_id == "B001")
+                raise RuntimeError("rollback")
+        self.assertEqual(persisted, [4])
+        self.assertEqual(len(phone_followups), 1)
+        self.assertEqual(patients.get(Query().medical_record_no == "B001")["call_progress"], 100)
+
+    def test_dashboard_counters_follow_writes(self):
+        # 首頁計數隨個案、訪談、Step3 的寫入同步更新，並與全表重算一致
+        from domdb import create_patient, dashboard, get_dashboard_counters, interviews, step3_table
+        self.assertEqual(get_dashboard_counters()["total"], 0)
+        create_patient({"medical_record_no": "D001", "patient_name": "甲", "created_at": "2025-03-01T09:00:00"})
+        create_patient({"medical_record_no": "D002", "patient_name": "乙", "created_at": "2025-04-01T09:00:00"})
+        interviews.upsert({"medical_record_no": "D001"}, Query().medical_record_no == "D001")
+        step3_table.insert({"medical_record_no": "D001"})
+        interviews.upsert({"medical_record_no": "D002"}, Query().medical_record_no == "D002")
+
+        counters = get_dashboard_counters()
+        self.assertEqual(counters["status"], {"waiting": 0, "interviewed": 1, "closed": 1})
+        self.assertEqual(counters["monthly_new"], {"2025-03": 1, "2025-04": 1})
+        self.assertEqual([c["patient_name"] for c in counters["recent"]], ["乙", "甲"])
+        self.assertEqual(dashboard.verify(self.db), {})
+
+        step3_table.remove(Query().medical_record_no == "D001")
+        self.assertEqual(get_dashboard_counters()["status"]["interviewed"], 2)
+
+    def test_combined_dashboard(self):
+        # /api/dashboard 一次回傳所有首頁資料，舊端點的數字與其一致
+        from domdb import create_patient, interviews, step3_table
+        create_patient({"medical_record_no": "D001", "patient_name": "甲", "created_at": "2025-03-01T09:00:00"})
+        create_patient({"medical_record_no": "D002", "patient_name": "乙", "created_at": "2025-04-01T09:00:00"})
+        interviews.insert({"medical_record_no": "D001"})
+        interviews.insert({"medical_record_no": "D002"})
+        step3_table.insert({"medical_record_no": "D001"})
+
+        data = self.app.get('/api/dashboard').get_json()
+        self.assertTrue(data["success"])
+        self.assertEqual((data["total_cases"], data["waiting_cases"], data["interviewed_cases"],
+                          data["closed_cases"]), (2, 0, 1, 1))
+        self.assertEqual(data["status"], {"待訪談": 0, "已訪談": 1, "已結案": 1})
+        self.assertEqual(len(data["trend"]), 6)
+        self.assertEqual([(c["patient_name"], c["status"]) for c in data["recent_cases"]],
+                         [("乙", "已訪談"), ("甲", "已結案")])
+
+        legacy = self.app.get('/dashboard-data').get_json()
+        self.assertEqual((legacy["interviewed_cases"], legacy["closed_cases"]), (1, 1))
+        self.assertEqual(self.app.get('/dashboard-recent-cases').get_json()["cases"], data["recent_cases"])
+
+    def test_creation_trend_by_range(self):
+        # created_at 排序索引隨寫入更新，趨勢可依日 / 週 / 月查詢任意期間
+        from domdb import create_patient, patients
+        for i, created in enumerate(["2023-12-31T23:00:00", "2024-01-01T08:00:00", "2024-01-07",
+                                     "2024-01-08T10:00:00", "2024-02-29T12:00:00"]):
+            create_patient({"medical_record_no": f"T{i}", "created_at": created})
+        patients.update({"created_at": "2024-03-01T00:00:00"}, Query().medical_record_no == "T4")
+        self.assertEqual(patients.count_range("created_at", "2024-01-01", "2024-02-01"), 3)
+
+        def trend(query):
+            response = self.app.get(f'/api/dashboard-stats?{query}')
+            return response.status_code, response.get_json()["trend"]
+
+        self.assertEqual(trend("from=2024-01-01&to=2024-03-31&granularity=month"),
+                         (200, {"2024-01": 3, "2024-02": 0, "2024-03": 1}))
+        self.assertEqual(trend("from=2024-01-01&to=2024-01-14&granularity=week"),
+                         (200, {"2024-01-01": 2, "2024-01-08": 1}))
+        self.assertEqual(trend("from=2023-12-31&to=2024-01-01&granularity=day"),
+                         (200, {"2023-12-31": 1, "2024-01-01": 1}))
+        self.assertEqual(trend("granularity=hour")[0], 400)
+        self.assertEqual(len(self.app.get('/api/dashboard-stats').get_json()["trend"]), 6)
+
+    def test_case_status_field(self):
+        # case_status 隨 Step1 / Step2 / Step3 的寫入更新，列表依進度以索引查詢
+        from domdb import backfill_completion, create_patient, get_patient_by_id, interviews, step3_table
+        create_patient({"medical_record_no": "S001", "patient_name": "甲"})
+        create_patient({"medical_record_no": "S002", "patient_name": "乙"})
+        self.assertEqual(get_patient_by_id("S001")["case_status"], "waiting")
+        interviews.upsert({"medical_record_no": "S001"}, Query().medical_record_no == "S001")
+        self.assertEqual(get_patient_by_id("S001")["case_status"], "interviewed")
+        step3_table.insert({"medical_record_no": "S001"})
+        self.assertEqual(get_patient_by_id("S001")["case_status"], "closed")
+        self.assertEqual(backfill_completion(), 0)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            step3 = client.post('/step3-search', json={"keyword": ""}).get_json()["data"]
+            self.assertEqual([c["medical_record_no"] for c in step3], ["S001"])
+            waiting = client.post('/case-query-search', json={"keyword": "S", "status": "待訪談"}).get_json()["data"]
+            self.assertEqual([c["medical_record_no"] for c in waiting], ["S002"])
+            step2 = client.post('/step2-search', json={"keyword": "", "status": "closed"}).get_json()["data"]
+            self.assertEqual([c["medical_record_no"] for c in step2], ["S001"])
+
+    def test_search_patients_ranking(self):
+        # 完全相符 > 開頭相符 > 包含；關鍵字不當作正規表示式
+        from domdb import create_patient, search_patients
+        for record_no, name in [("XA1", "陳一"), ("A12", "林二"), ("A1", "王三"), ("B1", "李四")]:
+            create_patient({"medical_record_no": record_no, "patient_name": name})
+        found = [p["medical_record_no"] for p in search_patients("a1")]
+        self.assertEqual(found, ["A1", "A12", "XA1"])
+        self.assertEqual([p["medical_record_no"] for p in search_patients("王")], ["A1"])
+        self.assertEqual(search_patients(".*"), [])
+        self.assertEqual(search_patients("["), [])
+
+    def test_paged_case_lists(self):
+        # keyset 分頁：依建檔時間由新到舊，游標接續下一頁，錯誤的游標回傳 400
+        from domdb import create_patient
+        for i in range(7):
+            create_patient({"medical_record_no": f"P{i}", "patient_name": "測試",
+                            "created_at": f"2025-01-0{i + 1}T09:00:00"})
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            seen, cursor = [], None
+            while True:
+                body = client.post('/case-query-search', json={"keyword": "", "limit": 3, "cursor": cursor}).get_json()
+                self.assertEqual(body["total"], 7)
+                seen += [c["medical_record_no"] for c in body["data"]]
+                cursor = body["next_cursor"]
+                if cursor is None:
+                    break
+            self.assertEqual(seen, [f"P{i}" for i in range(6, -1, -1)])
+            ranged = client.post('/case-query-search', json={
+                "keyword": "", "limit": 3, "order": "medical_record_no",
+                "date_from": "2025-01-02", "date_to": "2025-01-03"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in ranged["data"]], ["P1", "P2"])
+            response = client.post('/step2-search', json={"keyword": "", "limit": 3, "cursor": "bad"})
+            self.assertEqual(response.status_code, 400)
+            for page in ('/case-query', '/step2', '/phone-month'):
+                self.assertEqual(client.get(page).status_code, 200)
+
+    def test_projected_case_lists(self):
+        # 指定 fields 時以欄位名稱與值陣列回傳，不輸出完整個案資料
+        from domdb import create_patient, page_patients
+        create_patient({"medical_record_no": "F1", "patient_name": "王小明", "phone": "0912"})
+        create_patient({"medical_record_no": "F2", "patient_name": "李小華"})
+        page = page_patients(order="medical_record_no", columns=["medical_record_no", "phone"])
+        self.assertEqual(page.docs, [("F1", "0912"), ("F2", None)])
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            body = client.post('/step2-search', json={
+                "keyword": "小", "limit": 1, "fields": "medical_record_no, patient_name"}).get_json()
+            self.assertNotIn("data", body)
+            self.assertEqual(body["fields"], ["medical_record_no", "patient_name"])
+            self.assertEqual(body["rows"], [["F1", "王小明"]])
+            self.assertIsNotNone(body["next_cursor"])
+            response = client.post('/phone-month-search', json={"keyword": "", "fields": [1]})
+            self.assertEqual(response.status_code, 400)
+
+    def test_admin_export(self):
+        # 匯出合併訪談、電話關懷、復工紀錄；CSV 每列一個個案，JSON Lines 保留所有紀錄
+        import csv
+        import io
+        from domdb import create_patient, interviews
+        create_patient({"medical_record_no": "E1", "patient_name": "王小明", "created_at": "2025-01-01T09:00:00"})
+        create_patient({"medical_record_no": "E2", "patient_name": "李小華", "created_at": "2025-02-01T09:00:00"})
+        interviews.insert({"medical_record_no": "E1", "job_title": "技術員"})
+        domdb.phone_followups.insert({"case_id": "E1", "note": "第一次", "items": ["a", "b"]})
+        domdb.phone_followups.insert({"case_id": "E1", "note": "第二次"})
+        domdb.return_to_work_records.insert({"case_id": "E2", "status": "已復工"})
+        with self.app as client:
+            self.assertEqual(client.get('/admin/export').status_code, 401)
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            response = client.get('/admin/export?format=csv')
+            self.assertEqual(response.status_code, 200)
+            rows = list(csv.DictReader(io.StringIO(response.data.decode("utf-8-sig"))))
+            self.assertEqual([r["medical_record_no"] for r in rows], ["E1", "E2"])
+            self.assertEqual(rows[0]["interview.job_title"], "技術員")
+            self.assertEqual(rows[0]["phone_followup_count"], "2")
+            self.assertEqual(rows[0]["phone_followup.note"], "第二次")
+            self.assertEqual(rows[1]["return_to_work.status"], "已復工")
+            response = client.get('/admin/export?format=jsonl&from=2025-01-01&to=2025-01-31')
+            lines = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+            self.assertEqual(len(lines), 1)
+            self.assertEqual([r.get("items") for r in lines[0]["phone_followups"]], [["a", "b"], None])
+            self.assertEqual(client.get('/admin/export?format=xml').status_code, 400)
+
+    def test_case_aggregate_cache(self):
+        # 個案彙整資料由快取讀取，相關資料表寫入後只移除受影響的個案
+        from domdb import case_cache, create_patient, get_case_aggregate, interviews, step3_table
+        create_patient({"medical_record_no": "C1", "patient_name": "甲", "mobile_phone": "0911"})
+        create_patient({"medical_record_no": "C2", "patient_name": "乙"})
+        self.assertIsNone(get_case_aggregate("C1").interview)
+        get_case_aggregate("C2")
+        hits = case_cache.hits
+        aggregate = get_case_aggregate("C1")
+        self.assertEqual(case_cache.hits, hits + 1)
+        aggregate.patient["patient_name"] = "改"  # 回傳複本，不影響快取
+        self.assertEqual(get_case_aggregate("C1").patient["patient_name"], "甲")
+
+        interviews.insert({"medical_record_no": "C1", "mobile_phone": "0922"})
+        domdb.phone_followups.insert({"case_id": "C1"})
+        domdb.service_records.insert({"case_id": "C1"})
+        aggregate = get_case_aggregate("C1")
+        self.assertEqual(aggregate.merged()["mobile_phone"], "0922")
+        self.assertEqual(aggregate.progress, {"interview_progress": 50, "call_progress": 25,
+                                              "service_progress": 25, "return_progress": 0})
+        hits = case_cache.hits
+        get_case_aggregate("C2")
+        self.assertEqual(case_cache.hits, hits + 1)
+        step3_table.insert({"medical_record_no": "C1"})
+        self.assertEqual(get_case_aggregate("C1").progress["interview_progress"], 75)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            self.assertIn("0922", client.get('/step3/C1').data.decode("utf-8"))
+            self.assertEqual(client.get('/step3/C2').status_code, 400)
+            self.assertEqual(client.get('/case-detail/C1').status_code, 200)
+
+    def test_progress_many(self):
+        # 一次計算整頁個案的進度，與逐筆計算一致；列表可一併回傳進度
+        from domdb import create_patient, interviews, step3_table
+        from progress_utils import calculate_interview_progress, calculate_progress_many
+        for no in ("G1", "G2", "G3"):
+            create_patient({"medical_record_no": no, "created_at": f"2025-01-0{no[1]}"})
+        interviews.insert({"medical_record_no": "G1"})
+        step3_table.insert({"medical_record_no": "G1"})
+        interviews.insert({"medical_record_no": "G2"})
+        for _ in range(5):
+            domdb.phone_followups.insert({"case_id": "G2"})
+        domdb.return_to_work_records.insert({"case_id": "G3"})
+        progress = calculate_progress_many(["G1", "G2", "G3", "NONE"])
+        self.assertEqual([progress[no]["interview_progress"] for no in ("G1", "G2", "G3", "NONE")], [75, 50, 25, 0])
+        self.assertEqual((progress["G2"]["call_progress"], progress["G3"]["return_progress"]), (100, 25))
+        self.assertEqual(calculate_interview_progress("G2"), 50)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            data = client.post('/case-query-search', json={"keyword": "", "with_progress": True,
+                                                            "fields": "medical_record_no"}).get_json()
+            self.assertEqual(data["progress"]["G1"], progress["G1"])
+            self.assertEqual(set(data["progress"]), {"G1", "G2", "G3"})
+
+    def test_completion_mask(self):
+        # 各資料表寫入時同步更新 completion，依遮罩查詢待辦個案
+        from domdb import COMPLETION_BITS, backfill_completion, create_patient, get_patient_by_id, interviews
+        from progress_utils import calculate_interview_progress
+        for no in ("K1", "K2", "K3"):
+            create_patient({"medical_record_no": no})
+        interviews.insert({"medical_record_no": "K1"})
+        interviews.insert({"medical_record_no": "K2"})
+        domdb.phone_followups.insert({"case_id": "K2"})
+        domdb.adl_iadl_table.insert({"case_id": "K3"})
+        bits = COMPLETION_BITS
+        self.assertEqual(get_patient_by_id("K2")["completion"], bits["step1"] | bits["step2"] | bits["call"])
+        self.assertEqual(get_patient_by_id("K3")["completion"], bits["step1"] | bits["adl"])
+        self.assertEqual(calculate_interview_progress("K1"), 50)
+        domdb.phone_followups.remove(Query().case_id == "K2")
+        self.assertEqual(get_patient_by_id("K2")["completion"], bits["step1"] | bits["step2"])
+        domdb.phone_followups.insert({"case_id": "K1"})
+        self.assertEqual(backfill_completion(), 0)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            data = client.get('/api/case-worklist?done=step2&missing=call&fields=medical_record_no').get_json()
+            self.assertEqual((data["rows"], data["total"]), ([["K2"]], 1))
+            data = client.get('/api/case-worklist?missing=step2').get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["K3"])
+            self.assertEqual(client.get('/api/case-worklist?done=step9').status_code, 400)
+
+    def test_followup_schedule(self):
+        # 應關懷日隨建檔日、電話關懷紀錄與狀態更新，依應關懷日期間查詢
+        from domdb import backfill_phone_schedule, create_patient, get_patient_by_id
+        create_patient({"medical_record_no": "D1", "created_at": "2024-01-31T09:00:00", "phone_status": "待完成"})
+        create_patient({"medical_record_no": "D2", "created_at": "2024-03-05T09:00:00", "phone_status": "待完成"})
+        create_patient({"medical_record_no": "D3", "created_at": "2024-02-10T09:00:00"})
+        self.assertEqual(get_patient_by_id("D1")["phone_due_date"], "2024-02-29")
+        domdb.phone_followups.insert({"case_id": "D1", "created_at": "2024-04-02T10:00:00"})
+        self.assertEqual(get_patient_by_id("D1")["phone_due_date"], "2024-05-02")
+        create_patient({"medical_record_no": "D3", "phone_status": "結案"})
+        self.assertIsNone(get_patient_by_id("D3")["phone_due_date"])
+        self.assertEqual(backfill_phone_schedule(), 0)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            data = client.post('/phone-month-search', json={"due_to": "2024-04-30"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["D2"])
+            self.assertEqual(data["stats"]["total"], 1)
+            data = client.post('/phone-month-search', json={"due_from": "2024-04-01"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["D2", "D1"])
+            page = client.get('/phone-pending').get_data(as_text=True)
+            self.assertIn("2024-05-02", page)
+            self.assertNotIn("D3", page)
+            with mock.patch("app.PAGE_SIZE", 1):
+                page = client.get('/phone-pending').get_data(as_text=True)
+                self.assertIn("D2", page)
+                self.assertNotIn("D1", page)
+                cursor = re.search(r'href="/phone-pending\?cursor=([^"]+)"', page).group(1)
+                page = client.get('/phone-pending?cursor=' + cursor).get_data(as_text=True)
+                self.assertIn("D1", page)
+                self.assertNotIn("cursor=", page)
+
+    def test_read_paths_do_not_backfill(self):
+        # 舊資料（沒有衍生欄位）的查詢逐筆計算，不寫入；回填後結果相同
+        from domdb import backfill_completion, backfill_phone_schedule, get_patients_by_completion, \
+            get_patients_by_status, page_patients
+        domdb.registry.close_all()
+        with open(self.db_path, "w", encoding="utf-8") as f:
+            json.dump({"patients": {"1": {"medical_record_no": "L1", "created_at": "2024-01-10T09:00:00"},
+                                    "2": {"medical_record_no": "L2", "created_at": "2024-02-10T09:00:00"}},
+                       "interviews": {"1": {"medical_record_no": "L1"}}}, f)
+        domdb.registry.configure(self.db_path)
+
+        def query():
+            return ([p["medical_record_no"] for p in get_patients_by_status(["interviewed"])],
+                    [p["medical_record_no"] for p in get_patients_by_completion(done=2)],
+                    [p["medical_record_no"] for p in page_patients(statuses=["waiting"]).docs],
+                    [p["medical_record_no"] for p in page_patients(order="phone_due_date",
+                                                                   due_range=("2024-03-01", None)).docs])
+
+        self.assertEqual(query(), (["L1"], ["L1"], ["L2"], ["L2"]))
+        self.assertTrue(all("case_status" not in p and "phone_due_date" not in p for p in domdb.patients.all()))
+        self.assertEqual(backfill_completion(), 2)
+        backfill_phone_schedule()
+        self.assertTrue(all("case_status" in p and "phone_due_date" in p for p in domdb.patients.all()))
+        self.assertEqual(query(), (["L1"], ["L1"], ["L2"], ["L2"]))
+
+    def test_first_request_backfills(self):
+        # 以 create_app() 啟動（例如 gunicorn）時，由每個行程的第一個請求回填衍生欄位
+        domdb.registry.close_all()
+        with open(self.db_path, "w", encoding="utf-8") as f:
+            json.dump({"patients": {"1": {"medical_record_no": "B1", "created_at": "2024-01-10T09:00:00"}}}, f)
+        domdb.registry.configure(self.db_path)
+        self.assertNotIn("case_status", domdb.patients.all()[0])
+        self.app.get('/')
+        self.assertTrue(all("case_status" in p and "phone_due_date" in p for p in domdb.patients.all()))
+
+    def test_phone_status_batch_update(self):
+        # 批次更新電話關懷狀態：符合的個案一次寫檔，逐筆回報結果
+        from domdb import create_patient, get_patient_by_id
+        for no in ("S1", "S2"):
+            create_patient({"medical_record_no": no, "created_at": "2024-01-01T09:00:00"})
+        storage = self.db.storage
+        persisted = []
+        original = storage._persist
+        storage._persist = lambda changes: (persisted.append(len(changes)), original(changes))
+        self.addCleanup(setattr, storage, "_persist", original)
+
+        items = [{"medical_record_no": "S1", "status": "已完成", "reason": "完畢"},
+                 {"medical_record_no": "NOPE", "status": "已完成"},
+                 {"medical_record_no": "S2", "status": "結案", "reason": "復工"},
+                 {"status": "已完成"}]
+        with self.app as client:
+            self.assertEqual(client.post('/update-phone-status-batch', json={"items": items}).status_code, 401)
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            data = client.post('/update-phone-status-batch', json={"items": items}).get_json()
+            self.assertEqual((data["updated"], data["failed"]), (2, 2))
+            self.assertEqual([r["success"] for r in data["results"]], [True, False, True, False])
+            self.assertEqual(len(persisted), 1)
+            self.assertEqual(client.post('/update-phone-status-batch', json={"items": []}).status_code, 400)
+        self.assertEqual(get_patient_by_id("S1")["phone_reason"], "完畢")
+        self.assertIsNone(get_patient_by_id("S2")["phone_due_date"])  # 結案後不再排程
+
+    def test_phone_status_due_index(self):
+        # 電話關懷月報依狀態篩選時由 phone_status + phone_due_date 複合索引依應關懷日取得，與逐筆篩選一致
+        from domdb import create_patient, page_patients, update_phone_statuses
+        for no, created, status in (("W1", "2024-03-01", "待完成"), ("W2", "2024-01-15", "待完成"),
+                                    ("W3", "2024-02-10", "待完成"), ("W4", "2024-01-20", "結案"),
+                                    ("W0", "2024-01-01", "已完成"), ("W5", None, "待完成")):
+            create_patient({"medical_record_no": no, "created_at": created, "phone_status": status})
+
+        def numbers(page):
+            return [c["medical_record_no"] for c in page.docs]
+
+        scanned = page_patients(order="phone_due_date", doc_filter=lambda doc: doc.get("phone_status") == "待完成")
+        self.assertEqual(numbers(page_patients(order="phone_due_date", phone_status="待完成")), numbers(scanned))
+        self.assertEqual(numbers(scanned), ["W5", "W2", "W3", "W1"])
+        first = page_patients(1, order="phone_due_date", phone_status="待完成", due_range=(None, "2024-03-31"))
+        self.assertEqual((numbers(first), first.total, first.total_estimated), (["W2"], 2, False))
+        second = page_patients(1, first.next_cursor, order="phone_due_date", phone_status="待完成",
+                               due_range=(None, "2024-03-31"))
+        self.assertEqual((numbers(second), second.next_cursor), (["W3"], None))
+        update_phone_statuses([{"medical_record_no": "W3", "status": "已完成"}])
+        self.assertEqual(numbers(page_patients(order="phone_due_date", phone_status="待完成")), ["W5", "W2", "W1"])
+        # phone_status 沒有另建雜湊索引，等值查詢與計數也由複合索引取得
+        self.assertIsNotNone(domdb.patients.candidate_ids(Query().phone_status == "待完成"))
+        self.assertEqual([doc["medical_record_no"] for doc in domdb.patients.search(Query().phone_status == "待完成")],
+                         ["W1", "W2", "W5"])
+        self.assertEqual(domdb.patients.count(Query().phone_status == "已完成"), 2)
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            data = client.post('/phone-month-search', json={"status_filter": "待完成", "due_to": "2024-03-30"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["W2"])
+            self.assertEqual((data["stats"]["total"], data["stats"]["pending"]), (1, 1))
+            data = client.post('/phone-month-search', json={"due_to": "2024-03-30"}).get_json()
+            self.assertEqual((data["stats"]["total"], data["stats"]["completed"]), (3, 2))
+            # 待完成頁面的搜尋與頁面列出相同的個案與順序，標為已完成（W0、W3）或結案（W4）的個案不列出
+            data = client.post('/phone-pending-search', json={"keyword": "W"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["W2", "W1"])
+            update_phone_statuses([{"medical_record_no": "W2", "status": "已完成"}])
+            data = client.post('/phone-pending-search', json={"keyword": "W"}).get_json()
+            self.assertEqual([c["medical_record_no"] for c in data["data"]], ["W1"])
+            page = client.get('/phone-pending').get_data(as_text=True)
+            self.assertEqual([no for no in ("W0", "W1", "W2", "W3", "W4", "W5") if no in page], ["W1"])
+
+    def test_bulk_patient_import(self):
+        # CSV 批次匯入：正規化欄位、逐列回報錯誤，中途失敗後以同一檔案從提交的進度繼續
+        import io
+        from domdb import create_patient, get_patient_by_id
+        from domdb_import import import_patients
+        create_patient({"medical_record_no": "00000001", "patient_name": "舊姓名", "created_at": "2024-01-01"})
+        content = "\n".join([
+            "病歷號,姓名,出生日期,性別,身分證號,備註",
+            "00000001,王小明,69/1/2,男,a123456789,x",
+            "00000002,李小華,1985/03/04,F,A123456788,",
+            "ABC,陳,1990-01-01,男,,",
+            "00000003,張三,19900101,2,,",
+            "00000004,李四,2100-01-01,3,,",
+        ]).encode("utf-8-sig")
+
+        storage = self.db.table("patients")
+        original = storage.upsert_by
+        calls = []
+
+        def failing_upsert(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("disk full")
+            return original(*args, **kwargs)
+
+        storage.upsert_by = failing_upsert
+        with self.assertRaises(RuntimeError):
+            import_patients(io.BytesIO(content), "partner.csv", chunk_size=2)
+        del storage.upsert_by
+        self.assertEqual(get_patient_by_id("00000001")["patient_name"], "王小明")  # 第一批已提交
+
+        report = import_patients(io.BytesIO(content), "partner.csv", chunk_size=2)
+        self.assertEqual((report["rows"], report["skipped"], report["imported"]), (5, 2, 2))
+        self.assertEqual((report["inserted"], report["updated"]), (1, 1))
+        self.assertEqual([(e["row"], e["errors"][0].split(":")[0]) for e in report["errors"]],
+                         [(3, "id_document_no"), (4, "medical_record_no"), (6, "birth_date")])
+        self.assertEqual(report["ignored_columns"], ["備註"])
+        first = get_patient_by_id("00000001")
+        self.assertEqual((first["patient_name"], first["birth_date"], first["gender"], first["id_document_no"],
+                          first["id_document_type"], first["created_at"]),
+                         ("王小明", "1980-01-02", "1", "A123456789", "1", "2024-01-01"))
+        self.assertEqual(get_patient_by_id("00000003")["gender"], "2")
+        self.assertEqual(import_patients(io.BytesIO(content))["status"], "already_done")
+
+        with self.app as client:
+            with client.session_transaction() as session:
+                session['staff_id'] = 'test001'
+            response = client.post('/admin/import-patients', data={
+                "file": (io.BytesIO("姓名\n王\n".encode()), "bad.csv")})
+            self.assertEqual(response.status_code, 400)
+            response = client.post('/admin/import-patients', data={
+                "file": (io.BytesIO("medical_record_no,gender\n00000005,女\n".encode("cp950")), "big5.csv")})
+            self.assertEqual((response.get_json()["inserted"], get_patient_by_id("00000005")["gender"]), (1, "2"))
+
+    def test_create_app(self):
+        # 工廠每次建立獨立的應用程式，路由都掛在 main blueprint 上
+        from app import create_app
+        other = create_app({"TESTING": True, "MAIL_USERNAME": "factory@example.com"})
+        self.assertIsNot(other, app)
+        self.assertEqual(other.config["MAIL_USERNAME"], "factory@example.com")
+        self.assertEqual(other.test_client().get('/').status_code, 200)
+        with other.test_request_context():
+            from flask import url_for
+            self.assertEqual(url_for("main.home"), "/home")
+
+
+class SQLiteBackendTestCase(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db_path = self.path("test.sqlite3")
+        domdb.registry.configure(self.db_path, "sqlite")
+
+    def tearDown(self):
+        domdb.registry.close_all()
+        domdb.registry.configure(domdb.DB_PATH, domdb.DB_BACKEND)
+
+    def test_helpers_on_sqlite(self):
+        # domdb 的函式在 SQLite 後端維持相同行為，資料寫入 documents 資料表
+        from domdb import create_patient, get_patient_by_id
+        success, _ = create_patient({"medical_record_no": "SQL001", "patient_name": "測試"})
+        self.assertTrue(success)
+        create_patient({"medical_record_no": "SQL001", "patient_name": "更新"})
+        self.assertEqual(get_patient_by_id("SQL001")["patient_name"], "更新")
+
+        domdb.registry.close_all()
+        self.assertEqual(get_patient_by_id("SQL001")["patient_name"], "更新")
+        self.assertEqual(len(domdb.patients), 1)
+
+    def test_interrupted_write_releases_lock(self):
+        # 交易中被 KeyboardInterrupt 中斷時仍會 ROLLBACK，其他連線可以繼續寫入
+        from domdb_storage import SQLiteStorage
+        first = self.open_db("test.sqlite3", SQLiteStorage)
+        second = self.open_db("test.sqlite3", SQLiteStorage)
+        second.storage._conn.execute("PRAGMA busy_timeout=100")
+        with self.assertRaises(KeyboardInterrupt):
+            with first.storage.write_lock():
+                first.table("patients").insert({"medical_record_no": "SQL010"})
+                raise KeyboardInterrupt
+        self.assertEqual(first.storage._tx_depth, 0)
+        second.table("patients").insert({"medical_record_no": "SQL011"})
+        self.assertEqual([doc["medical_record_no"] for doc in first.table("patients").all()], ["SQL011"])
+
+    def test_sql_indexes(self):
+        # 索引欄位的查詢、分頁與文字搜尋由 SQLite 的索引處理；其他連線的寫入直接可見，
+        # 只有被異動的資料表 generation 改變
+        from domdb_storage import SQLiteStorage
+        db = self.open_db("test.sqlite3", SQLiteStorage, indexes=domdb.TABLE_INDEXES)
+        other = self.open_db("test.sqlite3", SQLiteStorage, indexes=domdb.TABLE_INDEXES)
+        patients = db.table("patients")
+        patients.insert_multiple([
+            {"medical_record_no": "SQL000", "patient_name": "王小明", "created_at": "2024-03-01"},
+            {"medical_record_no": "SQL001", "patient_name": "王大明", "created_at": "2024-01-01"},
+            {"medical_record_no": "SQL002", "patient_name": "李小華"},
+        ])
+        plan = db.storage._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT doc_id FROM documents WHERE tbl = 'patients'"
+            " AND json_extract(body, '$.medical_record_no') = ?", ("SQL001",)).fetchall()
+        self.assertIn("documents_patients_medical_record_no", str(plan))
+        self.assertEqual(patients.get(Query().medical_record_no == "SQL001")["patient_name"], "王大明")
+
+        columns = ("medical_record_no",)
+        docs, after, _ = patients.page("created_at", 2, columns=columns)
+        self.assertEqual(docs, [("SQL002",), ("SQL001",)])
+        self.assertEqual(patients.page("created_at", 2, after=after, columns=columns)[0], [("SQL000",)])
+        docs, _, _ = patients.page("created_at", 3, descending=True, columns=columns)
+        self.assertEqual(docs, [("SQL000",), ("SQL001",), ("SQL002",)])
+        self.assertEqual(patients.count_range("created_at", "2024-02-01"), 1)
+
+        fields = domdb.PATIENT_TEXT_FIELDS
+        self.assertEqual(patients.search_text(fields, "小", columns), [("SQL000",), ("SQL002",)])
+        other.table("patients").insert({"medical_record_no": "SQL003", "patient_name": "小王"})
+        self.assertEqual(patients.search_text(fields, "王", columns), [("SQL000",), ("SQL001",), ("SQL003",)])
+        self.assertEqual(patients.search_text(fields, "小王", columns), [("SQL003",)])
+
+        generation = db.storage.table_generation("patients")
+        other.table("options").insert({"type": "gender", "value": "男"})
+        self.assertEqual(len(db.table("options")), 1)
+        self.assertEqual(db.storage.table_generation("patients"), generation)
+
+
+class WALStorageTestCase(TempDirTestCase):
+    def test_replay_and_compaction(self):
+        # 未正常關閉時由日誌重播；關閉時壓實回快照
+        from domdb_storage import WALJSONStorage
+        path = self.path("wal.json")
+
+        db = domdb.DomDB(path, storage=WALJSONStorage)
+        patients = db.table("patients")
+        patients.insert({"medical_record_no": "WAL001", "patient_name": "甲"})
+        patients.update({"patient_name": "乙"}, Query().medical_record_no == "WAL001")
+        self.assertGreater(os.path.getsize(path + ".wal"), 0)
+
+        replayed = domdb.DomDB(path, storage=WALJSONStorage)
+        self.assertEqual(replayed.table("patients").get(Query().medical_record_no == "WAL001")["patient_name"], "乙")
+        replayed.close()
+
+        self.assertEqual(os.path.getsize(path + ".wal"), 0)
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["patients"]["1"]["patient_name"], "乙")
+
+    def test_reset_removes_side_files(self):
+        # init_db.py --reset 連同 WAL 日誌與鎖檔一併刪除，重新開啟後是空的資料庫
+        path = self.path("reset.json")
+        domdb.registry.configure(path, "wal")
+        self.addCleanup(domdb.registry.configure, domdb.DB_PATH, domdb.DB_BACKEND)
+        self.addCleanup(domdb.registry.close_all)
+        domdb.get_db().table("patients").insert({"medical_record_no": "R001"})
+        self.assertTrue(os.path.exists(path + ".wal"))
+
+        domdb.reset_db()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertEqual(len(domdb.get_db().table("patients")), 0)
+
+
+class TableFilesStorageTestCase(TempDirTestCase):
+    def test_split_and_reference_tables(self):
+        # 既有的 domdb.json 自動拆分；寫入個案只改寫 patients.json，參考資料表唯讀
+        from domdb_storage import TableFilesStorage
+        with open(self.path("split.json"), "w", encoding="utf-8") as f:
+            json.dump({"zipcode": {"1": {"zip": "100"}}, "patients": {}}, f)
+
+        db = self.open_db("split.json", TableFilesStorage, reference_tables=("zipcode",))
+        directory = db.storage.directory
+        zipcode_file = os.path.join(directory, "zipcode.json")
+        zipcode_stat = os.stat(zipcode_file)
+
+        db.table("patients").insert({"medical_record_no": "S001"})
+        with open(os.path.join(directory, "patients.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["1"]["medical_record_no"], "S001")
+        self.assertEqual(os.stat(zipcode_file).st_ino, zipcode_stat.st_ino)
+
+        with self.assertRaises(PermissionError):
+            db.table("zipcode").insert({"zip": "200"})
+        with db.storage.reference_writes():
+            db.table("zipcode").insert({"zip": "200"})
+        self.assertEqual(len(db.table("zipcode")), 2)
+
+    def test_reset_removes_tables_directory(self):
+        # init_db.py --reset 刪除整個 .tables 目錄與原本的 domdb.json，重新開啟後是空的資料庫
+        path = self.path("reset.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"patients": {"1": {"medical_record_no": "R001"}}}, f)
+        domdb.registry.configure(path, "tables")
+        self.addCleanup(domdb.registry.configure, domdb.DB_PATH, domdb.DB_BACKEND)
+        self.addCleanup(domdb.registry.close_all)
+        self.assertEqual(len(domdb.get_db().table("patients")), 1)
+
+        domdb.reset_db()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertEqual(len(domdb.get_db().table("patients")), 0)
+
+
+class JSONCodecTestCase(unittest.TestCase):
+    def test_fast_codec_keeps_chinese(self):
+        from domdb_storage import JSONCodec
+        doc = {"patient_name": "王小明", "big": 2 ** 70}
+        fast = JSONCodec("fast").dumps(doc)
+        self.assertIn("王小明".encode("utf-8"), fast)
+        self.assertNotIn(b" ", fast)
+        self.assertIn(b"\\u738b", JSONCodec("stdlib").dumps(doc))
+        # 兩種格式互相可讀
+        self.assertEqual(JSONCodec("fast").loads(JSONCodec("stdlib").dumps(doc)), doc)
+        self.assertEqual(JSONCodec("stdlib").loads(fast), doc)
+
+
+class SharedFileTestCase(TempDirTestCase):
+    def test_instances_see_each_others_writes(self):
+        # 模擬兩個工作行程各自開啟同一個資料庫檔案
+        from domdb_storage import CachedJSONStorage, TableFilesStorage, WALJSONStorage
+        for name, storage in (("json", CachedJSONStorage), ("wal", WALJSONStorage),
+                              ("tables", TableFilesStorage)):
+            first = self.open_db(f"{name}.json", storage)
+            second = self.open_db(f"{name}.json", storage)
+            first.table("patients").insert({"medical_record_no": "A001"})
+            second.table("patients").insert({"medical_record_no": "B001"})
+            first.table("patients").update({"patient_name": "甲"}, Query().medical_record_no == "B001")
+
+            for db in (first, second):
+                table = db.table("patients")
+                self.assertEqual(len(table), 2)
+                self.assertEqual(table.get(Query().medical_record_no == "B001")["patient_name"], "甲")
+            with self.assertRaises(ValueError):
+                second.table("patients").insert({"medical_record_no": "A001"})
+
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file